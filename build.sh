@@ -115,7 +115,8 @@ if [ "${goto_end:-false}" != "true" ]; then
 
   # Install packages in the build directory
   echo "Installing dependencies for Python 2.7..."
-  $pip2 install -q --target "$PWD" "dataplicity==${VERSION}" --pre
+  # The asyncio engine modules are Python 3 only, so don't byte-compile
+  $pip2 install -q --no-compile --target "$PWD" "dataplicity==${VERSION}" --pre
   $pip2 install -q --target "$PWD" -r ../requirements-py2.txt
 
   # Create a launcher script
@@ -0,0 +1,113 @@
+"""Manages M2M connections with the asyncio engine (Python 3.7+)."""
+
+import asyncio
+import logging
+
+from .constants import SERVER_BUSY
+from .limiter import LimitReached
+from .m2m import aioservices
+from .m2m.aioclient import AsyncWSClient
+from .m2mmanager import M2MManager
+
+log = logging.getLogger("m2m")
+
+
+class AsyncM2MManager(M2MManager):
+    """Manages M2M services, which run as coroutines on the client's event loop."""
+
+    client_class = AsyncWSClient
+
+    def _launch(self, limiter, channel, coroutine, busy_message=SERVER_BUSY):
+        """Run a service coroutine, return False if the limit was reached."""
+        try:
+            limiter.increment()
+        except LimitReached as error:
+            coroutine.close()
+            log.warning("unable to launch service on %r; %s", channel, error)
+            channel.write(busy_message)
+            channel.close()
+            return False
+        self.m2m_client.start_task(self._run_service(limiter, coroutine))
+        return True
+
+    async def _run_service(self, limiter, coroutine):
+        try:
+            await coroutine
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("error running service")
+        finally:
+            limiter.decrement()
+
+    def sync(self):
+        """Sync with the server, without blocking the event loop."""
+        self.m2m_client.loop.run_in_executor(None, self.client.sync)
+
+    def open_terminal(self, name, port, size=None):
+        """Open a new terminal."""
+        terminal = self.get_terminal(name)
+        if terminal is None:
+            log.warning("no terminal called '%s'", name)
+            return
+        terminal._prune_closed()
+        channel = self.m2m_client.get_channel(port)
+        # Keep terminals responsive while other channels are busy
+        channel.set_service("terminal")
+        process = aioservices.AsyncRemoteProcess(
+            terminal.command,
+            channel,
+            user=terminal.user,
+            group=terminal.group,
+            size=size or [80, 24],
+        )
+        if self._launch(
+            self.terminals_limiter,
+            channel,
+            process.run(),
+            busy_message=b"Failed to launch remote process\n",
+        ):
+            log.info("launched remote process %r over %r", terminal, channel)
+            terminal.processes.append(process)
+
+    def open_echo_service(self, port):
+        """Open an echo service (ping)."""
+        log.debug("opening echo service on m2m port %s", port)
+        channel = self.m2m_client.get_channel(port)
+        self.m2m_client.start_task(aioservices.run_echo(channel))
+
+    def open_portforward(self, service, route):
+        """Open a port forward service."""
+        log.debug("opening service %s on %r", service, route)
+        _node1, _port1, _node2, m2m_port = route
+        service = self.client.port_forward.get_service(service)
+        if service is None:
+            return
+        self._open_connection(m2m_port, service.host_port)
+
+    def open_portredirect(self, m2m_port, device_port):
+        """Forward a channel to a port on the device."""
+        self._open_connection(m2m_port, ("127.0.0.1", device_port))
+
+    def _open_connection(self, m2m_port, host_port):
+        channel = self.m2m_client.get_channel(m2m_port)
+        channel.set_service("portforward")
+        self._launch(
+            self.services_limiter,
+            channel,
+            aioservices.run_portforward(channel, host_port),
+        )
+
+    def open_file_service(self, port, path):
+        """Open a file service, to send a file over a port."""
+        channel = self.m2m_client.get_channel(port)
+        channel.set_service("file")
+        self._launch(self.services_limiter, channel, aioservices.run_file(channel, path))
+
+    def open_command_service(self, port, command):
+        """Open a service that runs a command and sends the stdout over m2m."""
+        channel = self.m2m_client.get_channel(port)
+        channel.set_service("command")
+        self._launch(
+            self.services_limiter, channel, aioservices.run_command(channel, command)
+        )
@@ -9,7 +9,7 @@ import sys
 from . import __version__
 from . import subcommand
 from .client import Client
-from .subcommands import run, version
+from .subcommands import compression, loadtest, run, version
 
 log = logging.getLogger("app")
 
@@ -163,6 +163,8 @@ class App(object):
             serial=self.args.serial,
             auth_token=self.args.auth_token,
             remote_directory_path=self.args.remote_directory,
+            # Only the run sub-command selects an engine
+            engine=getattr(self.args, "engine", None),
         )
         return client
 
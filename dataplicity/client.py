@@ -35,6 +35,7 @@ class Client(object):
         serial=None,  # type: str
         auth_token=None,  # type: str
         remote_directory_path=None,  # type: str
+        engine=None,  # type: str
     ):
         # type: (...) -> None
         self.rpc_url = rpc_url or constants.SERVER_URL
@@ -46,6 +47,7 @@ class Client(object):
         self.auth_token = auth_token
         self.serial = serial
         self.remote_directory_path = remote_directory_path
+        self.engine = engine or constants.M2M_ENGINE
 
         self._sync_lock = Lock()
         self._sent_meta = False
@@ -89,7 +91,8 @@ class Client(object):
             self.remote_directory = RemoteDirectory(
                 self.remote_directory_path, self.directory_scanner
             )
-            self.m2m = M2MManager.init(
+            log.info("engine=%s", self.engine)
+            self.m2m = self._get_manager_class().init(
                 self, self.remote_directory, m2m_url=self.m2m_url
             )
             self.port_forward = PortForwardManager.init(self)
@@ -98,6 +101,18 @@ class Client(object):
             log.exception("failed to initialize client")
             raise
 
+    def _get_manager_class(self):
+        """Get the M2M manager class for the engine."""
+        if self.engine == "asyncio":
+            if sys.version_info < (3, 7):
+                raise ValueError("the asyncio engine requires Python 3.7 or later")
+            from .aiomanager import AsyncM2MManager
+
+            return AsyncM2MManager
+        if self.engine != "threads":
+            raise ValueError("unknown engine '{}'".format(self.engine))
+        return M2MManager
+
     def run_forever(self):
         """Run the client "forever"."""
         clock_check_thread = ClockCheckThread()
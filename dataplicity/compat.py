@@ -25,6 +25,7 @@ if PY2:
     number_types = (int, long, float)
     next_method_name = "next"
     raw_input = raw_input
+    buffer_types = (str, bytearray, memoryview)
 else:
     text_type = str
     binary_type = bytes
@@ -36,6 +37,7 @@ else:
     number_types = (int, float)
     next_method_name = "__next__"
     raw_input = input
+    buffer_types = (bytes, bytearray, memoryview)
 
 # Use these functions for iterating over keys / values / items
 if PY2:
@@ -68,6 +70,48 @@ else:
     from inspect import getfullargspec
 
 
+# selectors is new in Python 3.4
+if PY2:
+    import selectors2 as selectors
+else:
+    import selectors
+
+
+# time.monotonic is new in Python 3.3
+if PY2:
+
+    def _get_monotonic():
+        """Get clock_gettime(CLOCK_MONOTONIC), or time.time if unavailable."""
+        import ctypes
+        import ctypes.util
+        import os
+        import time
+
+        class timespec(ctypes.Structure):
+            _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            clock_gettime = libc.clock_gettime
+        except (OSError, AttributeError):
+            return time.time
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        CLOCK_MONOTONIC = 1
+
+        def monotonic():
+            t = timespec()
+            if clock_gettime(CLOCK_MONOTONIC, ctypes.pointer(t)) != 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno))
+            return t.tv_sec + t.tv_nsec * 1e-9
+
+        return monotonic
+
+    monotonic = _get_monotonic()
+else:
+    from time import monotonic
+
+
 # pickle is the C version on PY3
 if PY2:
     import cPickle as pickle
@@ -24,7 +24,7 @@ def get_environ_int(name, default):
 CONF_PATH = "/etc/dataplicity/dataplicity.conf"
 SERVER_URL = environ.get("DATAPLICITY_API_URL", "https://api.dataplicity.com")
 M2M_URL = environ.get("DATAPLICITY_M2M_URL", "wss://m2m.dataplicity.com/m2m/")
-M2M_FEATURES = {"scan", "downloads"}
+M2M_FEATURES = {"scan", "downloads", "batch"}
 SERIAL_LOCATION = "/opt/dataplicity/tuxtunnel/serial"
 AUTH_LOCATION = "/opt/dataplicity/tuxtunnel/auth"
 REMOTE_DIRECTORY_LOCATION = "/home/dataplicity/remote"
@@ -33,10 +33,89 @@ REMOTE_DIRECTORY_LOCATION = "/home/dataplicity/remote"
 # Client will reconnect if the server hasn't responded in this time
 MAX_TIME_SINCE_LAST_PACKET = 100.0  # seconds or None
 
-# Number of bytes to read at a time, when copying date over the network
-# TODO: Replace this with a sensible chunk size once we identify the
-# issue with ssh over Porthole
-CHUNK_SIZE = 1024 * 1024
+# Reconnects are retried after a random wait, up to a limit that starts at the
+# base wait and doubles with each failure, up to a maximum (seconds)
+M2M_RECONNECT_BASE_WAIT = get_environ_int("DATAPLICITY_M2M_RECONNECT_BASE_WAIT", 1)
+M2M_RECONNECT_MAX_WAIT = get_environ_int("DATAPLICITY_M2M_RECONNECT_MAX_WAIT", 60)
+
+# Maximum size of packets combined in to one websocket message, when the
+# server supports batches (0 to disable)
+M2M_MAX_BATCH_SIZE = get_environ_int("DATAPLICITY_M2M_MAX_BATCH_SIZE", 64 * 1024)
+
+# Seconds to wait for the response to a command, before giving up
+M2M_COMMAND_TIMEOUT = get_environ_int("DATAPLICITY_M2M_COMMAND_TIMEOUT", 60)
+
+# Seconds between pings sent to the m2m server
+M2M_PING_INTERVAL = get_environ_int("DATAPLICITY_M2M_PING_INTERVAL", 30)
+
+# Seconds between writing m2m statistics to the debug log (0 to disable)
+M2M_STATS_INTERVAL = get_environ_int("DATAPLICITY_M2M_STATS_INTERVAL", 300)
+
+# Limits applied when decoding packets from the m2m server
+M2M_MAX_PACKET_SIZE = get_environ_int(
+    "DATAPLICITY_M2M_MAX_PACKET_SIZE", 16 * 1024 * 1024
+)
+M2M_MAX_PACKET_DEPTH = 32
+M2M_MAX_PACKET_ELEMENTS = 10000
+
+# Small writes to a channel within this many microseconds are sent together
+# (0 to disable), up to a size in bytes, and delayed no longer than a maximum
+M2M_COALESCE_WINDOW_US = get_environ_int("DATAPLICITY_M2M_COALESCE_WINDOW_US", 2000)
+M2M_COALESCE_BYTES = get_environ_int("DATAPLICITY_M2M_COALESCE_BYTES", 16 * 1024)
+M2M_COALESCE_MAX_DELAY_US = get_environ_int(
+    "DATAPLICITY_M2M_COALESCE_MAX_DELAY_US", 10000
+)
+
+# Maximum size of a request_send packet, larger writes are split so that
+# higher priority packets aren't held up
+M2M_MAX_SEND_PACKET_SIZE = get_environ_int(
+    "DATAPLICITY_M2M_MAX_SEND_PACKET_SIZE", 16 * 1024
+)
+# Maximum number of bytes written to the websocket at once
+M2M_MAX_WRITE_SIZE = get_environ_int("DATAPLICITY_M2M_MAX_WRITE_SIZE", 64 * 1024)
+
+# Share of bandwidth for each type of service, relative to other channels of
+# the same priority
+M2M_CHANNEL_WEIGHTS = {
+    "terminal": get_environ_int("DATAPLICITY_M2M_WEIGHT_TERMINAL", 1),
+    "portforward": get_environ_int("DATAPLICITY_M2M_WEIGHT_PORTFORWARD", 1),
+    "file": get_environ_int("DATAPLICITY_M2M_WEIGHT_FILE", 1),
+    "command": get_environ_int("DATAPLICITY_M2M_WEIGHT_COMMAND", 1),
+}
+
+# Engine that runs the m2m client and services; "threads" (a thread per
+# service), or "asyncio" (coroutines on a single event loop, Python 3.7+)
+M2M_ENGINE = environ.get("DATAPLICITY_M2M_ENGINE", "threads")
+
+# Websocket compression profile (see m2m/deflate.py); "default", "low-memory",
+# "minimal", or "off"
+M2M_COMPRESSION_PROFILE = environ.get("DATAPLICITY_M2M_COMPRESSION_PROFILE", "default")
+
+# Compression mode for each type of service; "always", "never", or "auto" to
+# skip compressing data that doesn't compress well
+M2M_CHANNEL_COMPRESSION = {
+    "terminal": environ.get("DATAPLICITY_M2M_COMPRESS_TERMINAL", "always"),
+    "portforward": environ.get("DATAPLICITY_M2M_COMPRESS_PORTFORWARD", "auto"),
+    "file": environ.get("DATAPLICITY_M2M_COMPRESS_FILE", "auto"),
+    "command": environ.get("DATAPLICITY_M2M_COMPRESS_COMMAND", "always"),
+}
+
+# Channels pause when they have this many bytes buffered, and resume when
+# there are fewer than the low watermark
+M2M_CHANNEL_HIGH_WATERMARK = get_environ_int(
+    "DATAPLICITY_M2M_CHANNEL_HIGH_WATERMARK", 1024 * 1024
+)
+M2M_CHANNEL_LOW_WATERMARK = get_environ_int(
+    "DATAPLICITY_M2M_CHANNEL_LOW_WATERMARK", 256 * 1024
+)
+
+# Limits of the number of bytes services read at a time, sized for each
+# channel to what it can send within a target latency (milliseconds)
+M2M_CHUNK_MIN_SIZE = get_environ_int("DATAPLICITY_M2M_CHUNK_MIN_SIZE", 4 * 1024)
+M2M_CHUNK_MAX_SIZE = get_environ_int("DATAPLICITY_M2M_CHUNK_MAX_SIZE", 1024 * 1024)
+M2M_CHUNK_TARGET_LATENCY_MS = get_environ_int(
+    "DATAPLICITY_M2M_CHUNK_TARGET_LATENCY_MS", 100
+)
 
 # Maximum number of services (port forward/commands/file etc)
 LIMIT_SERVICES = get_environ_int("DATAPLICITY_LIMIT_SERVICES", 500)
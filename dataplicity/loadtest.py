@@ -0,0 +1,399 @@
+"""
+End-to-end load test.
+
+Runs the agent in a separate process, connected to a local stand-in m2m
+server, and drives concurrent terminals, port forwards, file reads and
+commands over it. Reports throughput and latency for each, along with the
+CPU and memory used by the agent process.
+
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from six.moves import socketserver
+
+from .m2m.deflate import get_rss
+from .m2m.standin import StandInServer
+from .m2m.stats import RollingHistogram
+
+
+log = logging.getLogger("loadtest")
+
+# Bounds of the latency histograms (seconds)
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0]
+
+
+class WorkloadStats(object):
+    """Stats for one kind of workload."""
+
+    def __init__(self, name):
+        self.name = name
+        self.operations = 0
+        self.errors = 0
+        self.bytes = 0
+        self.latency = RollingHistogram(LATENCY_BUCKETS, size=None)
+        self.start_time = None
+        self.end_time = None
+        self._lock = threading.Lock()
+
+    def add(self, start, latency, size=0):
+        """Record an operation that started at `start` and has just completed."""
+        end = time.time()
+        self.latency.add(latency)
+        with self._lock:
+            self.operations += 1
+            self.bytes += size
+            self.start_time = min(start, self.start_time or start)
+            self.end_time = max(end, self.end_time or end)
+
+    def on_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def to_dict(self):
+        elapsed = 0.0
+        if self.start_time is not None:
+            elapsed = self.end_time - self.start_time
+        return {
+            "operations": self.operations,
+            "errors": self.errors,
+            "bytes": self.bytes,
+            # Bytes per second while this workload was running
+            "throughput": self.bytes / elapsed if elapsed else 0.0,
+            "latency": {
+                "p50": self.latency.get_percentile(50),
+                "p95": self.latency.get_percentile(95),
+                "p99": self.latency.get_percentile(99),
+                "max": self.latency.get_percentile(100),
+            },
+        }
+
+
+class AgentProcess(object):
+    """Runs the agent in a subprocess."""
+
+    def __init__(self, m2m_url, remote_directory, engine="threads"):
+        # The api url is unreachable, so api calls fail quickly
+        self.command = [
+            sys.executable,
+            "-m",
+            "dataplicity",
+            "--quiet",
+            "--server-url",
+            "http://127.0.0.1:9/",
+            "--m2m-url",
+            m2m_url,
+            "--serial",
+            "loadtest",
+            "--auth",
+            "loadtest",
+            "--remote-dir",
+            remote_directory,
+            "run",
+            "--engine",
+            engine,
+        ]
+        self.process = None
+        self.max_rss = None
+        self.max_threads = None
+
+    def start(self):
+        self.process = subprocess.Popen(self.command)
+
+    def get_cpu_time(self):
+        """Get CPU time (user + system) used by the agent, or None if not known."""
+        try:
+            with open("/proc/{}/stat".format(self.process.pid), "rb") as stat:
+                # Skip the command, which may contain spaces
+                fields = stat.read().rsplit(b")", 1)[1].split()
+        except (IOError, OSError):
+            return None
+        ticks = int(fields[11]) + int(fields[12])
+        return ticks / os.sysconf(str("SC_CLK_TCK"))
+
+    def get_rss(self):
+        """Get resident memory, and update max_rss."""
+        rss = get_rss(self.process.pid)
+        if rss is not None:
+            self.max_rss = max(self.max_rss or 0, rss)
+        return rss
+
+    def get_threads(self):
+        """Get the number of threads, and update max_threads."""
+        try:
+            with open("/proc/{}/status".format(self.process.pid), "rb") as status:
+                for line in status:
+                    if line.startswith(b"Threads:"):
+                        threads = int(line.split()[1])
+                        break
+                else:
+                    return None
+        except (IOError, OSError, ValueError):
+            return None
+        self.max_threads = max(self.max_threads or 0, threads)
+        return threads
+
+    def stop(self):
+        if self.process is None or self.process.poll() is not None:
+            return
+        self.process.terminate()
+        for _ in range(50):
+            if self.process.poll() is not None:
+                return
+            time.sleep(0.1)
+        self.process.kill()
+        self.process.wait()
+
+
+class _DataHandler(socketserver.StreamRequestHandler):
+    """Sends the number of bytes requested with a line "GET <bytes>"."""
+
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            size = int(line.split()[1])
+        except (IndexError, ValueError):
+            return
+        chunk = b"x" * 16384
+        while size > 0:
+            self.wfile.write(chunk[:size])
+            size -= len(chunk)
+
+
+class _DataServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    # Connections may arrive all at once
+    request_queue_size = 1024
+
+
+class LoadTest(object):
+    """Drive concurrent work through an agent connected to a stand-in server.
+
+    Args:
+        terminals (int): Number of terminals.
+        portforwards (int): Number of port forward connections.
+        files (int): Number of file reads.
+        commands (int): Number of command runs.
+        round_trips (int): Commands typed in to each terminal.
+        size (int): Bytes sent by each port forward, file and command.
+        timeout (float): Maximum time for each operation.
+        engine (str): Agent engine, "threads" or "asyncio".
+
+    """
+
+    def __init__(
+        self,
+        terminals=4,
+        portforwards=4,
+        files=4,
+        commands=4,
+        round_trips=50,
+        size=1024 * 1024,
+        timeout=60.0,
+        engine="threads",
+    ):
+        self.terminals = terminals
+        self.portforwards = portforwards
+        self.files = files
+        self.commands = commands
+        self.round_trips = round_trips
+        self.size = size
+        self.timeout = timeout
+        self.engine = engine
+        self.stats = {
+            name: WorkloadStats(name)
+            for name in ("terminal", "portforward", "file", "command")
+        }
+
+    def _run_terminal(self, connection):
+        stats = self.stats["terminal"]
+        channel = connection.open_channel()
+        connection.send_instruction(
+            action="open-terminal", port=channel.port, name="shell", size=[80, 24]
+        )
+        # Wait for the shell to start, then set a prompt we can recognize and
+        # wait for it before each command, as a user would. The expanded
+        # prompt and command output don't appear in the echoed input.
+        if not channel.wait_data(self.timeout):
+            stats.on_error()
+            channel.close()
+            return
+        channel.write(b"PS1='$((40+2))> '\n")
+        prompt = b"42> "
+        for round_trip in range(self.round_trips):
+            if not channel.wait_for(prompt, timeout=self.timeout):
+                stats.on_error()
+                break
+            start = time.time()
+            channel.write(b"echo $((100000+%d))\n" % round_trip)
+            if not channel.wait_for(b"%d\r\n" % (100000 + round_trip), self.timeout):
+                stats.on_error()
+                break
+            stats.add(start, time.time() - start)
+        # Close from the server end, as when a user closes the terminal
+        channel.close()
+
+    def _run_transfer(self, connection, name, port_key, **instruction):
+        """Run a service that sends data and closes the channel."""
+        stats = self.stats[name]
+        channel = connection.open_channel()
+        instruction[port_key] = channel.port
+        start = time.time()
+        connection.send_instruction(**instruction)
+        if name == "portforward":
+            channel.write(b"GET %d\n" % self.size)
+        if not channel.wait_closed(self.timeout) or channel.first_data_time is None:
+            stats.on_error()
+            channel.close()
+            return
+        stats.add(start, channel.first_data_time - start, channel.bytes_received)
+
+    def run(self):
+        """Run the load test, return a dict of results."""
+        temp_dir = tempfile.mkdtemp(prefix="dataplicity-loadtest-")
+        data_server = _DataServer(("127.0.0.1", 0), _DataHandler)
+        data_thread = threading.Thread(target=data_server.serve_forever)
+        data_thread.daemon = True
+        data_thread.start()
+        path = os.path.join(temp_dir, "data")
+        with open(path, "wb") as data_file:
+            data_file.write(b"x" * self.size)
+        command = "head -c {} /dev/zero".format(self.size)
+        try:
+            with StandInServer() as server:
+                agent = AgentProcess(server.url, temp_dir, engine=self.engine)
+                agent.start()
+                try:
+                    connection = server.wait_welcome(self.timeout)
+                    if connection is None:
+                        raise RuntimeError("agent did not connect")
+                    workers = []
+                    for _ in range(self.terminals):
+                        workers.append((self._run_terminal, (connection,), {}))
+                    for _ in range(self.portforwards):
+                        workers.append(
+                            (
+                                self._run_transfer,
+                                (connection, "portforward", "m2m_port"),
+                                {
+                                    "action": "open-portredirect",
+                                    "device_port": data_server.server_address[1],
+                                },
+                            )
+                        )
+                    for _ in range(self.files):
+                        workers.append(
+                            (
+                                self._run_transfer,
+                                (connection, "file", "port"),
+                                {"action": "read-file", "path": path},
+                            )
+                        )
+                    for _ in range(self.commands):
+                        workers.append(
+                            (
+                                self._run_transfer,
+                                (connection, "command", "port"),
+                                {"action": "run-command", "command": command},
+                            )
+                        )
+                    return self._run_workers(agent, workers)
+                finally:
+                    agent.stop()
+        finally:
+            data_server.shutdown()
+            data_server.server_close()
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def _run_workers(self, agent, workers):
+        threads = [
+            threading.Thread(target=target, args=args, kwargs=kwargs)
+            for target, args, kwargs in workers
+        ]
+        for thread in threads:
+            thread.daemon = True
+        start_cpu = agent.get_cpu_time()
+        start_rss = agent.get_rss()
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            while thread.is_alive():
+                agent.get_rss()
+                agent.get_threads()
+                thread.join(0.1)
+        elapsed = time.time() - start
+        end_cpu = agent.get_cpu_time()
+        cpu = None
+        if start_cpu is not None and end_cpu is not None:
+            cpu = end_cpu - start_cpu
+        return {
+            "elapsed": elapsed,
+            "agent": {
+                "engine": self.engine,
+                "cpu": cpu,
+                "cpu_percent": cpu * 100.0 / elapsed if cpu is not None else None,
+                "start_rss": start_rss,
+                "max_rss": agent.max_rss,
+                "max_threads": agent.max_threads,
+            },
+            "workloads": {
+                name: stats.to_dict() for name, stats in self.stats.items()
+            },
+        }
+
+
+def format_results(results):
+    """Format load test results as text."""
+
+    def format_ms(value):
+        return "-" if value is None else "{:.1f}ms".format(value * 1000.0)
+
+    def format_bytes(value):
+        return "-" if value is None else "{:.1f}MB".format(value / (1024.0 * 1024.0))
+
+    agent = results["agent"]
+    lines = [
+        "elapsed {:.2f}s".format(results["elapsed"]),
+        "agent ({} engine) cpu {} ({}), rss {} (start {}), threads {}".format(
+            agent["engine"],
+            "-" if agent["cpu"] is None else "{:.2f}s".format(agent["cpu"]),
+            "-"
+            if agent["cpu_percent"] is None
+            else "{:.0f}%".format(agent["cpu_percent"]),
+            format_bytes(agent["max_rss"]),
+            format_bytes(agent["start_rss"]),
+            "-" if agent["max_threads"] is None else agent["max_threads"],
+        ),
+        "{:<12} {:>6} {:>6} {:>10} {:>10} {:>9} {:>9} {:>9} {:>9}".format(
+            "workload", "ops", "errors", "bytes", "per sec", "p50", "p95", "p99", "max"
+        ),
+    ]
+    for name, workload in sorted(results["workloads"].items()):
+        latency = workload["latency"]
+        lines.append(
+            "{:<12} {:>6} {:>6} {:>10} {:>10} {:>9} {:>9} {:>9} {:>9}".format(
+                name,
+                workload["operations"],
+                workload["errors"],
+                format_bytes(workload["bytes"]),
+                format_bytes(workload["throughput"]),
+                format_ms(latency["p50"]),
+                format_ms(latency["p95"]),
+                format_ms(latency["p99"]),
+                format_ms(latency["max"]),
+            )
+        )
+    return "\n".join(lines)
@@ -0,0 +1,457 @@
+"""
+An asyncio engine for the m2m client.
+
+The websocket is read and written by coroutines on a single event loop,
+rather than by threads, and channels are exposed as asyncio streams so
+services may run as coroutines rather than a thread each. Packet handling
+is shared with WSClient, so both engines are wire compatible.
+
+Requires Python 3.7 or later. HTTP proxies are not supported.
+
+"""
+
+import asyncio
+import json
+import logging
+import ssl
+import threading
+import time
+
+from lomond import events
+from lomond.errors import WebSocketClosed, WebSocketError, WebSocketUnavailable
+from lomond.frame import Frame
+
+from .. import constants
+from .sendqueue import SendQueue
+from .wsclient import WSClient
+
+
+log = logging.getLogger("m2m")
+
+
+class _AsyncSession(object):
+    """Drives a lomond WebSocket over an asyncio transport.
+
+    Takes the place of lomond's WebsocketSession, which does blocking IO.
+
+    """
+
+    def __init__(self, websocket, transport):
+        self.websocket = websocket
+        self.transport = transport
+        self.ready = asyncio.Event()
+        self._start_time = time.time()
+
+    def __repr__(self):
+        return "<async-ws-session '{}'>".format(self.websocket.url)
+
+    @property
+    def session_time(self):
+        """Get the time (in seconds) since the session started."""
+        return time.time() - self._start_time
+
+    def on_ready(self):
+        self.ready.set()
+
+    def write(self, data):
+        """Send raw data, without blocking."""
+        if self.transport.is_closing():
+            raise WebSocketUnavailable("not connected")
+        if self.websocket.is_closed:
+            raise WebSocketClosed("data not sent")
+        self.transport.write(data)
+
+    def send(self, opcode, data):
+        """Send a websocket frame."""
+        self.write(Frame(opcode, payload=bytearray(data)).to_bytes())
+
+    def send_compressed(self, opcode, data):
+        """Send a compressed websocket frame."""
+        self.write(Frame(opcode, payload=bytearray(data), rsv1=1).to_bytes())
+
+    def close(self):
+        self.transport.close()
+
+    def force_disconnect(self):
+        self.transport.abort()
+
+
+class AsyncChannel(asyncio.Transport):
+    """A channel, as an asyncio transport.
+
+    Data from the channel is read from `reader`, and written with `writer`
+    (an asyncio StreamReader and StreamWriter). The writer pauses while the
+    remote end has paused the channel, or there is more than
+    `high_watermark` bytes of unsent data, so producers should await
+    `writer.drain()` after writing. The reader asks the remote end to pause
+    once it has buffered `high_watermark` bytes.
+
+    """
+
+    def __init__(
+        self,
+        client,
+        number,
+        high_watermark=constants.M2M_CHANNEL_HIGH_WATERMARK,
+        low_watermark=constants.M2M_CHANNEL_LOW_WATERMARK,
+    ):
+        super(AsyncChannel, self).__init__()
+        self.client = client
+        self.number = number
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self._closed = False
+        self._closing = False
+        self._reading = True
+        self._remote_paused = False
+        self._writing_paused = False
+        self._control_callback = None
+        # The reader pauses when it has more than twice its limit buffered
+        self.reader = asyncio.StreamReader(limit=max(1, high_watermark // 2))
+        self._protocol = asyncio.StreamReaderProtocol(self.reader)
+        self._protocol.connection_made(self)
+        self.writer = asyncio.StreamWriter(
+            self, self._protocol, self.reader, client.loop
+        )
+
+    def __repr__(self):
+        return "<async channel {}>".format(self.number)
+
+    @property
+    def is_closed(self):
+        return self._closed
+
+    def set_control_callback(self, on_control):
+        """Set a callable to receive control data (other than flow control)."""
+        self._control_callback = on_control
+
+    def on_data(self, data):
+        """On incoming data."""
+        if self._closed:
+            log.debug("%s bytes from closed %r ignored", len(data), self)
+            return
+        self._protocol.data_received(data)
+
+    def on_control(self, data):
+        """On control data."""
+        if self._closed:
+            log.debug("%s bytes from closed %r ignored", len(data), self)
+            return
+        try:
+            control_type = json.loads(data).get("type")
+        except Exception:
+            control_type = None
+        if control_type == "pause":
+            log.debug("%r paused by remote", self)
+            self._remote_paused = True
+            self.update_writing()
+        elif control_type == "resume":
+            log.debug("%r resumed by remote", self)
+            self._remote_paused = False
+            self.update_writing()
+        elif self._control_callback is not None:
+            self._control_callback(data)
+
+    def on_close(self):
+        """Called when the notify_close packet is received."""
+        if self._closed:
+            return
+        self._closed = True
+        self._closing = True
+        self.client.paused_channels.discard(self)
+        # Feeds EOF to the reader, and wakes anything waiting to drain
+        self._protocol.connection_lost(None)
+
+    def update_writing(self):
+        """Pause or resume the writer, according to the unsent data."""
+        if self._closed:
+            return
+        unsent = self.client.send_queue.get_channel_size(self.number)
+        if self._writing_paused:
+            if not self._remote_paused and unsent <= self.low_watermark:
+                self._writing_paused = False
+                self.client.paused_channels.discard(self)
+                self._protocol.resume_writing()
+        elif self._remote_paused or unsent >= self.high_watermark:
+            self._writing_paused = True
+            self.client.paused_channels.add(self)
+            self._protocol.pause_writing()
+
+    def set_service(self, service):
+        """Configure the channel for a type of service, e.g. "terminal"."""
+        self.client.set_channel_service(self.number, service)
+
+    def get_chunk_size(self):
+        """Get the number of bytes a service should read at a time, to write
+        to this channel."""
+        return self.client.get_chunk_size(self.number)
+
+    def send_control(self, control):
+        """Write a control packet."""
+        if not self._closed:
+            self.client.channel_control_write(self.number, control)
+
+    # Transport interface
+
+    def write(self, data):
+        if self._closing:
+            return
+        self.client.channel_write(self.number, data)
+        if not self._writing_paused:
+            self.update_writing()
+
+    def can_write_eof(self):
+        return False
+
+    def get_write_buffer_size(self):
+        return self.client.send_queue.get_channel_size(self.number)
+
+    def is_closing(self):
+        return self._closing
+
+    def close(self):
+        """Request a close, once unsent data has been sent."""
+        if not self._closing:
+            self._closing = True
+            self.client.close_channel(self.number)
+
+    def abort(self):
+        self.close()
+
+    def is_reading(self):
+        return self._reading
+
+    def pause_reading(self):
+        if self._reading and not self._closed:
+            self._reading = False
+            log.debug("%r buffered data, pausing", self)
+            self.send_control({"type": "pause"})
+
+    def resume_reading(self):
+        if not self._reading and not self._closed:
+            self._reading = True
+            log.debug("%r resuming", self)
+            self.send_control({"type": "resume"})
+
+
+class AsyncWSClient(WSClient):
+    """Interface to the M2M server, running on an asyncio event loop.
+
+    The thread runs the event loop, which reads and writes the websocket and
+    runs services started with `start_task`.
+
+    """
+
+    # Bytes read from the websocket at a time
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncWSClient, self).__init__(*args, **kwargs)
+        # Writes are coalesced by the event loop, rather than by the queue
+        self.send_queue = SendQueue(
+            max_packet_size=constants.M2M_MAX_SEND_PACKET_SIZE
+        )
+        self.loop = None
+        self.paused_channels = set()
+        self._loop_thread_id = None
+        self._send_event = None
+        self._closed_event = None
+        self._tasks = set()
+
+    def __repr__(self):
+        return "AsyncWSClient({!r})".format(self.url)
+
+    def get_channel(self, channel_no):
+        if channel_no not in self.channels:
+            self.channels[channel_no] = AsyncChannel(self, channel_no)
+        return self.channels[channel_no]
+
+    def start_task(self, coroutine):
+        """Run a coroutine on the event loop, from any thread."""
+        if threading.get_ident() != self._loop_thread_id:
+            return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        task = self.loop.create_task(coroutine)
+        # The loop only keeps weak references to tasks
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def run(self):
+        """Run the event loop until the client is closed."""
+        try:
+            asyncio.run(self.run_async())
+        except (SystemExit, KeyboardInterrupt):
+            log.info("exit requested")
+        except Exception:
+            log.exception("unhandled error from websocket")
+        self.send_queue.close()
+
+    async def run_async(self):
+        """Connect, and reconnect, until closed."""
+        self.loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._send_event = asyncio.Event()
+        self._closed_event = asyncio.Event()
+        if self._closed:
+            return
+        try:
+            while not self._closed:
+                await self.connect()
+                if self._closed:
+                    break
+                wait = self.backoff.get_wait()
+                log.debug("reconnecting in %.1f seconds", wait)
+                try:
+                    await asyncio.wait_for(self._closed_event.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in list(self._tasks):
+                task.cancel()
+
+    async def connect(self):
+        """Connect the websocket, and handle events until it disconnects."""
+        websocket = self.websocket
+        websocket.reset()
+        ssl_context = ssl.create_default_context() if websocket.is_secure else None
+        log.debug("connecting to %s", websocket.url)
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(
+                    websocket.host, websocket.port, ssl=ssl_context
+                ),
+                30,
+            )
+        except (OSError, asyncio.TimeoutError) as error:
+            log.debug("unable to connect to %s; %r", websocket.url, error)
+            return
+        session = _AsyncSession(websocket, writer.transport)
+        websocket.state.session = session
+        tasks = [
+            self.loop.create_task(self._write_queued(session, writer)),
+            self.loop.create_task(self._poll(session)),
+        ]
+        try:
+            session.write(websocket.build_request())
+            while not websocket.is_closed:
+                data = await reader.read(self.READ_SIZE)
+                if not data:
+                    break
+                for event in websocket.feed(data):
+                    if event.name == "ready":
+                        session.on_ready()
+                    elif event.name == "ping":
+                        self._send_pong(event.data)
+                    self._on_event(event)
+        except (OSError, WebSocketError) as error:
+            log.debug("websocket error; %r", error)
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+            websocket.on_disconnect()
+            self._on_event(events.Disconnected())
+
+    def _on_event(self, event):
+        log.debug("WS %r", event)
+        try:
+            self.on_event(event)
+        except Exception:
+            log.exception("error handling websocket event")
+
+    def force_disconnect(self, reason):
+        """Drop the connection, so that the client reconnects."""
+        log.debug("disconnecting; %s", reason)
+        self.websocket.force_disconnect()
+
+    def _send_pong(self, data):
+        try:
+            self.websocket.send_pong(data)
+        except WebSocketError:
+            pass
+
+    async def _poll(self, session):
+        """Generate poll events, and send websocket pings."""
+        await session.ready.wait()
+        last_ping = time.time()
+        while True:
+            await asyncio.sleep(5)
+            self._on_event(events.Poll())
+            if time.time() - last_ping >= 30:
+                last_ping = time.time()
+                try:
+                    self.websocket.send_ping()
+                except WebSocketError:
+                    pass
+
+    async def _write_queued(self, session, writer):
+        """Write packets from the send queue, until cancelled."""
+        send_queue = self.send_queue
+        chunk_sizer = self.chunk_sizer
+        await session.ready.wait()
+        while True:
+            await self._send_event.wait()
+            self._send_event.clear()
+            while True:
+                packets = send_queue.get_packets(
+                    max_bytes=constants.M2M_MAX_WRITE_SIZE, timeout=0
+                )
+                if not packets:
+                    break
+                now = time.time()
+                for channel, packet_bytes in packets:
+                    if channel is not None:
+                        chunk_sizer.on_sent(
+                            channel,
+                            len(packet_bytes),
+                            bool(send_queue.get_channel_size(channel)),
+                            now,
+                        )
+                try:
+                    self.write_packets(packets)
+                except Exception:
+                    log.exception("error writing packets")
+                for channel in list(self.paused_channels):
+                    channel.update_writing()
+                await writer.drain()
+
+    def _wake_writer(self):
+        if self._send_event is None:
+            return
+        if threading.get_ident() == self._loop_thread_id:
+            self._send_event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._send_event.set)
+
+    def send_bytes(self, packet_bytes, channel=None):
+        """Queue bytes to be sent over the websocket, without blocking."""
+        queued = self.send_queue.put(packet_bytes, channel=channel)
+        self._wake_writer()
+        return queued
+
+    def channel_write(self, channel, data):
+        """Write data to a virtual channel."""
+        queued = self.send_queue.put_data(channel, data)
+        self._wake_writer()
+        return queued
+
+    def close(self, timeout=5):
+        """Close the client, from any thread."""
+        self._closed = True
+        self._exit_event.set()
+        self.send_queue.close()
+        self.callbacks.close()
+        self.identity = None
+        if self.loop is not None and not self.loop.is_closed():
+            try:
+                self.loop.call_soon_threadsafe(self._close)
+            except RuntimeError:
+                # Loop has closed
+                pass
+
+    def _close(self):
+        self._closed_event.set()
+        if self.websocket.state.session is not None:
+            self.websocket.close()
+            # Don't wait long for the server to respond to the close
+            self.loop.call_later(5, self.websocket.force_disconnect)
@@ -0,0 +1,290 @@
+"""
+M2M services as coroutines, for the asyncio engine.
+
+Each service reads from and writes to an AsyncChannel, and behaves the same
+as its threaded counterpart (RemoteProcess, portforward.Connection,
+FileService, CommandService and EchoService).
+
+"""
+
+import asyncio
+import json
+import logging
+import os
+import shlex
+import signal
+import subprocess
+
+from lomond.errors import WebSocketError
+
+from . import proxy
+from .commandservice import CommandService
+from .fileservice import FileService
+
+
+log = logging.getLogger("m2m")
+
+# Bytes read from a channel at a time
+READ_SIZE = 64 * 1024
+
+
+async def _wait_pid(pid, name, kill_time=15.0):
+    """Wait for a process to exit, killing it if it takes too long."""
+    loop = asyncio.get_running_loop()
+    start_time = loop.time()
+    sent_kill = False
+    while True:
+        try:
+            exited_pid, exit_code = os.waitpid(pid, os.WNOHANG)
+        except OSError:
+            # Not our child, or already reaped
+            return
+        if exited_pid:
+            log.debug("process %s exited with code=%i", name, exit_code)
+            return
+        if not sent_kill and loop.time() - start_time >= kill_time:
+            sent_kill = True
+            log.warning("sending SIGKILL to process %s", name)
+            os.kill(pid, signal.SIGKILL)
+        await asyncio.sleep(0.2)
+
+
+async def _copy_to_channel(reader, channel, read_size=None):
+    """Copy from a reader to a channel until EOF, return bytes copied."""
+    bytes_copied = 0
+    writer = channel.writer
+    while not channel.is_closed:
+        data = await reader.read(read_size or channel.get_chunk_size())
+        if not data:
+            break
+        writer.write(data)
+        bytes_copied += len(data)
+        # Wait for the remote end to catch up
+        await writer.drain()
+    return bytes_copied
+
+
+class AsyncRemoteProcess(object):
+    """A process in a pseudo terminal, managed remotely over m2m."""
+
+    def __init__(self, command, channel, user=None, group=None, size=None):
+        self.command = command
+        self.channel = channel
+        self.interceptor = proxy.Interceptor(user=user, group=group, size=size)
+        self._closed = False
+        channel.set_control_callback(self.on_control)
+
+    def __repr__(self):
+        return "AsyncRemoteProcess({!r}, {!r}, pid={})".format(
+            self.command, self.channel, self.interceptor.pid
+        )
+
+    @property
+    def is_closed(self):
+        return self._closed
+
+    def on_control(self, data):
+        try:
+            control = json.loads(data)
+        except Exception:
+            log.exception("error decoding control")
+            return
+        control_type = control.get("type", None)
+        if control_type == "window_resize":
+            size = control["size"]
+            log.debug("resize terminal to {} X {}".format(*size))
+            self.interceptor.resize_terminal(size)
+        else:
+            log.warning("unknown control packet {}".format(control_type))
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        master_fd = self.interceptor.fork(shlex.split(self.command))
+        pty_reader = asyncio.StreamReader()
+        read_transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(pty_reader),
+            os.fdopen(master_fd, "rb", 0),
+        )
+        # A second fd, so the read and write transports may close independently
+        write_transport, write_protocol = await loop.connect_write_pipe(
+            asyncio.streams.FlowControlMixin, os.fdopen(os.dup(master_fd), "wb", 0)
+        )
+        pty_writer = asyncio.StreamWriter(write_transport, write_protocol, None, loop)
+        input_task = loop.create_task(self._copy_input(pty_writer))
+        try:
+            await _copy_to_channel(pty_reader, self.channel, READ_SIZE)
+        except OSError:
+            # EIO when the process exits
+            pass
+        finally:
+            input_task.cancel()
+            read_transport.close()
+            write_transport.close()
+            self.interceptor.master_fd = None
+            self.close()
+
+    async def _copy_input(self, pty_writer):
+        """Copy data from the channel to the terminal."""
+        reader = self.channel.reader
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                pty_writer.write(data)
+                await pty_writer.drain()
+        except OSError:
+            pass
+        self.close()
+
+    def close(self):
+        """Hang up the process, if it is running."""
+        if self._closed:
+            return
+        self._closed = True
+        pid = self.interceptor.pid
+        if pid is not None:
+            log.debug("sending SIGHUP to %r", self)
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except OSError:
+                pass
+            asyncio.ensure_future(_wait_pid(pid, self.command))
+
+
+async def run_echo(channel):
+    """Send data back on the same channel."""
+    await _copy_to_channel(channel.reader, channel, READ_SIZE)
+
+
+async def run_portforward(channel, host_port):
+    """Forward a channel to a TCP/IP connection."""
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(*host_port), 5.0
+        )
+    except asyncio.TimeoutError:
+        log.error("timed out connecting to server")
+        channel.close()
+        return
+    except OSError as error:
+        log.error("IO Error when connecting, %s", error)
+        channel.close()
+        return
+    log.debug("connected to %s:%d", *host_port)
+    bytes_written = 0
+    upstream = asyncio.ensure_future(_copy_to_socket(channel.reader, writer))
+    try:
+        bytes_written = await _copy_to_channel(reader, channel)
+    except OSError as error:
+        log.debug("port forward ended; %r", error)
+    finally:
+        upstream.cancel()
+        writer.close()
+        channel.close()
+    log.debug("left recv loop (read %s bytes)", bytes_written)
+
+
+async def _copy_to_socket(reader, writer):
+    """Copy data from a channel to a socket, then shut down writing."""
+    try:
+        while True:
+            data = await reader.read(READ_SIZE)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+    except OSError:
+        pass
+
+
+async def run_file(channel, path):
+    """Send a file over a channel."""
+    loop = asyncio.get_running_loop()
+    bytes_sent = 0
+    if not path.startswith("/"):
+        path = "/" + path
+    try:
+        with open(path, "rb") as read_file:
+            while not channel.is_closed:
+                # Reads may block on slow storage, so run them in a thread
+                chunk = await loop.run_in_executor(
+                    None, read_file.read, channel.get_chunk_size()
+                )
+                if not chunk:
+                    break
+                channel.writer.write(chunk)
+                bytes_sent += len(chunk)
+                await channel.writer.drain()
+            else:
+                log.warning("file service on %r m2m closed prematurely", channel)
+    except IOError as error:
+        if isinstance(error, ConnectionError):
+            log.warning("file service on %r m2m closed prematurely", channel)
+        else:
+            FileService.send_error(channel, "ioerror", msg="unable to open file")
+            log.debug('unable to read file "%s"; %r', path, error)
+    except WebSocketError as websocket_error:
+        log.warning("websocket error (%s)", websocket_error)
+    except Exception:
+        FileService.send_error(channel, "error", "internal error, see agent logs")
+        log.exception("error in file service")
+    else:
+        log.info('read %s byte(s) from "%s"', bytes_sent, path)
+    finally:
+        channel.close()
+
+
+async def run_command(channel, command):
+    """Run a command and send the stdout over a channel."""
+    loop = asyncio.get_running_loop()
+    process = subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True
+    )
+    stdout = asyncio.StreamReader()
+    stdout_transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(stdout), process.stdout
+    )
+    stderr = asyncio.StreamReader()
+    stderr_transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(stderr), process.stderr
+    )
+    stderr_task = loop.create_task(_log_stderr(stderr, command))
+    try:
+        bytes_sent = await _copy_to_channel(stdout, channel)
+    except OSError:
+        log.debug("command %r channel closed", command)
+    except Exception:
+        log.exception("command %r error", command)
+        CommandService.send_error(channel, "error", "error running command")
+    else:
+        log.info('read %s byte(s) from command "%s"', bytes_sent, command)
+    finally:
+        # Give the process a moment to exit, so we can report the return code
+        for _ in range(50):
+            if process.poll() is not None:
+                break
+            await asyncio.sleep(0.01)
+        channel.send_control(
+            {"service": "command", "type": "complete", "returncode": process.poll()}
+        )
+        channel.close()
+        stderr_task.cancel()
+        stdout_transport.close()
+        stderr_transport.close()
+        if process.poll() is None:
+            try:
+                process.kill()
+            except OSError:
+                log.exception("command %r failed to kill", command)
+            asyncio.ensure_future(_wait_pid(process.pid, command))
+
+
+async def _log_stderr(reader, command):
+    while True:
+        chunk = await reader.read(READ_SIZE)
+        if not chunk:
+            break
+        log.debug("%r [stderr] %r", command, chunk)
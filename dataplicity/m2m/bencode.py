@@ -2,8 +2,6 @@ from __future__ import print_function, unicode_literals
 
 import sys
 
-import io
-
 """
 Encode / Decode Bencode (http://en.wikipedia.org/wiki/Bencode)
 
@@ -20,16 +18,28 @@ else:
     number_types = (long, int)
     text_type = unicode
 
+binary_types = (bytes, bytearray, memoryview)
+
 
 class EncodingError(ValueError):
     pass
 
 
+# Default maximum nesting of lists / dicts
+DEFAULT_MAX_DEPTH = 100
+
+# Maximum number of digits in a string size
+MAX_SIZE_DIGITS = 20
+
+# Default maximum size of a string decoded by IncrementalDecoder
+DEFAULT_MAX_STRING = 16 * 1024 * 1024
+
+
 class DecodeError(Exception):
     pass
 
 
-class DecoderError(Exception):
+class DecoderError(DecodeError):
     """Exception occurred with the data being decoded"""
 
     (
@@ -37,13 +47,19 @@ class DecoderError(Exception):
         MAX_SIZE_REACHED,
         ILLEGAL_DIGIT_IN_SIZE,
         ILLEGAL_DIGIT,
-    ) = range(4)
+        MAX_DEPTH_REACHED,
+        MAX_ELEMENTS_REACHED,
+        INVALID_INPUT,
+    ) = range(7)
 
     error_text = {
         PRECEDING_ZERO_IN_SIZE: "PRECEDING_ZERO_IN_SIZE",
         MAX_SIZE_REACHED: "MAX_SIZE_REACHED",
         ILLEGAL_DIGIT_IN_SIZE: "ILLEGAL_DIGIT_IN_SIZE",
         ILLEGAL_DIGIT: "ILLEGAL_DIGIT",
+        MAX_DEPTH_REACHED: "MAX_DEPTH_REACHED",
+        MAX_ELEMENTS_REACHED: "MAX_ELEMENTS_REACHED",
+        INVALID_INPUT: "INVALID_INPUT",
     }
 
     def __init__(self, code, text):
@@ -59,91 +75,383 @@ class DecoderError(Exception):
 
 def encode(obj):
     """Encode to Bencode, return bytes"""
-    binary = []
-    append = binary.append
-
-    def add_encode(obj):
-        if isinstance(obj, bytes):
-            append("{}:".format(len(obj)).encode())
-            append(obj)
-        elif isinstance(obj, text_type):
-            obj_bytes = obj.encode("utf-8")
-            append("{}:".format(len(obj_bytes)).encode())
-            append(obj_bytes)
-        elif isinstance(obj, number_types):
-            append("i{}e".format(obj).encode())
-        elif isinstance(obj, (list, tuple)):
-            append(b"l")
-            for item in obj:
-                add_encode(item)
-            append(b"e")
-        elif isinstance(obj, dict):
-            append(b"d")
-            keys = sorted(obj.keys())
-            for k in keys:
+    buffer = bytearray()
+    encode_into(obj, buffer)
+    return bytes(buffer)
+
+
+def encode_into(obj, buffer):
+    """Encode to Bencode, appending to the bytearray `buffer`.
+
+    No check is made that the result decodes, and `buffer` may contain a
+    partial encoding if an EncodingError is raised.
+
+    """
+    if isinstance(obj, binary_types):
+        buffer += b"%d:" % len(obj)
+        buffer += obj
+    elif isinstance(obj, text_type):
+        obj_bytes = obj.encode("utf-8")
+        buffer += b"%d:" % len(obj_bytes)
+        buffer += obj_bytes
+    elif isinstance(obj, number_types):
+        buffer += b"i%de" % obj
+    elif isinstance(obj, (list, tuple)):
+        buffer += b"l"
+        for item in obj:
+            encode_into(item, buffer)
+        buffer += b"e"
+    elif isinstance(obj, dict):
+        buffer += b"d"
+        for k in sorted(obj.keys()):
+            if not isinstance(k, bytes):
+                raise EncodingError("dict keys must be bytes")
+            encode_into(k, buffer)
+            encode_into(obj[k], buffer)
+        buffer += b"e"
+    else:
+        raise EncodingError("value {!r} can not be encoded in Bencode".format(obj))
+
+
+def decode(
+    data,
+    zero_copy=False,
+    max_depth=DEFAULT_MAX_DEPTH,
+    max_string=None,
+    max_elements=None,
+    max_size=None,
+):
+    """Decode Bencode, return an object.
+
+    If `zero_copy` is True, byte strings (other than dict keys) are returned
+    as memoryview slices of `data` rather than copies.
+
+    The remaining arguments limit the nesting depth of lists and dicts, the
+    size of strings, the total number of decoded objects, and the size of
+    `data`. Use `None` for no limit. A DecoderError is raised before anything
+    is allocated for an object that would exceed a limit.
+
+    """
+    assert isinstance(data, bytes), "decode takes bytes"
+    if max_size is not None and len(data) > max_size:
+        raise DecoderError(
+            DecoderError.MAX_SIZE_REACHED,
+            "{} bytes exceeds maximum of {}".format(len(data), max_size),
+        )
+    decoder = _Decoder(data, max_depth, max_string, max_elements)
+    obj, _end = decoder.decode(0, 0, memoryview(data) if zero_copy else data)
+    return obj
+
+
+def _check_size(size_bytes, max_string):
+    """Validate a string size, return the size as an integer."""
+    if not size_bytes.isdigit():
+        raise DecoderError(
+            DecoderError.ILLEGAL_DIGIT_IN_SIZE, "size {!r}".format(size_bytes)
+        )
+    if size_bytes[:1] == b"0" and len(size_bytes) > 1:
+        raise DecoderError(
+            DecoderError.PRECEDING_ZERO_IN_SIZE, "size {!r}".format(size_bytes)
+        )
+    size = int(size_bytes)
+    if max_string is not None and size > max_string:
+        raise DecoderError(
+            DecoderError.MAX_SIZE_REACHED,
+            "string of {} bytes exceeds maximum of {}".format(size, max_string),
+        )
+    return size
+
+
+def _check_number(number_bytes):
+    """Validate an integer, return it as an int."""
+    digits = number_bytes[1:] if number_bytes[:1] == b"-" else number_bytes
+    if not digits.isdigit():
+        raise DecoderError(
+            DecoderError.ILLEGAL_DIGIT, "integer {!r}".format(number_bytes)
+        )
+    if digits[:1] == b"0" and number_bytes != b"0":
+        raise DecoderError(
+            DecoderError.ILLEGAL_DIGIT, "integer {!r}".format(number_bytes)
+        )
+    return int(number_bytes)
+
+
+class _Decoder(object):
+    """Decodes a complete Bencode object from bytes."""
+
+    def __init__(self, data, max_depth, max_string, max_elements):
+        self.data = data
+        self.max_depth = max_depth
+        self.max_string = max_string
+        self.elements_remaining = max_elements
+
+    def decode(self, pos, depth, strings):
+        """Decode the object starting at `pos`, return a tuple of (object, end position).
+
+        Byte strings are sliced from `strings`, which is either the data or a memoryview of it.
+
+        """
+        data = self.data
+        if self.elements_remaining is not None:
+            self.elements_remaining -= 1
+            if self.elements_remaining < 0:
+                raise DecoderError(
+                    DecoderError.MAX_ELEMENTS_REACHED, "at position {}".format(pos)
+                )
+        obj_type = data[pos : pos + 1]
+        if obj_type == b"":
+            raise DecoderError(DecoderError.INVALID_INPUT, "unexpected end of data")
+        if obj_type == b"i":
+            end = data.find(b"e", pos + 1)
+            if end == -1:
+                raise DecoderError(
+                    DecoderError.INVALID_INPUT, "unterminated integer at {}".format(pos)
+                )
+            return _check_number(data[pos + 1 : end]), end + 1
+        elif obj_type == b"l" or obj_type == b"d":
+            if self.max_depth is not None and depth >= self.max_depth:
+                raise DecoderError(
+                    DecoderError.MAX_DEPTH_REACHED, "at position {}".format(pos)
+                )
+            depth += 1
+            decode = self.decode
+            items = []
+            append = items.append
+            pos += 1
+            if obj_type == b"l":
+                while data[pos : pos + 1] != b"e":
+                    obj, pos = decode(pos, depth, strings)
+                    append(obj)
+                return items, pos + 1
+            while data[pos : pos + 1] != b"e":
+                k, pos = decode(pos, depth, data)
                 if not isinstance(k, bytes):
-                    raise EncodingError("dict keys must be bytes")
-                add_encode(k)
-                add_encode(obj[k])
-            append(b"e")
+                    raise DecoderError(
+                        DecoderError.INVALID_INPUT, "dict keys must be bytes"
+                    )
+                v, pos = decode(pos, depth, strings)
+                append((k, v))
+            return dict(items), pos + 1
         else:
-            raise EncodingError("value {!r} can not be encoded in Bencode".format(obj))
+            colon = data.find(b":", pos, pos + MAX_SIZE_DIGITS + 1)
+            if colon == -1:
+                if data[pos : pos + MAX_SIZE_DIGITS + 1].isdigit():
+                    raise DecoderError(
+                        DecoderError.MAX_SIZE_REACHED, "at position {}".format(pos)
+                    )
+                raise DecoderError(
+                    DecoderError.INVALID_INPUT, "at position {}".format(pos)
+                )
+            start = colon + 1
+            end = start + _check_size(data[pos:colon], self.max_string)
+            if end > len(data):
+                raise DecoderError(
+                    DecoderError.INVALID_INPUT, "truncated string at {}".format(pos)
+                )
+            return strings[start:end], end
 
-    add_encode(obj)
-    bencode_data = b"".join(binary)
 
-    assert decode(bencode_data) is not None
-    return bencode_data
+class _PartialDict(object):
+    """A dict being decoded by IncrementalDecoder."""
 
+    __slots__ = ["items", "key"]
 
-def decode(data):
-    """Decode Bencode, return an object."""
-    assert isinstance(data, bytes), "decode takes bytes"
-    return _decode(io.BytesIO(data).read)
-
-
-def _decode(read):
-    """Decode bencode, `read` should be a callable that returns number of bytes."""
-    # TODO: Some input validation
-    obj_type = read(1)
-    if obj_type == b"":
-        raise DecodeError("invalid input")
-    if obj_type == b"e":
-        return None
-    if obj_type == b"i":
-        number_bytes = b""
-        while 1:
-            c = read(1)
-            if not c.isdigit() and c != b"-":
-                if c != b"e":
-                    raise DecodeError("illegal digit in size")
-                break
-            number_bytes += c
-        number = int(number_bytes)
-        return number
-    elif obj_type == b"l":
-        l = []
-        while 1:
-            i = _decode(read)
-            if i is None:
-                break
-            l.append(i)
-        return l
-    elif obj_type == b"d":
-        kv = []
-        while 1:
-            k = _decode(read)
-            if k is None:
-                break
-            v = _decode(read)
-            kv.append((k, v))
-        return dict(kv)
-    else:
-        size_bytes = obj_type
-        while 1:
-            c = read(1)
-            if c == b":":
-                break
-            size_bytes += c
-        size = int(size_bytes)
-        return read(size)
+    def __init__(self):
+        self.items = {}
+        self.key = None
+
+
+def _to_bytes(data):
+    """Copy a slice of a bytes-like object to bytes."""
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    if isinstance(data, bytearray):
+        return bytes(data)
+    return data
+
+
+class IncrementalDecoder(object):
+    """Decodes a stream of Bencode objects, fed in chunks of any size.
+
+    Internal state is limited to the open containers (at most `max_depth`), a
+    partial integer or length prefix (at most `max_token` bytes), and the
+    string currently being received, which grows as data arrives (at most
+    `max_string` bytes).
+
+    As with `decode`, `max_elements` and `max_size` limit the number of
+    decoded objects and the number of bytes in each top level object. Use
+    `None` for no limit.
+
+    Chunks may be bytes, bytearray or memoryview. Strings are copied out of
+    the chunk once, so a buffer may be reused after feed has returned.
+
+    """
+
+    _INTEGER, _SIZE = 1, 2
+
+    def __init__(
+        self,
+        max_token=64,
+        max_depth=DEFAULT_MAX_DEPTH,
+        max_string=DEFAULT_MAX_STRING,
+        max_elements=None,
+        max_size=None,
+    ):
+        self.max_token = max_token
+        self.max_depth = max_depth
+        self.max_string = max_string
+        self.max_elements = max_elements
+        self.max_size = max_size
+        self._elements = 0
+        self._size = 0
+        self._stack = []
+        self._token_type = None
+        self._token = b""
+        self._string = None
+        self._string_remaining = 0
+
+    def __repr__(self):
+        return "<IncrementalDecoder depth={}>".format(len(self._stack))
+
+    @property
+    def pending(self):
+        """True if an object has been partially decoded."""
+        return bool(
+            self._stack or self._token_type is not None or self._string is not None
+        )
+
+    def _start(self, size):
+        """Count a new object of `size` bytes (so far) against the limits."""
+        self._elements += 1
+        if self.max_elements is not None and self._elements > self.max_elements:
+            raise DecoderError(
+                DecoderError.MAX_ELEMENTS_REACHED,
+                "more than {} elements".format(self.max_elements),
+            )
+        self._consume(size)
+
+    def _consume(self, size):
+        """Count bytes in the current top level object against `max_size`."""
+        self._size += size
+        if self.max_size is not None and self._size > self.max_size:
+            raise DecoderError(
+                DecoderError.MAX_SIZE_REACHED,
+                "object exceeds maximum of {} bytes".format(self.max_size),
+            )
+
+    def _add(self, obj):
+        """Add a decoded object to the open container, return True if it is top level."""
+        if not self._stack:
+            self._elements = 0
+            self._size = 0
+            return True
+        container = self._stack[-1]
+        if isinstance(container, list):
+            container.append(obj)
+        elif container.key is None:
+            if not isinstance(obj, bytes):
+                raise DecoderError(
+                    DecoderError.INVALID_INPUT, "dict keys must be bytes"
+                )
+            container.key = obj
+        else:
+            container.items[container.key] = obj
+            container.key = None
+        return False
+
+    def feed(self, chunk):
+        """Feed bytes to the decoder, and yield each object as it completes.
+
+        The returned iterator should be exhausted before the next call to feed.
+
+        """
+        pos = 0
+        size = len(chunk)
+        while pos < size:
+            if self._string is not None:
+                # Continue a string that started in a previous chunk
+                take = min(self._string_remaining, size - pos)
+                self._string += chunk[pos : pos + take]
+                self._string_remaining -= take
+                pos += take
+                if self._string_remaining:
+                    break
+                string = bytes(self._string)
+                self._string = None
+                if self._add(string):
+                    yield string
+                continue
+
+            if self._token_type is not None:
+                terminator = b"e" if self._token_type == self._INTEGER else b":"
+                # Only look as far as the longest valid token
+                window = _to_bytes(
+                    chunk[pos : pos + self.max_token + 1 - len(self._token)]
+                )
+                end = window.find(terminator)
+                token = self._token + (window if end == -1 else window[:end])
+                if len(token) > self.max_token:
+                    raise DecoderError(
+                        DecoderError.MAX_SIZE_REACHED, "integer or size too long"
+                    )
+                if end == -1:
+                    self._token = token
+                    break
+                pos += end + 1
+                token_type = self._token_type
+                self._token_type = None
+                self._token = b""
+                self._consume(len(token) + 1)
+                if token_type == self._INTEGER:
+                    number = _check_number(token)
+                    if self._add(number):
+                        yield number
+                    continue
+                string_size = _check_size(token, self.max_string)
+                self._consume(string_size)
+                if pos + string_size <= size:
+                    # Whole string is in this chunk
+                    string = _to_bytes(chunk[pos : pos + string_size])
+                    pos += string_size
+                    if self._add(string):
+                        yield string
+                else:
+                    self._string = bytearray()
+                    self._string_remaining = string_size
+                continue
+
+            obj_type = _to_bytes(chunk[pos : pos + 1])
+            if obj_type == b"i":
+                self._start(1)
+                self._token_type = self._INTEGER
+                pos += 1
+            elif obj_type == b"l" or obj_type == b"d":
+                self._start(1)
+                max_depth = self.max_depth
+                if max_depth is not None and len(self._stack) >= max_depth:
+                    raise DecoderError(
+                        DecoderError.MAX_DEPTH_REACHED, "depth {}".format(max_depth)
+                    )
+                self._stack.append([] if obj_type == b"l" else _PartialDict())
+                pos += 1
+            elif obj_type == b"e":
+                if not self._stack:
+                    raise DecoderError(DecoderError.INVALID_INPUT, "unexpected end")
+                self._consume(1)
+                container = self._stack.pop()
+                if not isinstance(container, list):
+                    if container.key is not None:
+                        raise DecoderError(
+                            DecoderError.INVALID_INPUT, "dict key has no value"
+                        )
+                    container = container.items
+                pos += 1
+                if self._add(container):
+                    yield container
+            elif obj_type.isdigit():
+                self._start(0)
+                self._token_type = self._SIZE
+            else:
+                raise DecoderError(
+                    DecoderError.INVALID_INPUT, "object type {!r}".format(obj_type)
+                )
@@ -0,0 +1,186 @@
+"""
+Callbacks for command responses.
+
+A callback is registered for a command id, and called with the result when
+the server responds. If no response arrives before the deadline, the
+callback is called with None and discarded, so callers don't block forever
+and the table doesn't accumulate stale entries.
+
+Deadlines are kept in a heap serviced by a single timer thread. Entries
+removed on response are marked as cancelled and left in the heap until
+they reach the top, which keeps removal O(1).
+
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import defaultdict
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+log = logging.getLogger("m2m")
+
+
+class _Entry(object):
+    """A registered callback."""
+
+    __slots__ = ["command_id", "callback", "deadline", "cancelled"]
+
+    def __init__(self, command_id, callback, deadline):
+        self.command_id = command_id
+        self.callback = callback
+        self.deadline = deadline
+        self.cancelled = False
+
+
+class CallbackRegistry(object):
+    """Callbacks keyed on command id, with deadlines."""
+
+    def __init__(self, timeout=60.0):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._entries = defaultdict(list)
+        self._heap = []
+        self._sequence = itertools.count()
+        self._outstanding = 0
+        self._expired = 0
+        self._completed = 0
+        self._timer = None
+        self._closed = False
+
+    def __repr__(self):
+        return "<callbacks {} outstanding>".format(self._outstanding)
+
+    def __len__(self):
+        return self._outstanding
+
+    def add(self, command_id, callback, timeout=None):
+        """Register a callback for a command id.
+
+        The callback is called with the result, or None if no response
+        arrives within `timeout` seconds (None for the default).
+
+        """
+        if timeout is None:
+            timeout = self.timeout
+        entry = _Entry(command_id, callback, time.time() + timeout)
+        with self._lock:
+            self._entries[command_id].append(entry)
+            self._outstanding += 1
+            is_next = not self._heap or entry.deadline < self._heap[0][0]
+            heapq.heappush(self._heap, (entry.deadline, next(self._sequence), entry))
+            self._compact()
+            self._start_timer()
+            if is_next:
+                self._wake.notify()
+
+    def call(self, command_id, result):
+        """Call and remove callbacks for a command id."""
+        with self._lock:
+            entries = self._entries.pop(command_id, None)
+            if not entries:
+                return
+            self._remove(entries)
+            self._completed += len(entries)
+        self._call(entries, result)
+
+    def clear(self):
+        """Call all callbacks with None, and remove them."""
+        with self._lock:
+            entries = [
+                entry for _entries in self._entries.values() for entry in _entries
+            ]
+            self._entries.clear()
+            del self._heap[:]
+            self._outstanding = 0
+        self._call(entries, None)
+
+    def expire(self, now=None):
+        """Call and remove callbacks that are past their deadline."""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            expired = self._pop_expired(now)
+        if expired:
+            log.debug("%s command callback(s) expired", len(expired))
+        self._call(expired, None)
+        return len(expired)
+
+    def close(self):
+        """Stop the timer thread."""
+        with self._lock:
+            self._closed = True
+            self._wake.notify()
+
+    def get_stats(self):
+        """Get a dict of callback counts."""
+        with self._lock:
+            return {
+                "outstanding": self._outstanding,
+                "expired": self._expired,
+                "completed": self._completed,
+            }
+
+    def _remove(self, entries):
+        """Mark entries as removed (lock must be held)."""
+        for entry in entries:
+            entry.cancelled = True
+        self._outstanding -= len(entries)
+
+    def _compact(self):
+        """Rebuild the heap if it is mostly cancelled entries (lock must be held)."""
+        if len(self._heap) > 64 and len(self._heap) > self._outstanding * 2:
+            self._heap = [item for item in self._heap if not item[2].cancelled]
+            heapq.heapify(self._heap)
+
+    def _pop_expired(self, now):
+        """Remove and return expired entries (lock must be held)."""
+        heap = self._heap
+        expired = []
+        while heap and (heap[0][2].cancelled or heap[0][0] <= now):
+            entry = heapq.heappop(heap)[2]
+            if entry.cancelled:
+                continue
+            entries = self._entries[entry.command_id]
+            entries.remove(entry)
+            if not entries:
+                del self._entries[entry.command_id]
+            expired.append(entry)
+        self._remove(expired)
+        self._expired += len(expired)
+        return expired
+
+    def _call(self, entries, result):
+        for entry in entries:
+            try:
+                entry.callback(result)
+            except Exception:
+                log.exception("error in command callback")
+
+    def _start_timer(self):
+        """Start the timer thread if required (lock must be held)."""
+        if self._timer is None and not self._closed:
+            self._timer = threading.Thread(target=self._run_timer, name="m2m-callbacks")
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _run_timer(self):
+        while True:
+            with self._lock:
+                while not self._closed:
+                    now = time.time()
+                    expired = self._pop_expired(now)
+                    if expired:
+                        break
+                    wait = self._heap[0][0] - now if self._heap else None
+                    self._wake.wait(wait)
+                else:
+                    return
+            log.debug("%s command callback(s) expired", len(expired))
+            self._call(expired, None)
@@ -0,0 +1,167 @@
+"""
+Decides how much services read at a time for each channel.
+
+A large read on a slow link queues data that takes seconds to send, while
+small reads on a fast link waste time on per-read and per-packet overhead.
+The send rate of each channel is measured while it has a backlog of unsent
+data, and reads are sized to what the channel can send in `target_latency`
+seconds, within `min_size` and `max_size`. Sizes grow at most twofold per
+read, and don't grow while the channel's queued data is older than the
+target latency.
+
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+import threading
+import time
+
+
+log = logging.getLogger("m2m")
+
+
+class _ChannelChunks(object):
+    """Chunk size state for a channel."""
+
+    __slots__ = [
+        "size",
+        "rate",
+        "window_start",
+        "window_bytes",
+        "increases",
+        "decreases",
+    ]
+
+    def __init__(self, size):
+        self.size = size
+        # Bytes per second, or None if not yet measured
+        self.rate = None
+        self.window_start = None
+        self.window_bytes = 0
+        self.increases = 0
+        self.decreases = 0
+
+    def to_dict(self):
+        return {
+            "size": self.size,
+            "rate": self.rate,
+            "increases": self.increases,
+            "decreases": self.decreases,
+        }
+
+
+class ChunkSizer(object):
+    """Per channel read sizes and stats."""
+
+    def __init__(
+        self,
+        min_size=4 * 1024,
+        max_size=1024 * 1024,
+        initial_size=64 * 1024,
+        target_latency=0.1,
+        sample_interval=0.1,
+        smoothing=0.25,
+    ):
+        assert 0 < min_size <= max_size, "min_size must be in range 1-max_size"
+        self.min_size = min_size
+        self.max_size = max_size
+        self.initial_size = max(min_size, min(max_size, initial_size))
+        self.target_latency = target_latency
+        self.sample_interval = sample_interval
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._channels = {}
+
+    def _get_channel(self, channel):
+        state = self._channels.get(channel)
+        if state is None:
+            state = self._channels[channel] = _ChannelChunks(self.initial_size)
+        return state
+
+    def forget_channel(self, channel):
+        """Discard state and stats for a channel."""
+        with self._lock:
+            self._channels.pop(channel, None)
+
+    def reset(self):
+        """Discard state and stats for all channels."""
+        with self._lock:
+            self._channels.clear()
+
+    def on_sent(self, channel, size, backlogged, now=None):
+        """Record data for a channel taken from the send queue.
+
+        Only time spent with a `backlogged` channel (more data waiting to be
+        sent) measures the rate the link can send, otherwise the rate is
+        limited by the service producing the data.
+
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            state = self._get_channel(channel)
+            if state.window_start is None:
+                # The time this data took to send is unknown
+                state.window_start = now
+                state.window_bytes = 0
+            else:
+                state.window_bytes += size
+                elapsed = now - state.window_start
+                if elapsed >= self.sample_interval:
+                    rate = state.window_bytes / elapsed
+                    if state.rate is None:
+                        state.rate = rate
+                    else:
+                        state.rate += (rate - state.rate) * self.smoothing
+                    state.window_start = now
+                    state.window_bytes = 0
+            if not backlogged:
+                state.window_start = None
+
+    def get_size(self, channel, latency=0.0):
+        """Get the number of bytes to read for a channel.
+
+        Args:
+            channel (int): Channel number.
+            latency (float): Time the oldest unsent data for the channel has
+                been queued (seconds).
+
+        Returns:
+            int: Bytes to read.
+        """
+        with self._lock:
+            state = self._get_channel(channel)
+            size = state.size
+            if state.rate is None:
+                target = self.initial_size
+            else:
+                target = state.rate * self.target_latency
+            if latency > self.target_latency:
+                # The queue isn't keeping up, don't read more
+                target = min(target, size)
+            new_size = int(max(self.min_size, min(self.max_size, target, size * 2)))
+            if new_size != size:
+                state.size = new_size
+                if new_size > size:
+                    state.increases += 1
+                else:
+                    state.decreases += 1
+                log.debug(
+                    "channel %s chunk size %s -> %s (rate %s, latency %.3fs)",
+                    channel,
+                    size,
+                    new_size,
+                    "unknown" if state.rate is None else "%.0fB/s" % state.rate,
+                    latency,
+                )
+        return new_size
+
+    def get_stats(self):
+        """Get a dict that maps channel on to chunk size stats."""
+        with self._lock:
+            return {
+                channel: state.to_dict() for channel, state in self._channels.items()
+            }
@@ -12,31 +12,36 @@ from __future__ import unicode_literals
 
 import logging
 import os
-import select
 import subprocess
-import threading
 
 from lomond.errors import WebSocketError
 
 from ..limiter import LimitReached
-from ..constants import CHUNK_SIZE
 
 
 log = logging.getLogger("m2m")
 
 
-class CommandService(threading.Thread):
-    """Runs a command and sends the stdout over m2m."""
+class CommandService(object):
+    """Runs a command and sends the stdout over m2m.
 
-    def __init__(self, limiter, channel, command):
+    The command's output is read by the reactor thread.
+
+    """
+
+    def __init__(self, limiter, reactor, channel, command):
         self.limiter = limiter
+        self.reactor = reactor
+        self.channel = channel
+        self.command = command
+        self.process = None
+        self.bytes_sent = 0
+        self._finished = False
         self._repr = "CommandService({!r}, {!r})".format(channel, command)
+        channel.set_service("command")
         try:
             with limiter():
-                super(CommandService, self).__init__(
-                    args=(channel, command), target=self.run_service
-                )
-                self.start()
+                self._start()
         except Exception as error:
             log.warning("unable to launch %r; %s", self, error)
             self.send_error(channel, "error", str(error))
@@ -52,70 +57,84 @@ class CommandService(threading.Thread):
         error.update(extra)
         channel.send_control(error)
 
-    def run_service(self, channel, command):
-        """Run the thread and log exceptions."""
-        try:
-            try:
-                self._run_service(channel, command)
-            except Exception:
-                log.exception("error running %r", self)
-                self.send_error(channel, "error", "error running command")
-        finally:
-            self.limiter.decrement()
-
-    def _run_service(self, channel, command):
-        """Run command and send stdout over m2m."""
+    def _start(self):
+        """Run command, and read the output from the reactor."""
         log.debug("%r started", self)
-        process = subprocess.Popen(
-            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True
+        self.process = subprocess.Popen(
+            self.command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True
         )
-        bytes_sent = 0
-        stdout_fh = process.stdout.fileno()
-        stderr_fh = process.stderr.fileno()
-
-        readable_events = select.POLLIN | select.POLLPRI  # Data in , priority data in
-        error_events = select.POLLERR | select.POLLHUP  #  Error or hang up
-        events = readable_events | error_events
-        poll = select.poll()
-        poll.register(stdout_fh, events)
-        poll.register(stderr_fh, events)
+        self.channel.set_callbacks(on_close=self.on_channel_close)
+        self.reactor.add_reader(self.process.stdout.fileno(), self._on_stdout)
+        self.reactor.add_reader(self.process.stderr.fileno(), self._on_stderr)
+
+    def on_channel_close(self):
+        """Called when the channel has been closed."""
+        self.reactor.call_soon(self._finish)
+
+    def _on_writable(self):
+        """Called when the remote end has caught up."""
+        if not self._finished:
+            self.reactor.add_reader(self.process.stdout.fileno(), self._on_stdout)
+
+    def _on_stdout(self):
+        """Send stdout to the channel."""
+        channel = self.channel
+        stdout_fh = self.process.stdout.fileno()
+        if channel.is_closed:
+            log.debug("%r channel closed", self)
+            self._finish()
+            return
+        if not channel.is_writable:
+            # Stop reading until the remote end catches up
+            self.reactor.remove_reader(stdout_fh)
+            channel.call_when_writable(
+                lambda: self.reactor.call_soon(self._on_writable)
+            )
+            return
         try:
-            more_data = True
-            while more_data:
-                try:
-                    poll_result = poll.poll(0.5 * 1000)
-                except Exception as error:
-                    log.warning("error in commandservice.py poll.poll; %s", error)
-                    break
-
-                for _file_descriptor, event_mask in poll_result:
-                    if event_mask & readable_events:
-                        if _file_descriptor == stdout_fh:
-                            chunk = os.read(stdout_fh, CHUNK_SIZE)
-                            if not chunk:
-                                more_data = False
-                                log.debug("%r EOF", self)
-                                break
-                            channel.write(chunk)
-                            bytes_sent += len(chunk)
-                        else:
-                            chunk = os.read(stderr_fh, CHUNK_SIZE)
-                            log.debug("%r [stderr] %r", self, chunk)
-                    if event_mask & error_events:
-                        break
-                if channel.is_closed:
-                    log.debug("%r channel closed", self)
-                    break
-
+            chunk = os.read(stdout_fh, channel.get_chunk_size())
+            if not chunk:
+                log.debug("%r EOF", self)
+                log.info(
+                    'read %s byte(s) from command "%s"', self.bytes_sent, self.command
+                )
+                self._finish()
+                return
+            channel.write(chunk)
+            self.bytes_sent += len(chunk)
         except WebSocketError as websocket_error:
             log.warning("%r websocket error (%s)", self, websocket_error)
             # Can't send error message if websocket is fubar
-        except Exception as error:
+            self._finish()
+        except Exception:
             log.exception("%r error", self)
             self.send_error(channel, "error", "error running command")
+            self._finish()
+
+    def _on_stderr(self):
+        """Log stderr."""
+        stderr_fh = self.process.stderr.fileno()
+        try:
+            chunk = os.read(stderr_fh, self.channel.get_chunk_size())
+        except OSError:
+            chunk = b""
+        if chunk:
+            log.debug("%r [stderr] %r", self, chunk)
         else:
-            log.info('read %s byte(s) from command "%s"', bytes_sent, command)
-        finally:
+            # Hang up with nothing left to read
+            self.reactor.remove_reader(stderr_fh)
+
+    def _finish(self):
+        """Send the return code, close the channel and kill the command."""
+        if self._finished:
+            return
+        self._finished = True
+        process = self.process
+        channel = self.channel
+        try:
+            for pipe in (process.stdout, process.stderr):
+                self.reactor.remove_reader(pipe.fileno())
+                pipe.close()
             channel.send_control(
                 {"service": "command", "type": "complete", "returncode": process.poll()}
             )
@@ -125,3 +144,5 @@ class CommandService(threading.Thread):
                     process.kill()
             except OSError:
                 log.exception("%r failed to kill", self)
+        finally:
+            self.limiter.decrement()
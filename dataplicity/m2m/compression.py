@@ -0,0 +1,133 @@
+"""
+Decides which outbound packets are worth compressing.
+
+Data that is already compressed (images, archives, TLS etc.) gains nothing
+from being deflated again, but still costs CPU. Channels may be set to
+always or never compress, otherwise a sample of the data is compressed at a
+fast level to estimate how well it compresses. The decision is re-used for
+the next `resample_interval` packets on the channel.
+
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import defaultdict
+import threading
+import zlib
+
+
+COMPRESS_ALWAYS = "always"
+COMPRESS_NEVER = "never"
+COMPRESS_AUTO = "auto"
+
+COMPRESS_MODES = (COMPRESS_ALWAYS, COMPRESS_NEVER, COMPRESS_AUTO)
+
+
+class _CompressionStats(object):
+    """Compression stats for a channel."""
+
+    __slots__ = ["packets", "skipped", "bytes_in", "bytes_out", "compress_time"]
+
+    def __init__(self):
+        self.packets = 0
+        self.skipped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.compress_time = 0.0
+
+    def to_dict(self):
+        bytes_in = self.bytes_in
+        return {
+            "packets": self.packets,
+            "skipped": self.skipped,
+            "bytes_in": bytes_in,
+            "bytes_out": self.bytes_out,
+            "ratio": self.bytes_out / bytes_in if bytes_in else 1.0,
+            "compress_time": self.compress_time,
+        }
+
+
+class CompressionPolicy(object):
+    """Per channel compression decisions and stats."""
+
+    def __init__(
+        self, min_size=256, sample_size=1024, max_ratio=0.9, resample_interval=64
+    ):
+        self.min_size = min_size
+        self.sample_size = sample_size
+        self.max_ratio = max_ratio
+        self.resample_interval = resample_interval
+        self._lock = threading.Lock()
+        self._modes = {}
+        # Maps channel on to [packets until resample, compress]
+        self._samples = {}
+        self._stats = defaultdict(_CompressionStats)
+
+    def set_channel_mode(self, channel, mode):
+        """Set the compression mode for a channel."""
+        assert mode in COMPRESS_MODES, "invalid compression mode"
+        self._modes[channel] = mode
+        self._samples.pop(channel, None)
+
+    def forget_channel(self, channel):
+        """Discard settings and stats for a channel."""
+        self._modes.pop(channel, None)
+        self._samples.pop(channel, None)
+        with self._lock:
+            self._stats.pop(channel, None)
+
+    def reset(self):
+        """Discard settings and stats for all channels."""
+        self._modes.clear()
+        self._samples.clear()
+        with self._lock:
+            self._stats.clear()
+
+    def should_compress(self, channel, data):
+        """Check if a packet for a channel (or None) should be compressed."""
+        mode = self._modes.get(channel, COMPRESS_AUTO)
+        if mode == COMPRESS_ALWAYS:
+            return True
+        if mode == COMPRESS_NEVER:
+            return False
+        if len(data) < self.min_size:
+            # Too small to tell, and cheap to compress anyway
+            return True
+        sample = self._samples.get(channel)
+        if sample is None or not sample[0]:
+            sample = self._samples[channel] = [
+                self.resample_interval,
+                self.estimate_ratio(data) <= self.max_ratio,
+            ]
+        sample[0] -= 1
+        return sample[1]
+
+    def estimate_ratio(self, data):
+        """Estimate how well data will compress (compressed size / size)."""
+        sample = data[-self.sample_size :]
+        return len(zlib.compress(sample, 1)) / len(sample)
+
+    def on_compressed(self, channel, size, compressed_size, elapsed):
+        """Record a packet that was compressed."""
+        with self._lock:
+            stats = self._stats[channel]
+            stats.packets += 1
+            stats.bytes_in += size
+            stats.bytes_out += compressed_size
+            stats.compress_time += elapsed
+
+    def on_skipped(self, channel, size):
+        """Record a packet that wasn't compressed."""
+        with self._lock:
+            stats = self._stats[channel]
+            stats.packets += 1
+            stats.skipped += 1
+            stats.bytes_in += size
+            stats.bytes_out += size
+
+    def get_stats(self):
+        """Get a dict that maps channel (None for other packets) on to stats."""
+        with self._lock:
+            return {channel: stats.to_dict() for channel, stats in self._stats.items()}
@@ -0,0 +1,108 @@
+"""
+Encode / decode data-plane packets.
+
+Nearly all M2M traffic consists of packets with a body of [channel, data]
+(route, request_send, route_control and request_send_control). These are
+encoded and decoded directly here, rather than through the generic packet
+classes and bencode.
+
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from .packets import PacketType
+from ..compat import PY2
+
+
+DATA_PACKET_TYPES = (
+    PacketType.request_send,
+    PacketType.route,
+    PacketType.route_control,
+    PacketType.request_send_control,
+)
+
+# Encoded packet type, e.g. b"li6e" for route
+_prefixes = {
+    packet_type: b"li%de" % packet_type.value for packet_type in DATA_PACKET_TYPES
+}
+_packet_types = {prefix: packet_type for packet_type, prefix in _prefixes.items()}
+
+_batch_prefix = b"li%del" % PacketType.batch.value
+
+
+def encode(packet_type, channel, data):
+    """Encode a data-plane packet, return bytes."""
+    header = b"i%de%d:" % (channel, len(data))
+    if PY2 and isinstance(data, memoryview):
+        data = data.tobytes()
+    return b"".join((_prefixes[packet_type], header, data, b"e"))
+
+
+def decode(frame):
+    """Decode a data-plane packet.
+
+    Returns a tuple of (packet type, channel, data) where data is a memoryview
+    of `frame`, or None if `frame` isn't a well formed data-plane packet.
+
+    """
+    prefix_end = frame.find(b"e", 2, 6) + 1
+    packet_type = _packet_types.get(frame[:prefix_end])
+    if packet_type is None:
+        return None
+    if frame[prefix_end : prefix_end + 1] != b"i":
+        return None
+    channel_end = frame.find(b"e", prefix_end)
+    if channel_end == -1:
+        return None
+    channel_bytes = frame[prefix_end + 1 : channel_end]
+    if not channel_bytes.isdigit():
+        return None
+    size_end = frame.find(b":", channel_end)
+    if size_end == -1:
+        return None
+    size_bytes = frame[channel_end + 1 : size_end]
+    if not size_bytes.isdigit():
+        return None
+    start = size_end + 1
+    end = start + int(size_bytes)
+    if end + 1 != len(frame) or frame[end:] != b"e":
+        return None
+    return packet_type, int(channel_bytes), memoryview(frame)[start:end]
+
+
+def encode_batch(packets):
+    """Encode a batch packet from a sequence of encoded packets."""
+    parts = [_batch_prefix]
+    for packet in packets:
+        parts.append(b"%d:" % len(packet))
+        parts.append(packet)
+    parts.append(b"ee")
+    return b"".join(parts)
+
+
+def decode_batch(frame, max_packets=10000):
+    """Decode a batch packet.
+
+    Returns a list of encoded packets, or None if `frame` isn't a well
+    formed batch packet.
+
+    """
+    if not frame.startswith(_batch_prefix) or frame[-2:] != b"ee":
+        return None
+    packets = []
+    position = len(_batch_prefix)
+    end = len(frame) - 2
+    while position < end:
+        size_end = frame.find(b":", position, position + 12)
+        if size_end == -1:
+            return None
+        size_bytes = frame[position:size_end]
+        if not size_bytes.isdigit():
+            return None
+        start = size_end + 1
+        position = start + int(size_bytes)
+        if position > end or len(packets) >= max_packets:
+            return None
+        packets.append(frame[start:position])
+    return packets
@@ -0,0 +1,205 @@
+"""
+Websocket compression profiles.
+
+Permessage-deflate keeps zlib state for the lifetime of a connection. The
+memory used depends on the window size and memory level, which a profile
+sets. A profile may also disable context takeover, which resets the zlib
+state after each message, trading compression ratio for memory.
+
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import gc
+import logging
+import os
+import time
+import zlib
+
+from lomond import WebSocket
+from lomond.compression import Deflate
+from lomond.extension import parse_extension
+from lomond.frame import Frame
+from lomond.opcode import Opcode
+
+
+log = logging.getLogger("m2m")
+
+
+class CompressionProfile(object):
+    """Settings for permessage-deflate."""
+
+    def __init__(
+        self,
+        name,
+        window_bits=15,
+        mem_level=8,
+        context_takeover=True,
+        level=zlib.Z_DEFAULT_COMPRESSION,
+    ):
+        assert 9 <= window_bits <= 15, "window_bits must be in range 9-15"
+        assert 1 <= mem_level <= 9, "mem_level must be in range 1-9"
+        self.name = name
+        self.window_bits = window_bits
+        self.mem_level = mem_level
+        self.context_takeover = context_takeover
+        self.level = level
+
+    def __repr__(self):
+        return "<compression profile '{}' window_bits={} mem_level={}{}>".format(
+            self.name,
+            self.window_bits,
+            self.mem_level,
+            "" if self.context_takeover else " no_context_takeover",
+        )
+
+    @property
+    def extension_header(self):
+        """The Sec-WebSocket-Extensions header to offer this profile."""
+        offer = "permessage-deflate; client_max_window_bits={}".format(
+            self.window_bits
+        )
+        if not self.context_takeover:
+            offer += "; client_no_context_takeover"
+        # Ask the server to limit the memory we need to decompress, with a
+        # fallback offer in case the server won't
+        server_offer = "{}; server_max_window_bits={}".format(offer, self.window_bits)
+        if not self.context_takeover:
+            server_offer += "; server_no_context_takeover"
+        return "{}, {}".format(server_offer, offer).encode("utf-8")
+
+    @property
+    def options(self):
+        """Extension options, as they would be if the server accepted the offer."""
+        options = {
+            "server_max_window_bits": str(self.window_bits),
+            "client_max_window_bits": str(self.window_bits),
+        }
+        if not self.context_takeover:
+            options["server_no_context_takeover"] = ""
+            options["client_no_context_takeover"] = ""
+        return options
+
+    def make_deflate(self, options):
+        """Make a Deflate object from the options the server responded with."""
+        return ProfileDeflate(
+            Deflate.get_wbits(options, "server_max_window_bits"),
+            min(self.window_bits, Deflate.get_wbits(options, "client_max_window_bits")),
+            "server_no_context_takeover" in options,
+            "client_no_context_takeover" in options or not self.context_takeover,
+            mem_level=self.mem_level,
+            level=self.level,
+        )
+
+
+PROFILES = {
+    profile.name: profile
+    for profile in [
+        CompressionProfile("default"),
+        CompressionProfile("low-memory", window_bits=11, mem_level=4),
+        CompressionProfile(
+            "minimal", window_bits=9, mem_level=1, context_takeover=False
+        ),
+    ]
+}
+
+
+def get_profile(name):
+    """Get a compression profile from its name, or None for "off"."""
+    if name == "off":
+        return None
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError("no compression profile called '{}'".format(name))
+
+
+class ProfileDeflate(Deflate):
+    """Deflate with a configurable memory level."""
+
+    def __init__(
+        self,
+        decompress_wbits,
+        compress_wbits,
+        reset_decompress,
+        reset_compress,
+        mem_level=8,
+        level=zlib.Z_DEFAULT_COMPRESSION,
+    ):
+        self.mem_level = mem_level
+        self.level = level
+        super(ProfileDeflate, self).__init__(
+            decompress_wbits, compress_wbits, reset_decompress, reset_compress
+        )
+
+    def reset_compressor(self):
+        """Reset the compressor for the next frame."""
+        self._compressobj = zlib.compressobj(
+            self.level, zlib.DEFLATED, -max(9, self.compress_wbits), self.mem_level
+        )
+
+
+class ProfileWebSocket(WebSocket):
+    """A WebSocket that negotiates compression with a CompressionProfile."""
+
+    def __init__(self, url, profile, **kwargs):
+        super(ProfileWebSocket, self).__init__(url, compress=False, **kwargs)
+        self.profile = profile
+        self.add_header(b"Sec-WebSocket-Extensions", profile.extension_header)
+
+    def process_extensions(self, extensions):
+        """Process extension headers."""
+        enabled_extensions = set()
+        for extension in extensions:
+            extension_token, options = parse_extension(extension)
+            if extension_token == "permessage-deflate":
+                enabled_extensions.add("permessage-deflate")
+                compression = self.profile.make_deflate(options)
+                self.state.compression = compression
+                self.state.stream.set_compression(compression)
+                log.debug("%r enabled with %r", compression, self.profile)
+        return enabled_extensions
+
+
+def get_rss(pid=None):
+    """Get resident memory of a process in bytes, or None if not known."""
+    try:
+        with open("/proc/{}/statm".format(pid or "self"), "rb") as statm:
+            pages = int(statm.read().split()[1])
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf(str("SC_PAGE_SIZE"))
+
+
+def measure_profile(profile, data, connections=32):
+    """Measure the resources used by a compression profile.
+
+    Creates compression state for a number of connections, and compresses /
+    decompresses `data` with each.
+
+    Returns:
+        dict: Resident memory per connection (None if it couldn't be
+            measured), compression ratio, and time per message.
+    """
+    gc.collect()
+    start_rss = get_rss()
+    deflates = []
+    compressed = b""
+    start = time.time()
+    for _ in range(connections):
+        deflate = profile.make_deflate(profile.options)
+        compressed = deflate.compress(data)
+        deflate.decompress([Frame(Opcode.BINARY, payload=compressed)])
+        deflates.append(deflate)
+    elapsed = time.time() - start
+    end_rss = get_rss()
+    rss = None
+    if start_rss is not None and end_rss is not None:
+        rss = max(0, end_rss - start_rss) // connections
+    return {
+        "rss": rss,
+        "ratio": len(compressed) / len(data),
+        "time": elapsed / connections,
+    }
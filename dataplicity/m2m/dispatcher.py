@@ -9,6 +9,7 @@ Dispatches incoming packets
 
 from ..compat import text_type, getfullargspec
 
+from operator import attrgetter
 import logging
 import inspect
 
@@ -49,16 +50,19 @@ class Dispatcher(object):
 
         self._packet_cls = packet_cls
         self._packet_handlers = {}
+        self._calls = {}
         self._init_dispatcher()
         self._dispatch_enabled = True
 
     def set_packet_class(self, packet_cls):
         self._packet_cls = packet_cls
+        self._init_calls()
 
     def disable(self):
         """Prevent all further packet dispatch."""
         self._dispatch_enabled = False
         self._packet_handlers.clear()
+        self._calls.clear()
 
     def _init_dispatcher(self):
         for method_name in dir(self._handler_instance):
@@ -68,6 +72,56 @@ class Dispatcher(object):
             if getattr(method, "_dispatcher_exposed", False):
                 packet_type = method._dispatcher_packet_type
                 self._packet_handlers[packet_type] = method
+        self._init_calls()
+
+    def _init_calls(self):
+        """Work out how to call the handler for each registered packet class."""
+        self._calls.clear()
+        if self._packet_cls is None:
+            return
+        for packet_type in self._packet_handlers:
+            packet_cls = self._packet_cls.registry.get(packet_type)
+            if packet_cls is not None:
+                self._calls[packet_cls] = self._make_call(packet_cls)
+
+    def _make_call(self, packet_cls):
+        """Get a tuple of (method, args getter, keyword names, error) for a packet class.
+
+        Attributes of the packet are passed positionally, up to the number of
+        arguments the handler has, and the remainder by keyword. If the handler
+        can't accept those arguments, `error` is the message for the PacketFormatError.
+
+        """
+        packet_type = packet_cls.type
+        method = self._packet_handlers.get(packet_type, None)
+        if method is None:
+            return None
+        arg_count = len(getfullargspec(method)[0])
+        attribute_names = [
+            attrib_name for attrib_name, _attrib_type in packet_cls.attributes
+        ]
+        arg_names = attribute_names[:arg_count]
+        keyword_names = attribute_names[arg_count:]
+
+        error = None
+        try:
+            inspect.getcallargs(
+                method,
+                packet_type,
+                *arg_names,
+                **{keyword: None for keyword in keyword_names}
+            )
+        except TypeError as e:
+            error = text_type(e)
+
+        if not arg_names:
+            get_args = lambda packet: ()
+        elif len(arg_names) == 1:
+            get_arg = attrgetter(arg_names[0])
+            get_args = lambda packet: (get_arg(packet),)
+        else:
+            get_args = attrgetter(*arg_names)
+        return method, get_args, keyword_names, error
 
     def dispatch(self, packet_type, packet_body):
         """Dispatch a packet to appropriate handler"""
@@ -86,27 +140,24 @@ class Dispatcher(object):
         if not getattr(packet, "no_log", False):
             self.log.debug("received %r", packet)
         packet_type = packet.type
-        method = self._packet_handlers.get(packet_type, None)
+        packet_cls = type(packet)
+        try:
+            call = self._calls[packet_cls]
+        except KeyError:
+            call = self._calls[packet_cls] = self._make_call(packet_cls)
 
-        if method is None:
+        if call is None:
             self.on_missing_handler(packet)
             return None
 
-        arg_spec = getfullargspec(method)
-
-        args, kwargs = packet.get_method_args(len(arg_spec[0]))
+        method, get_args, keyword_names, error = call
+        if error is not None:
+            raise PacketFormatError(error)
 
-        try:
-            inspect.getcallargs(method, packet_type, *args, **kwargs)
-        except TypeError as e:
-            raise PacketFormatError(text_type(e))
-
-        try:
-            ret = method(packet_type, *args, **kwargs)
-        except Exception:
-            raise
-        else:
-            return ret
+        if keyword_names:
+            kwargs = {keyword: getattr(packet, keyword) for keyword in keyword_names}
+            return method(packet_type, *get_args(packet), **kwargs)
+        return method(packet_type, *get_args(packet))
 
     def on_missing_handler(self, packet):
         """Called when no handler is available to handle `packet`"""
@@ -9,7 +9,6 @@ File data is sent in chunks.
 from __future__ import print_function
 from __future__ import unicode_literals
 
-from functools import partial
 import logging
 import os.path
 import threading
@@ -17,7 +16,7 @@ import threading
 from lomond.errors import WebSocketError
 
 from ..limiter import LimitReached
-from ..constants import CHUNK_SIZE, SERVER_BUSY
+from ..constants import SERVER_BUSY
 
 
 log = logging.getLogger("m2m")
@@ -35,6 +34,7 @@ class FileService(threading.Thread):
     def __init__(self, limiter, channel, path):
         self.limiter = limiter
         self._repr = "FileService({!r}, {!r})".format(channel, path)
+        channel.set_service("file")
         try:
             with limiter():
                 super(FileService, self).__init__(
@@ -81,11 +81,15 @@ class FileService(threading.Thread):
             path = "/" + path
         try:
             with open(path, "rb") as read_file:
-                read = partial(read_file.read, CHUNK_SIZE)
-                for chunk in iter(read, b""):
+                while True:
+                    # Wait for the remote end to catch up
+                    channel.wait_writable()
                     if channel.is_closed:
                         log.warning("%r m2m closed prematurely", self)
                         break
+                    chunk = read_file.read(channel.get_chunk_size())
+                    if not chunk:
+                        break
                     channel.write(chunk)
                     bytes_sent += len(chunk)
         except IOError as error:
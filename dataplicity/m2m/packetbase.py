@@ -6,6 +6,9 @@ Packet management
 
 """
 
+from keyword import iskeyword
+import re
+
 from . import bencode
 from ..compat import int_types, binary_type, text_type, with_metaclass
 
@@ -22,10 +25,105 @@ class UnknownPacketError(PacketError):
     """A packet we don't know how to handle."""
 
 
+class _Missing(object):
+    def __repr__(self):
+        return "<missing>"
+
+
+_missing = _Missing()
+
+_valid_name = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$").match
+
+
+def _find_method(cls, name):
+    """Get the function that implements a method, without binding it."""
+    for klass in cls.__mro__:
+        if name in klass.__dict__:
+            return klass.__dict__[name]
+    return None
+
+
+def _is_generic(cls, name):
+    """Check if a method is the default implementation (or was compiled)."""
+    method = _find_method(cls, name)
+    return method is PacketBaseType.__dict__[name] or hasattr(method, "_compiled")
+
+
+# Templates for compiled packet methods
+_INIT_ATTRIBUTE = """\
+    if {name} is _missing:
+        raise PacketFormatError("missing attribute '{name}', in {{!r}}".format(self))
+    if isinstance({name}, text_type):
+        {name} = {name}.encode("utf-8")
+"""
+
+_CHECK_ATTRIBUTE_TYPE = """\
+    if not isinstance({name}, type_{index}):
+        raise PacketFormatError(
+            "parameter '{name}' should be a {{!r}}, in {{!r}} (not {{!r}})".format(
+                type_{index}, self, type({name})
+            )
+        )
+"""
+
+
+def _compile_methods(packet_cls):
+    """Generate an __init__ and encode specialized for the packet's attributes."""
+    names = [attrib_name for attrib_name, _attrib_type in packet_cls.attributes]
+    namespace = {
+        "PacketFormatError": PacketFormatError,
+        "text_type": text_type,
+        "_missing": _missing,
+        "packet_type": int(packet_cls.type),
+    }
+    code = [
+        "def __init__(self, {}*_args, **_kwargs):\n".format(
+            "".join("{}=_missing, ".format(name) for name in names)
+        )
+    ]
+    for index, (name, attrib_type) in enumerate(packet_cls.attributes):
+        code.append(_INIT_ATTRIBUTE.format(name=name))
+        if attrib_type is not None:
+            namespace["type_{}".format(index)] = attrib_type
+            code.append(_CHECK_ATTRIBUTE_TYPE.format(name=name, index=index))
+        code.append("    self.{0} = {0}\n".format(name))
+    if not _is_generic(packet_cls, "validate"):
+        code.append("    self.validate()\n")
+    elif not names:
+        code.append("    pass\n")
+    code.append(
+        "def encode(self):\n    return [packet_type{}]\n".format(
+            "".join(", self.{}".format(name) for name in names)
+        )
+    )
+    source = "".join(code)
+    exec(compile(source, "<{}>".format(packet_cls.__name__), "exec"), namespace)
+    init = namespace["__init__"]
+    encode = namespace["encode"]
+    init._compiled = encode._compiled = True
+    return init, encode
+
+
 class PacketMeta(type):
-    """Maintains a registry of packet classes."""
+    """Maintains a registry of packet classes.
+
+    Packet classes get __slots__ for their attributes, and an __init__ and
+    encode compiled from the `attributes` list.
+
+    """
 
     def __new__(mcs, name, bases, attrs):
+        if "__slots__" not in attrs:
+            attributes = attrs.get("attributes", getattr(bases[0], "attributes", []))
+            inherited = set()
+            for base in bases:
+                for klass in base.__mro__:
+                    inherited.update(getattr(klass, "__slots__", ()))
+            attrs["__slots__"] = tuple(
+                attrib_name
+                for attrib_name, _attrib_type in attributes
+                if attrib_name not in inherited
+            )
         packet_cls = super(PacketMeta, mcs).__new__(mcs, name, bases, attrs)
         if bases[0] is not object:
             if packet_cls.type >= 0:
@@ -35,12 +133,29 @@ class PacketMeta(type):
                     packet_cls, type
                 )
                 packet_cls.registry[packet_cls.type] = packet_cls
+                mcs.compile(packet_cls)
         return packet_cls
 
+    @classmethod
+    def compile(mcs, packet_cls):
+        """Replace the default __init__ and encode, if they haven't been overridden."""
+        if not _is_generic(packet_cls, "init_params"):
+            return
+        for attrib_name, _attrib_type in packet_cls.attributes:
+            if not _valid_name(attrib_name) or iskeyword(attrib_name):
+                return
+        init, encode = _compile_methods(packet_cls)
+        if _is_generic(packet_cls, "__init__"):
+            packet_cls.__init__ = init
+        if _is_generic(packet_cls, "encode"):
+            packet_cls.encode = encode
+
 
 class PacketBaseType(object):
     """Metaclass to register packet type."""
 
+    __slots__ = ()
+
     registry = {}
 
     # Packet type
@@ -6,7 +6,7 @@ from __future__ import absolute_import
 
 from enum import IntEnum, unique
 from .packetbase import PacketBase
-from ..compat import text_type, int_types
+from ..compat import buffer_types, text_type, int_types
 
 
 @unique
@@ -95,6 +95,9 @@ class PacketType(IntEnum):
     write_remote_file = 31
     write_remote_file_result = 32
 
+    # Several packets in one websocket message
+    batch = 33
+
     response = 100
 
     command_add_route = 101
@@ -189,7 +192,7 @@ class RequestSendPacket(M2MPacket):
     """Request to send data to a connection."""
 
     type = PacketType.request_send
-    attributes = [("channel", int_types), ("data", bytes)]
+    attributes = [("channel", int_types), ("data", buffer_types)]
 
 
 class KeepAlivePacket(M2MPacket):
@@ -202,7 +205,7 @@ class RoutePacket(M2MPacket):
     """Route data."""
 
     type = PacketType.route
-    attributes = [("channel", int_types), ("data", bytes)]
+    attributes = [("channel", int_types), ("data", buffer_types)]
 
 
 class RouteControlPacket(M2MPacket):
@@ -518,3 +521,9 @@ class WriteRemoteFileResult(M2MPacket):
         ("fail_reason", bytes),
     ]
 
+
+class BatchPacket(M2MPacket):
+    """Several encoded packets sent in one websocket message."""
+
+    type = PacketType.batch
+    attributes = [("packets", list)]
@@ -53,52 +53,99 @@ class Interceptor(object):
         self.size = size
         self.master_fd = None
         self.pid = None
+        self._reactor = None
 
     def spawn(self, argv=None):
         """
         Create a spawned process.
         Based on the code for pty.spawn().
         """
+        master_fd = self.fork(argv)
+        try:
+            self._copy()
+        except (IOError, OSError):
+            pass
+
+        os.close(master_fd)
+        self.master_fd = None
+
+    def spawn_reactor(self, reactor, argv=None):
+        """
+        Create a spawned process, with output read from a shared reactor thread.
+        Returns immediately; on_exit() is called when the terminal closes.
+        """
+        self._reactor = reactor
+        master_fd = self.fork(argv)
+        reactor.add_reader(master_fd, self._on_master_readable, master_fd)
+
+    def _on_master_readable(self, master_fd):
+        """
+        Called from the reactor thread when there is output from the child.
+        """
+        try:
+            data = os.read(master_fd, 1024 * 1024)
+        except (IOError, OSError):
+            # EIO when the child has exited
+            data = b""
+        if data:
+            self.master_read(data)
+            return
+        self._reactor.remove_reader(master_fd)
+        os.close(master_fd)
+        self.master_fd = None
+        self.on_exit()
+
+    def on_exit(self):
+        """
+        Called when a process started with spawn_reactor() has closed its terminal.
+        """
+
+    def fork(self, argv=None):
+        """
+        Fork a process attached to a new pseudo terminal, return the master fd.
+        """
         assert self.master_fd is None
 
         pid, master_fd = pty.fork()
         self.master_fd = master_fd
         self.pid = pid
         if pid == pty.CHILD:
-            if self.user is not None:
-                try:
-                    uid = pwd.getpwnam(self.user).pw_uid
-                except KeyError:
-                    log.error("No such user: %s", self.user)
-                else:
-                    os.setuid(uid)
-                    log.debug(
-                        "switched user for remote process to %s(%s)", self.user, uid
-                    )
-            if self.group is not None:
-                try:
-                    gid = grp.getgrnam(self.group).gr_gid
-                except KeyError:
-                    log.error("No such group: %s", self.group)
-                else:
-                    os.setgid(gid)
-                    log.debug(
-                        "switched group for remote process to %s(%s)", self.group, gid
-                    )
-            if not argv:
-                argv = [os.environ["SHELL"]]
-            os.execlp(argv[0], *argv)
-            # Previous command replaces the process
-            return
+            # The child must never return in to the agent, even if exec fails
+            try:
+                self._exec_child(argv)
+            except BaseException:
+                log.exception("unable to exec %r", argv)
+            finally:
+                os._exit(1)
 
         self._init_fd()
-        try:
-            self._copy()
-        except (IOError, OSError):
-            pass
+        return master_fd
 
-        os.close(master_fd)
-        self.master_fd = None
+    def _exec_child(self, argv):
+        """
+        Switch user and group, and replace the forked child with the command.
+        """
+        if self.user is not None:
+            try:
+                uid = pwd.getpwnam(self.user).pw_uid
+            except KeyError:
+                log.error("No such user: %s", self.user)
+            else:
+                os.setuid(uid)
+                log.debug("switched user for remote process to %s(%s)", self.user, uid)
+        if self.group is not None:
+            try:
+                gid = grp.getgrnam(self.group).gr_gid
+            except KeyError:
+                log.error("No such group: %s", self.group)
+            else:
+                os.setgid(gid)
+                log.debug(
+                    "switched group for remote process to %s(%s)", self.group, gid
+                )
+        if not argv:
+            argv = [os.environ["SHELL"]]
+        os.execlp(argv[0], *argv)
 
     def _init_fd(self):
         """
@@ -0,0 +1,286 @@
+"""
+A single thread that waits on file descriptors for all services.
+
+Terminals, commands and port forwards register their file descriptors
+(pty masters, subprocess pipes and sockets) with a shared Reactor, which
+calls back when they are ready. Callbacks run in the reactor thread, and
+should not block. The thread waits with no timeout unless a timer is due,
+so idle services cause no wake ups.
+
+If select fails (typically because a file descriptor was closed while still
+registered), the error is logged and the selector is rebuilt without the
+closed file descriptors, whose callbacks are called so their owners see the
+error and clean up.
+
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import deque
+import errno
+import fcntl
+import heapq
+import itertools
+import logging
+import os
+import select
+import threading
+import time
+
+from ..compat import monotonic, selectors
+
+
+log = logging.getLogger("m2m")
+
+
+class Timer(object):
+    """A callback scheduled with Reactor.call_later."""
+
+    __slots__ = ["callback", "args", "cancelled"]
+
+    def __init__(self, callback, args):
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """Stop the callback from being called."""
+        self.cancelled = True
+
+
+class Reactor(object):
+    """Calls back when file descriptors are ready, from a single thread.
+
+    Methods may be called from any thread. The thread is started when the
+    first file descriptor or callback is added.
+
+    """
+
+    def __init__(self, name="m2m-reactor"):
+        self.name = name
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._calls = deque()
+        self._timers = []
+        self._timer_count = itertools.count()
+        self._thread = None
+        self._closed = False
+        self._wake_read, self._wake_write = os.pipe()
+        for fd in (self._wake_read, self._wake_write):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._selector.register(self._wake_read, selectors.EVENT_READ, None)
+
+    def __repr__(self):
+        return "<reactor {!r} {} fds>".format(
+            self.name, len(self._selector.get_map()) - 1
+        )
+
+    @property
+    def in_thread(self):
+        """True if called from the reactor thread."""
+        return threading.current_thread() is self._thread
+
+    def start(self):
+        """Start the reactor thread, if it isn't already running."""
+        with self._lock:
+            if self._thread is not None or self._closed:
+                return
+            self._thread = threading.Thread(target=self.run, name=self.name)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def close(self):
+        """Stop the reactor thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            started = self._thread is not None
+        if started:
+            self._wake()
+        else:
+            self._close_selector()
+
+    def _close_selector(self):
+        self._selector.close()
+        os.close(self._wake_read)
+        os.close(self._wake_write)
+
+    def _wake(self):
+        """Wake the reactor thread, so it sees new calls."""
+        try:
+            os.write(self._wake_write, b"\0")
+        except OSError as error:
+            # A full pipe will wake the reactor anyway
+            if error.errno != errno.EAGAIN:
+                raise
+
+    def call_soon(self, callback, *args):
+        """Call a function from the reactor thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._calls.append((callback, args))
+            wake = len(self._calls) == 1
+        self.start()
+        if wake and not self.in_thread:
+            self._wake()
+
+    def call_later(self, delay, callback, *args):
+        """Call a function from the reactor thread after `delay` seconds.
+
+        Returns:
+            Timer: An object with a `cancel` method.
+        """
+        timer = Timer(callback, args)
+        self.call_soon(self._add_timer, monotonic() + delay, timer)
+        return timer
+
+    def _add_timer(self, call_time, timer):
+        heapq.heappush(self._timers, (call_time, next(self._timer_count), timer))
+
+    def add_reader(self, fd, callback, *args):
+        """Call a function when a file descriptor is readable (or closed)."""
+        self._call(self._add_callback, fd, selectors.EVENT_READ, (callback, args))
+
+    def remove_reader(self, fd):
+        """Stop watching a file descriptor for reading."""
+        self._call(self._add_callback, fd, selectors.EVENT_READ, None)
+
+    def add_writer(self, fd, callback, *args):
+        """Call a function when a file descriptor is writable."""
+        self._call(self._add_callback, fd, selectors.EVENT_WRITE, (callback, args))
+
+    def remove_writer(self, fd):
+        """Stop watching a file descriptor for writing."""
+        self._call(self._add_callback, fd, selectors.EVENT_WRITE, None)
+
+    def _call(self, callback, *args):
+        """Call now if in the reactor thread, otherwise from the reactor thread."""
+        if self.in_thread:
+            callback(*args)
+        else:
+            self.call_soon(callback, *args)
+
+    def _add_callback(self, fd, event, callback):
+        """Set or clear (if `callback` is None) the callback for an event."""
+        selector = self._selector
+        try:
+            key = selector.get_key(fd)
+        except KeyError:
+            if callback is not None:
+                selector.register(fd, event, {event: callback})
+            return
+        callbacks = dict(key.data)
+        if callback is None:
+            callbacks.pop(event, None)
+        else:
+            callbacks[event] = callback
+        events = 0
+        for _event in callbacks:
+            events |= _event
+        if not events:
+            selector.unregister(fd)
+        else:
+            selector.modify(fd, events, callbacks)
+
+    def _get_timeout(self):
+        """Get the time until the next timer, or None if there are none."""
+        timers = self._timers
+        while timers and timers[0][2].cancelled:
+            heapq.heappop(timers)
+        if self._calls:
+            return 0
+        if not timers:
+            return None
+        return max(0.0, timers[0][0] - monotonic())
+
+    def run(self):
+        """Run callbacks until closed."""
+        try:
+            while not self._closed:
+                selector = self._selector
+                try:
+                    events = selector.select(self._get_timeout())
+                except (IOError, OSError, ValueError, select.error) as error:
+                    # select.error isn't an OSError on Python 2
+                    if error.args and error.args[0] == errno.EINTR:
+                        continue
+                    log.exception("select failed in %r", self)
+                    self._rebuild_selector()
+                    continue
+                for key, mask in events:
+                    if key.data is None:
+                        self._read_wake()
+                        continue
+                    for event in (selectors.EVENT_READ, selectors.EVENT_WRITE):
+                        if not mask & event:
+                            continue
+                        # A previous callback may have removed this one
+                        try:
+                            callback = selector.get_key(key.fd).data.get(event)
+                        except KeyError:
+                            break
+                        if callback is not None:
+                            self._run_callback(*callback)
+                self._run_timers()
+                self._run_calls()
+        except Exception:
+            log.exception("error in %r", self)
+        finally:
+            self._close_selector()
+
+    def _rebuild_selector(self):
+        """Replace the selector, dropping closed file descriptors."""
+        old_selector = self._selector
+        self._selector = selectors.DefaultSelector()
+        closed = []
+        for key in list(old_selector.get_map().values()):
+            try:
+                os.fstat(key.fd)
+            except OSError:
+                log.warning("fd %s was closed while registered with %r", key.fd, self)
+                closed.append(key)
+            else:
+                self._selector.register(key.fd, key.events, key.data)
+        try:
+            old_selector.close()
+        except Exception:
+            log.exception("error closing selector")
+        if not closed:
+            # Don't spin if the error wasn't caused by a closed fd
+            time.sleep(1.0)
+        for key in closed:
+            for callback in (key.data or {}).values():
+                self._run_callback(*callback)
+
+    def _read_wake(self):
+        try:
+            while os.read(self._wake_read, 4096):
+                pass
+        except OSError as error:
+            if error.errno != errno.EAGAIN:
+                raise
+
+    def _run_timers(self):
+        timers = self._timers
+        now = monotonic()
+        while timers and timers[0][0] <= now:
+            _call_time, _count, timer = heapq.heappop(timers)
+            if not timer.cancelled:
+                self._run_callback(timer.callback, timer.args)
+
+    def _run_calls(self):
+        with self._lock:
+            calls = list(self._calls)
+            self._calls.clear()
+        for callback, args in calls:
+            self._run_callback(callback, args)
+
+    def _run_callback(self, callback, args):
+        try:
+            callback(*args)
+        except Exception:
+            log.exception("error in reactor callback %r", callback)
@@ -0,0 +1,44 @@
+"""
+Reconnect scheduling.
+
+After an outage, many devices may lose their connection at the same moment.
+Waiting a random time up to an exponentially increasing limit ("full
+jitter") spreads their reconnects out, so the server isn't overwhelmed.
+
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import random
+
+
+class Backoff(object):
+    """Exponential backoff with full jitter.
+
+    The first retry is immediate, subsequent retries wait a random time
+    between 0 and `base` * 2 ** (attempt - 1), up to `max_wait` seconds.
+
+    """
+
+    def __init__(self, base=1.0, max_wait=60.0, random=random.random):
+        self.base = base
+        self.max_wait = max_wait
+        self._random = random
+        self.attempts = 0
+
+    def __repr__(self):
+        return "<backoff {} attempt(s)>".format(self.attempts)
+
+    def reset(self):
+        """Call when successfully connected."""
+        self.attempts = 0
+
+    def get_wait(self):
+        """Get the time to wait (in seconds) before the next attempt."""
+        attempts = self.attempts
+        self.attempts += 1
+        if not attempts:
+            return 0.0
+        limit = min(self.max_wait, self.base * 2 ** min(attempts - 1, 32))
+        return self._random() * limit
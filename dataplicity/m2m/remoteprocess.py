@@ -93,11 +93,12 @@ class RemoteProcess(proxy.Interceptor):
             self.command, self.channel, self.pid
         )
 
-    def run(self):
-        try:
-            self.spawn(shlex.split(self.command))
-        finally:
-            self.limiter.decrement()
+    def start(self, reactor):
+        """Start the process, with output read by the reactor thread."""
+        self.spawn_reactor(reactor, shlex.split(self.command))
+
+    def on_exit(self):
+        self.limiter.decrement()
 
     def on_data(self, data):
         try:
@@ -0,0 +1,115 @@
+"""
+A byte ring buffer.
+
+Data is copied in to a single bytearray, which grows as required. Reads copy
+directly out of the buffer, so reading a little at a time from a large
+backlog doesn't require re-slicing the remaining data.
+
+Not threadsafe, callers should hold a lock if required.
+
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+
+class RingBuffer(object):
+    """A FIFO of bytes."""
+
+    def __init__(self, capacity=64 * 1024):
+        self._initial_capacity = capacity
+        self._allocate(capacity)
+
+    def __repr__(self):
+        return "<ringbuffer {}/{} bytes>".format(self._size, self.capacity)
+
+    def __len__(self):
+        return self._size
+
+    def __nonzero__(self):
+        return self._size > 0
+
+    def __bool__(self):
+        return self._size > 0
+
+    @property
+    def capacity(self):
+        """Number of bytes that may be written without allocating."""
+        return len(self._buffer)
+
+    def _allocate(self, capacity):
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._size = 0
+
+    def _grow(self, required):
+        """Re-allocate the buffer so it can store at least `required` bytes."""
+        capacity = max(1, self.capacity)
+        while capacity < required:
+            capacity *= 2
+        size = self._size
+        buffer = bytearray(capacity)
+        self._readinto(memoryview(buffer), size)
+        self._buffer = buffer
+        self._view = memoryview(buffer)
+        self._start = 0
+
+    def _readinto(self, out, count):
+        """Copy `count` bytes from the start of the buffer in to `out`."""
+        view = self._view
+        start = self._start
+        first = min(count, len(view) - start)
+        out[:first] = view[start : start + first]
+        if first < count:
+            out[first:count] = view[: count - first]
+
+    def _consume(self, count):
+        """Discard `count` bytes from the start of the buffer."""
+        self._size -= count
+        if self._size:
+            self._start = (self._start + count) % len(self._view)
+        elif self.capacity > self._initial_capacity:
+            # Release memory used by a burst of data
+            self._allocate(self._initial_capacity)
+        else:
+            self._start = 0
+
+    def write(self, data):
+        """Add data to the end of the buffer."""
+        count = len(data)
+        if not count:
+            return
+        if self._size + count > self.capacity:
+            self._grow(self._size + count)
+        data = memoryview(data)
+        view = self._view
+        capacity = len(view)
+        end = (self._start + self._size) % capacity
+        first = min(count, capacity - end)
+        view[end : end + first] = data[:first]
+        if first < count:
+            view[: count - first] = data[first:]
+        self._size += count
+
+    def readinto(self, buffer):
+        """Read bytes in to a writable buffer, return number of bytes read."""
+        out = memoryview(buffer)
+        count = min(len(out), self._size)
+        self._readinto(out, count)
+        self._consume(count)
+        return count
+
+    def read(self, count):
+        """Read up to `count` bytes."""
+        count = min(count, self._size)
+        view = self._view
+        start = self._start
+        if start + count <= len(view):
+            data = view[start : start + count].tobytes()
+        else:
+            data = bytearray(count)
+            self._readinto(memoryview(data), count)
+            data = bytes(data)
+        self._consume(count)
+        return data
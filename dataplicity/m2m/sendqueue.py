@@ -0,0 +1,477 @@
+"""
+A threadsafe queue of outbound packets.
+
+Services enqueue encoded packets without blocking on the socket. A single
+writer thread takes packets off in batches, so that packets which are ready
+at the same time may be written with a single syscall.
+
+Packets are sent in order of priority. Packets that aren't associated with a
+channel (pongs, requests etc.) are sent first, then channels with terminal
+priority, then bulk channels. Packets for a channel are always sent in the
+order they were queued. Channel data is split in to packets of at most
+`max_packet_size` bytes, so a large write won't hold up higher priority
+packets for long.
+
+Channels of the same priority share bandwidth with deficit round robin
+scheduling. Each turn a channel may send up to `max_packet_size` multiplied
+by its weight, so a channel with a weight of 2 gets twice the bandwidth of a
+channel with a weight of 1, when both have data waiting.
+
+Small writes to a channel are coalesced in to a single request_send packet,
+if they arrive within `coalesce_window` seconds of each other. Coalesced data
+is sent once it reaches `coalesce_bytes`, or when it has been waiting for
+`max_delay` seconds, so that interactive traffic isn't held up.
+
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import defaultdict, deque
+import threading
+import time
+
+from . import dataplane
+from .packets import PacketType
+from ..compat import PY2
+
+
+PRIORITY_TERMINAL = 1
+PRIORITY_BULK = 2
+
+CHANNEL_PRIORITIES = (PRIORITY_TERMINAL, PRIORITY_BULK)
+
+
+class _ChannelData(object):
+    """Data waiting to be sent to a channel."""
+
+    __slots__ = ["channel", "chunks", "size", "first_time", "last_time"]
+
+    def __init__(self, channel, now):
+        self.channel = channel
+        self.chunks = []
+        self.size = 0
+        self.first_time = now
+        self.last_time = now
+
+    def __len__(self):
+        return self.size
+
+    def encode(self):
+        """Encode a request_send packet."""
+        chunks = self.chunks
+        data = chunks[0] if len(chunks) == 1 else b"".join(chunks)
+        return dataplane.encode(PacketType.request_send, self.channel, data)
+
+
+class SendQueue(object):
+    """A queue of packets (bytes) waiting to be written."""
+
+    def __init__(
+        self,
+        coalesce_window=0.0,
+        coalesce_bytes=0,
+        max_delay=0.0,
+        max_packet_size=64 * 1024,
+    ):
+        self.coalesce_window = coalesce_window
+        self.coalesce_bytes = coalesce_bytes
+        self.max_delay = max_delay
+        self.max_packet_size = max_packet_size
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._drained = threading.Condition(self._lock)
+        # Packets not associated with a channel
+        self._control = deque()
+        # Packets for each channel
+        self._channels = {}
+        # Channels with packets, for each priority
+        self._active = {priority: deque() for priority in CHANNEL_PRIORITIES}
+        self._priorities = {}
+        self._weights = {}
+        # Bytes each active channel may send before its turn ends
+        self._deficits = {}
+        # Bytes sent per channel
+        self._channel_sent = defaultdict(int)
+        # Channel data that may be appended to
+        self._pending = {}
+        # Unsent bytes per channel
+        self._channel_sizes = defaultdict(int)
+        # Callbacks waiting for a channel to drain, and their watermarks
+        self._drain_callbacks = {}
+        self._depth = 0
+        self._size = 0
+        self._closed = False
+
+        # Stats
+        self.max_depth = 0
+        self.sent_count = 0
+        self.sent_bytes = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def __repr__(self):
+        return "<sendqueue {} packets, {} bytes>".format(self.depth, self.size)
+
+    def __len__(self):
+        return self._depth
+
+    @property
+    def depth(self):
+        """Number of packets in the queue."""
+        return self._depth
+
+    @property
+    def size(self):
+        """Number of bytes in the queue."""
+        return self._size
+
+    @property
+    def is_closed(self):
+        return self._closed
+
+    def set_channel_priority(self, channel, priority):
+        """Set the priority of packets sent to a channel."""
+        assert priority in CHANNEL_PRIORITIES, "invalid channel priority"
+        with self._lock:
+            self._priorities[channel] = priority
+
+    def set_channel_weight(self, channel, weight):
+        """Set the share of bandwidth for a channel, relative to other channels
+        of the same priority."""
+        assert weight > 0, "weight must be positive"
+        with self._lock:
+            self._weights[channel] = weight
+
+    def forget_channel(self, channel):
+        """Discard settings and stats for a channel that has closed.
+
+        Returns:
+            int: Number of bytes sent to the channel.
+        """
+        with self._lock:
+            self._priorities.pop(channel, None)
+            self._weights.pop(channel, None)
+            drain_callback = self._drain_callbacks.pop(channel, None)
+            sent = self._channel_sent.pop(channel, 0)
+        if drain_callback is not None:
+            drain_callback[1]()
+        return sent
+
+    def get_channel_stats(self):
+        """Get a dict that maps channel number on to bytes sent."""
+        with self._lock:
+            return dict(self._channel_sent)
+
+    def put(self, data, channel=None):
+        """Add a packet to the queue, return False if the queue is closed.
+
+        Packets for a `channel` are sent in order with data for that channel,
+        otherwise they are sent ahead of all channel data.
+
+        """
+        with self._lock:
+            if self._closed:
+                return False
+            now = time.time()
+            if channel is None:
+                self._control.append((data, now))
+                self._on_append(len(data))
+            else:
+                # Data queued before this packet must not be added to
+                self._pending.pop(channel, None)
+                self._append(channel, data, now)
+            self._ready.notify()
+        return True
+
+    def put_data(self, channel, data):
+        """Queue data to be sent to a channel, return False if the queue is closed."""
+        if not len(data):
+            # Nothing to send
+            return not self._closed
+        max_packet_size = self.max_packet_size
+        if len(data) > max_packet_size:
+            view = memoryview(data)
+            for offset in range(0, len(data), max_packet_size):
+                if not self.put_data(channel, view[offset : offset + max_packet_size]):
+                    return False
+            return True
+        if PY2 and isinstance(data, memoryview):
+            data = data.tobytes()
+        now = time.time()
+        with self._lock:
+            if self._closed:
+                return False
+            channel_data = self._pending.get(channel)
+            if channel_data is None or channel_data.size + len(data) > max_packet_size:
+                channel_data = _ChannelData(channel, now)
+                if self.coalesce_window:
+                    self._pending[channel] = channel_data
+                self._append(channel, channel_data, now)
+            channel_data.chunks.append(data)
+            channel_data.size += len(data)
+            channel_data.last_time = now
+            self._size += len(data)
+            self._channel_sizes[channel] += len(data)
+            if channel_data.size >= self.coalesce_bytes:
+                # Large enough to send now
+                self._pending.pop(channel, None)
+                self._ready.notify()
+            elif len(channel_data.chunks) == 1:
+                self._ready.notify()
+        return True
+
+    def _append(self, channel, packet, now):
+        """Add a packet to a channel's queue."""
+        queue = self._channels.get(channel)
+        if queue is None:
+            queue = self._channels[channel] = deque()
+            priority = self._priorities.get(channel, PRIORITY_BULK)
+            self._active[priority].append(channel)
+        queue.append((packet, now))
+        self._on_append(len(packet))
+
+    def _on_append(self, size):
+        self._size += size
+        self._depth += 1
+        if self._depth > self.max_depth:
+            self.max_depth = self._depth
+
+    def _get_wait(self, now):
+        """Get the time to wait for more data, or 0 if the queue should be sent now."""
+        if not self._pending or len(self._pending) < self._depth:
+            # There are packets which can't be coalesced
+            return 0
+        wait = self.max_delay
+        coalesce_window = self.coalesce_window
+        max_delay = self.max_delay
+        for channel_data in self._pending.values():
+            wait = min(
+                wait,
+                channel_data.last_time + coalesce_window - now,
+                channel_data.first_time + max_delay - now,
+            )
+        return max(0, wait)
+
+    def _next_queue(self):
+        """Get the queue that should send next, and the active channels it is in."""
+        if self._control:
+            return self._control, None
+        deficits = self._deficits
+        for priority in CHANNEL_PRIORITIES:
+            active = self._active[priority]
+            while active:
+                channel = active[0]
+                queue = self._channels[channel]
+                deficit = deficits.get(channel, 0)
+                if deficit >= len(queue[0][0]):
+                    return queue, active
+                # End of this channel's turn
+                deficits[channel] = (
+                    deficit + self.max_packet_size * self._weights.get(channel, 1)
+                )
+                active.rotate(-1)
+        return None, None
+
+    def get(self, max_bytes=256 * 1024, timeout=None):
+        """Get a batch of packets.
+
+        Blocks until at least one packet is available, then returns as many
+        packets as are waiting, up to approximately `max_bytes`. Returns an
+        empty list if the timeout expires or the queue is closed.
+
+        """
+        return [
+            packet
+            for _channel, packet in self.get_packets(max_bytes=max_bytes, timeout=timeout)
+        ]
+
+    def get_packets(self, max_bytes=256 * 1024, timeout=None):
+        """Get a batch of packets, as a list of (channel, packet) tuples.
+
+        Channel is None for packets that aren't associated with a channel.
+        Otherwise the same as `get`.
+
+        """
+        batch = []
+        callbacks = []
+        with self._lock:
+            if not self._depth and not self._closed:
+                self._ready.wait(timeout)
+            if self._pending:
+                # Wait for small writes to be coalesced
+                wait = self._get_wait(time.time())
+                while wait and not self._closed:
+                    self._ready.wait(wait)
+                    wait = self._get_wait(time.time())
+            if self._closed:
+                return batch
+            now = time.time()
+            batch_size = 0
+            drained = False
+            while self._depth:
+                queue, active = self._next_queue()
+                next_size = len(queue[0][0])
+                if batch and batch_size + next_size > max_bytes:
+                    break
+                data, queued_time = queue.popleft()
+                channel = None
+                if active is not None:
+                    channel = active[0]
+                    deficits = self._deficits
+                    deficits[channel] = deficits.get(channel, 0) - next_size
+                    self._channel_sent[channel] += next_size
+                    if not queue:
+                        active.popleft()
+                        del self._channels[channel]
+                        deficits.pop(channel, None)
+                self._depth -= 1
+                batch_size += next_size
+                if isinstance(data, _ChannelData):
+                    if self._pending.get(channel) is data:
+                        del self._pending[channel]
+                    self._channel_sizes[channel] -= data.size
+                    if not self._channel_sizes[channel]:
+                        del self._channel_sizes[channel]
+                    drained = True
+                    data = data.encode()
+                batch.append((channel, data))
+                latency = now - queued_time
+                self.total_latency += latency
+                if latency > self.max_latency:
+                    self.max_latency = latency
+            self._size -= batch_size
+            self.sent_count += len(batch)
+            self.sent_bytes += batch_size
+            if drained:
+                self._drained.notify_all()
+                if self._drain_callbacks:
+                    callbacks = self._pop_drain_callbacks(batch)
+        for callback in callbacks:
+            callback()
+        return batch
+
+    def get_channel_size(self, channel):
+        """Get the number of unsent bytes for a channel."""
+        return self._channel_sizes.get(channel, 0)
+
+    def get_channel_latency(self, channel, now=None):
+        """Get the time (in seconds) the oldest unsent packet for a channel
+        has been queued, or 0 if there are none."""
+        with self._lock:
+            queue = self._channels.get(channel)
+            if not queue:
+                return 0.0
+            queued_time = queue[0][1]
+        if now is None:
+            now = time.time()
+        return max(0.0, now - queued_time)
+
+    def wait_drained(self, channel, high_watermark, low_watermark, timeout=None):
+        """Wait for unsent data on a channel.
+
+        Returns immediately if there are fewer than `high_watermark` bytes
+        unsent, otherwise waits for the unsent data to drop to `low_watermark`.
+
+        Returns:
+            bool: True if the channel may be written to, False on timeout.
+        """
+        with self._lock:
+            if self._channel_sizes.get(channel, 0) < high_watermark:
+                return True
+            start = time.time()
+            while not self._closed:
+                if self._channel_sizes.get(channel, 0) <= low_watermark:
+                    return True
+                wait = None
+                if timeout is not None:
+                    wait = start + timeout - time.time()
+                    if wait <= 0:
+                        return False
+                self._drained.wait(wait)
+            return True
+
+    def call_when_drained(self, channel, high_watermark, low_watermark, callback):
+        """Call `callback` once a channel may be written to, without blocking.
+
+        Has the same watermarks as `wait_drained`. The callback is called
+        immediately if the channel may be written to, otherwise it is called
+        from the thread that takes packets. Replaces any previous callback
+        for the channel.
+
+        """
+        with self._lock:
+            if (
+                not self._closed
+                and self._channel_sizes.get(channel, 0) >= high_watermark
+            ):
+                self._drain_callbacks[channel] = (low_watermark, callback)
+                return
+        callback()
+
+    def _pop_drain_callbacks(self, batch):
+        """Remove and return callbacks for channels in a batch that have drained."""
+        callbacks = []
+        channel_sizes = self._channel_sizes
+        drain_callbacks = self._drain_callbacks
+        for channel, _data in batch:
+            if channel not in drain_callbacks:
+                continue
+            low_watermark, callback = drain_callbacks[channel]
+            if channel_sizes.get(channel, 0) <= low_watermark:
+                del drain_callbacks[channel]
+                callbacks.append(callback)
+        return callbacks
+
+    def _clear(self):
+        """Discard packets, and return callbacks waiting for a drain."""
+        callbacks = [callback for _low, callback in self._drain_callbacks.values()]
+        self._drain_callbacks.clear()
+        self._control.clear()
+        self._channels.clear()
+        for active in self._active.values():
+            active.clear()
+        self._priorities.clear()
+        self._weights.clear()
+        self._deficits.clear()
+        self._channel_sent.clear()
+        self._pending.clear()
+        self._channel_sizes.clear()
+        self._depth = 0
+        self._size = 0
+        self._drained.notify_all()
+        return callbacks
+
+    def clear(self):
+        """Discard any queued packets, return the number discarded."""
+        with self._lock:
+            count = self._depth
+            callbacks = self._clear()
+        for callback in callbacks:
+            callback()
+        return count
+
+    def close(self):
+        """Close the queue, and wake up the writer."""
+        with self._lock:
+            self._closed = True
+            callbacks = self._clear()
+            self._ready.notify_all()
+        for callback in callbacks:
+            callback()
+
+    def get_stats(self):
+        """Get a dict of queue statistics."""
+        with self._lock:
+            sent_count = self.sent_count
+            return {
+                "depth": self._depth,
+                "size": self._size,
+                "max_depth": self.max_depth,
+                "sent_count": sent_count,
+                "sent_bytes": self.sent_bytes,
+                "mean_latency": (
+                    self.total_latency / sent_count if sent_count else 0.0
+                ),
+                "max_latency": self.max_latency,
+            }
@@ -0,0 +1,485 @@
+"""
+A local stand-in for the m2m server.
+
+Speaks just enough of the websocket and m2m protocols to connect a WSClient
+on localhost, so the agent's side of the connection may be tested and
+measured without the real server. Channels are opened by sending
+instructions to the agent, as the real server does when a user opens a
+terminal, port forward etc.
+
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import base64
+import hashlib
+import logging
+import socket
+import threading
+import time
+import uuid
+
+from lomond.compression import Deflate
+from lomond.extension import parse_extension
+from lomond.frame import Frame
+from lomond.frame_parser import FrameParser
+from lomond.mask import mask_payload
+from lomond.opcode import Opcode
+
+from . import bencode, dataplane
+from .packets import PacketType
+from ..compat import text_type
+
+
+log = logging.getLogger("m2m")
+
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+class StandInChannel(object):
+    """The server end of a channel."""
+
+    # Received data kept for wait_for
+    max_buffer_size = 64 * 1024
+
+    def __init__(self, connection, port):
+        self.connection = connection
+        self.port = port
+        self.bytes_received = 0
+        self.first_data_time = None
+        self.controls = []
+        self.closed = False
+        self._buffer = bytearray()
+        self._condition = threading.Condition()
+
+    def __repr__(self):
+        return "<standin-channel {}>".format(self.port)
+
+    def on_data(self, data):
+        with self._condition:
+            if self.first_data_time is None:
+                self.first_data_time = time.time()
+            self.bytes_received += len(data)
+            buffer = self._buffer
+            buffer.extend(data)
+            if len(buffer) > self.max_buffer_size:
+                del buffer[: -self.max_buffer_size]
+            self._condition.notify_all()
+
+    def on_control(self, data):
+        with self._condition:
+            self.controls.append(data)
+            self._condition.notify_all()
+
+    def on_close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def write(self, data):
+        """Send data to the agent."""
+        self.connection.send(PacketType.route, self.port, data)
+
+    def close(self):
+        """Close the channel."""
+        self.on_close()
+        self.connection.send(PacketType.notify_close, self.port)
+
+    def wait_for(self, marker, timeout=None):
+        """Wait for data containing `marker`, and discard data up to it.
+
+        Returns:
+            bool: True if the marker was received, False on timeout or close.
+        """
+        end_time = time.time() + (timeout or 0)
+        with self._condition:
+            while True:
+                index = self._buffer.find(marker)
+                if index != -1:
+                    del self._buffer[: index + len(marker)]
+                    return True
+                if self.closed:
+                    return False
+                wait = None if timeout is None else end_time - time.time()
+                if wait is not None and wait <= 0:
+                    return False
+                self._condition.wait(wait)
+
+    def wait_data(self, timeout=None):
+        """Wait for the first data from the agent."""
+        end_time = time.time() + (timeout or 0)
+        with self._condition:
+            while not self.bytes_received:
+                wait = None if timeout is None else end_time - time.time()
+                if self.closed or (wait is not None and wait <= 0):
+                    return False
+                self._condition.wait(wait)
+        return True
+
+    def wait_closed(self, timeout=None):
+        """Wait for the agent to close the channel."""
+        end_time = time.time() + (timeout or 0)
+        with self._condition:
+            while not self.closed:
+                wait = None if timeout is None else end_time - time.time()
+                if wait is not None and wait <= 0:
+                    return False
+                self._condition.wait(wait)
+        return True
+
+
+class StandInConnection(object):
+    """A websocket connection from the agent."""
+
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        self.identity = None
+        self.compression = None
+        self.channels = {}
+        self._channel_lock = threading.Lock()
+        self._next_port = 1
+        # Counts are updated together, so they can be read consistently
+        self._count_lock = threading.Lock()
+        self.frames_received = 0
+        self.packets_received = 0
+        self.bytes_received = 0
+        self.closed = False
+        self._send_lock = threading.RLock()
+
+    def __repr__(self):
+        return "<standin-connection {}>".format(self.identity)
+
+    def run(self):
+        """Handle the connection until it closes."""
+        try:
+            data = self._handshake()
+            if data is None:
+                return
+            parser = FrameParser(parse_headers=False, validate=False)
+            while True:
+                if data:
+                    for frame in parser.feed(data):
+                        if not self.on_frame(frame):
+                            return
+                data = self.sock.recv(64 * 1024)
+                if not data:
+                    break
+        except socket.error as error:
+            log.debug("stand-in connection error; %s", error)
+        except Exception:
+            log.exception("error in stand-in connection")
+        finally:
+            self.close()
+
+    def _handshake(self):
+        """Read the upgrade request and respond, return any remaining data."""
+        data = b""
+        while b"\r\n\r\n" not in data:
+            chunk = self.sock.recv(16 * 1024)
+            if not chunk:
+                return None
+            data += chunk
+        header_data, _, data = data.partition(b"\r\n\r\n")
+        headers = {}
+        for line in header_data.split(b"\r\n")[1:]:
+            name, _, value = line.partition(b":")
+            headers[name.strip().lower()] = value.strip()
+        key = headers[b"sec-websocket-key"]
+        accept = base64.b64encode(hashlib.sha1(key + WS_GUID).digest())
+        response = [
+            b"HTTP/1.1 101 Switching Protocols",
+            b"Upgrade: websocket",
+            b"Connection: Upgrade",
+            b"Sec-WebSocket-Accept: " + accept,
+        ]
+        extensions = headers.get(b"sec-websocket-extensions")
+        if self.server.compress and extensions:
+            header = self._accept_deflate(extensions.decode("utf-8"))
+            if header is not None:
+                response.append(b"Sec-WebSocket-Extensions: " + header)
+        self.sock.sendall(b"\r\n".join(response) + b"\r\n\r\n")
+        return data
+
+    def _accept_deflate(self, extensions):
+        """Accept the first permessage-deflate offer, return the header."""
+        for extension in extensions.split(","):
+            token, options = parse_extension(extension)
+            if token != "permessage-deflate":
+                continue
+            # A max_window_bits without a value just says it is supported
+            options = {
+                name: value
+                for name, value in options.items()
+                if value or not name.endswith("_max_window_bits")
+            }
+            self.compression = Deflate(
+                Deflate.get_wbits(options, "client_max_window_bits"),
+                Deflate.get_wbits(options, "server_max_window_bits"),
+                "client_no_context_takeover" in options,
+                "server_no_context_takeover" in options,
+            )
+            header = "; ".join(
+                ["permessage-deflate"]
+                + [
+                    "{}={}".format(name, value) if value else name
+                    for name, value in sorted(options.items())
+                ]
+            )
+            return header.encode("utf-8")
+        return None
+
+    def on_frame(self, frame):
+        """Handle a websocket frame, return False to close."""
+        if frame.mask and frame.payload:
+            payload = bytearray(frame.payload)
+            mask_payload(frame.masking_key, payload)
+            frame.payload = bytes(payload)
+        if frame.is_close:
+            self.send_frame(Opcode.CLOSE, b"")
+            return False
+        if frame.is_ping:
+            self.send_frame(Opcode.PONG, frame.payload)
+        elif frame.is_binary:
+            data = frame.payload
+            if frame.rsv1:
+                data = self.compression.decompress([frame])
+            self.on_message(data)
+        return True
+
+    def on_message(self, data):
+        """Handle a message containing one or more packets."""
+        packets = dataplane.decode_batch(data)
+        if packets is None:
+            packets = [data]
+        with self._count_lock:
+            self.frames_received += 1
+            self.packets_received += len(packets)
+            self.bytes_received += sum(len(packet_bytes) for packet_bytes in packets)
+        for packet_bytes in packets:
+            packet = dataplane.decode(packet_bytes)
+            if packet is None:
+                packet = bencode.decode(packet_bytes)
+            self.on_packet(packet[0], packet[1:])
+
+    def on_packet(self, packet_type, body):
+        """Handle a packet from the agent."""
+        if packet_type in (PacketType.request_join, PacketType.request_identify):
+            if packet_type == PacketType.request_identify:
+                self.identity = body[0]
+            else:
+                self.identity = uuid.uuid4().hex.encode("ascii")
+            self.send(PacketType.set_identity, self.identity)
+            self.send(PacketType.welcome)
+            if self.server.batching:
+                # An empty batch tells the agent batches are supported
+                self.send_packets([])
+            self.server.on_welcome(self)
+        elif packet_type == PacketType.ping:
+            self.send(PacketType.pong, body[0])
+        elif packet_type == PacketType.request_send:
+            channel = self.channels.get(body[0])
+            if channel is not None:
+                channel.on_data(body[1])
+        elif packet_type == PacketType.request_send_control:
+            channel = self.channels.get(body[0])
+            if channel is not None:
+                channel.on_control(bytes(body[1]))
+        elif packet_type == PacketType.request_close:
+            channel = self.channels.pop(body[0], None)
+            if channel is not None:
+                channel.on_close()
+            self.send(PacketType.notify_close, body[0])
+
+    def open_channel(self):
+        """Allocate a new channel."""
+        with self._channel_lock:
+            port = self._next_port
+            self._next_port += 1
+            channel = self.channels[port] = StandInChannel(self, port)
+        self.send(PacketType.notify_open, port)
+        return channel
+
+    def send_instruction(self, **data):
+        """Send an instruction to the agent."""
+
+        def encode(value):
+            if isinstance(value, text_type):
+                return value.encode("utf-8")
+            return value
+
+        data = {encode(key): encode(value) for key, value in data.items()}
+        self.send(PacketType.instruction, b"standin", data)
+
+    def send(self, packet_type, *body):
+        """Send a single packet."""
+        self.send_message(bencode.encode([int(packet_type)] + list(body)))
+
+    def send_packets(self, packets):
+        """Send encoded packets in one batch packet."""
+        self.send_message(dataplane.encode_batch(packets))
+
+    def send_message(self, data):
+        # Compressed frames must be sent in the order they were compressed
+        with self._send_lock:
+            if self.compression is None:
+                self.send_frame(Opcode.BINARY, data)
+            else:
+                payload = self.compression.compress(data)
+                self.send_frame(Opcode.BINARY, payload, rsv1=1)
+
+    def send_frame(self, opcode, payload, rsv1=0):
+        frame_bytes = Frame.build(opcode, payload=payload, rsv1=rsv1, mask=False)
+        with self._send_lock:
+            self.sock.sendall(frame_bytes)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            for channel in list(self.channels.values()):
+                channel.on_close()
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+
+
+class StandInServer(object):
+    """Accept websocket connections on localhost.
+
+    Args:
+        batching (bool): Tell agents that batch packets are supported.
+        compress (bool): Accept permessage-deflate.
+
+    """
+
+    connection_class = StandInConnection
+
+    def __init__(self, host="127.0.0.1", port=0, batching=True, compress=True):
+        self.batching = batching
+        self.compress = compress
+        self.connections = []
+        self.welcomed = None
+        self._welcome_event = threading.Event()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((host, port))
+        self._sock.listen(128)
+        self.host, self.port = self._sock.getsockname()[:2]
+        self._thread = None
+
+    def __repr__(self):
+        return "<standin-server {}>".format(self.url)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def url(self):
+        return "ws://{}:{}/m2m/".format(self.host, self.port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="m2m-standin")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                sock, _address = self._sock.accept()
+            except socket.error:
+                break
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = self.connection_class(self, sock)
+            self.connections.append(connection)
+            thread = threading.Thread(target=connection.run, name="m2m-standin-conn")
+            thread.daemon = True
+            thread.start()
+
+    def on_welcome(self, connection):
+        self.welcomed = connection
+        self._welcome_event.set()
+
+    def wait_welcome(self, timeout=None):
+        """Wait for an agent to be welcomed, return the connection or None."""
+        self._welcome_event.wait(timeout)
+        return self.welcomed
+
+    def get_received(self):
+        """Get a tuple of (frames, packets) received from all connections."""
+        frames = packets = 0
+        for connection in self.connections:
+            with connection._count_lock:
+                frames += connection.frames_received
+                packets += connection.packets_received
+        return frames, packets
+
+    @property
+    def packets_received(self):
+        return sum(connection.packets_received for connection in self.connections)
+
+    @property
+    def frames_received(self):
+        return sum(connection.frames_received for connection in self.connections)
+
+    def close(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self._sock.close()
+        for connection in self.connections:
+            connection.close()
+
+
+class _Manager(object):
+    """Stands in for M2MManager."""
+
+    def set_identity(self, identity):
+        pass
+
+
+def measure_packet_rate(count=20000, size=64, batching=True, timeout=60.0):
+    """Measure the rate packets are sent from a WSClient to a stand-in server.
+
+    Returns:
+        dict: Packets per second, and the number of packets and websocket
+            messages received by the server.
+    """
+    from .wsclient import WSClient
+
+    with StandInServer(batching=batching) as server:
+        client = WSClient(_Manager(), server.url, None)
+        client.start()
+        try:
+            if not server.wait_welcome(timeout):
+                raise RuntimeError("agent did not connect to stand-in server")
+            # Give the agent a moment to process the welcome
+            end_time = time.time() + timeout
+            while batching and not client.peer_batching and time.time() < end_time:
+                time.sleep(0.01)
+            start_frames, start_packets = server.get_received()
+            packet_bytes = dataplane.encode(PacketType.request_send, 1, b"x" * size)
+            start = time.time()
+            for _ in range(count):
+                client.send_bytes(packet_bytes, channel=1)
+            while server.packets_received - start_packets < count:
+                if time.time() > end_time:
+                    raise RuntimeError("timed out waiting for packets")
+                time.sleep(0.001)
+            elapsed = time.time() - start
+        finally:
+            client.send_queue.close()
+            client.close()
+        frames, packets = server.get_received()
+        return {
+            "packets": packets - start_packets,
+            "messages": frames - start_frames,
+            "packets_per_second": count / elapsed,
+        }
@@ -0,0 +1,81 @@
+"""
+Statistics for monitoring the M2M connection.
+
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from bisect import bisect_left
+from collections import deque
+import threading
+
+
+class RollingHistogram(object):
+    """A histogram of the most recent `size` samples.
+
+    Each bucket counts the samples less than or equal to its bound, and
+    greater than the previous bound. The last bucket counts everything else.
+
+    """
+
+    def __init__(self, bounds, size=100):
+        self.bounds = sorted(bounds)
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=size)
+        self._counts = [0] * (len(self.bounds) + 1)
+        self._total = 0.0
+
+    def __repr__(self):
+        return "<histogram {} samples>".format(len(self))
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, value):
+        """Add a sample, discarding the oldest sample if full."""
+        with self._lock:
+            samples = self._samples
+            if len(samples) == samples.maxlen:
+                oldest = samples[0]
+                self._counts[bisect_left(self.bounds, oldest)] -= 1
+                self._total -= oldest
+            samples.append(value)
+            self._counts[bisect_left(self.bounds, value)] += 1
+            self._total += value
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts = [0] * (len(self.bounds) + 1)
+            self._total = 0.0
+
+    def get_histogram(self):
+        """Get a list of (bound, count), bound is None for the last bucket."""
+        with self._lock:
+            return list(zip(self.bounds + [None], self._counts))
+
+    def get_percentile(self, percentile):
+        """Get a percentile (0-100) of the samples, or None if there are none."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = int(round((len(samples) - 1) * percentile / 100.0))
+        return samples[index]
+
+    def get_stats(self):
+        """Get a dict of summary statistics."""
+        with self._lock:
+            count = len(self._samples)
+            mean = self._total / count if count else None
+            last = self._samples[-1] if count else None
+        return {
+            "count": count,
+            "last": last,
+            "mean": mean,
+            "median": self.get_percentile(50),
+            "p95": self.get_percentile(95),
+            "histogram": self.get_histogram(),
+        }
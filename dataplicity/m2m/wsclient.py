@@ -6,24 +6,48 @@ import logging
 import sys
 import threading
 import time
-from collections import defaultdict, deque
+from collections import defaultdict
 
 from lomond import WebSocket
 from lomond.constants import USER_AGENT as LOMOND_USER_AGENT
-from lomond.persist import persist
+from lomond.frame import Frame
+from lomond.opcode import Opcode
+from lomond.session import _ForceDisconnect
 from lomond.errors import WebSocketError
 
 from . import bencode
+from . import dataplane
 from . import packets
-from ..compat import text_type
+from .. import constants
+from ..compat import buffer_types, int_types, text_type
 from .dispatcher import Dispatcher, expose
 from .packets import M2MPacket as Packet
 from .packets import PacketType
+from .callbacks import CallbackRegistry
+from .chunksize import ChunkSizer
+from .compression import CompressionPolicy
+from .deflate import ProfileWebSocket, get_profile
+from .reconnect import Backoff
+from .ringbuffer import RingBuffer
+from .sendqueue import PRIORITY_TERMINAL, SendQueue
+from .stats import RollingHistogram
 from .._version import __version__
 
 
 log = logging.getLogger("m2m")
 
+# Bounds of the round trip time histogram buckets (seconds)
+RTT_BUCKETS = [0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+# Bounds of the histogram of times to resume a session after a disconnect
+RESUME_BUCKETS = [0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+# Channel priorities for services, all other channels have bulk priority
+_service_priorities = {"terminal": PRIORITY_TERMINAL}
+
+# Packets that are handled without the dispatcher
+_route_types = {PacketType.route.value, PacketType.route_control.value}
+
 
 class ClientError(Exception):
     pass
@@ -37,7 +61,8 @@ class ChannelFile(object):
         self.channel_no = channel_no
 
     def write(self, data):
-        # http://stackoverflow.com/questions/23932332/writing-bytes-to-standard-output-in-a-way-compatible-with-both-python2-and-pyth
+        # Writing bytes to stdout on Python 2 and 3, see
+        # http://stackoverflow.com/questions/23932332/
         # retrieve stdout as a binary file object
         output = getattr(sys.stdout, "buffer", sys.stdout)
         output.write(data)
@@ -48,19 +73,48 @@ class ChannelFile(object):
 
 
 class Channel(object):
-    """An interface to a channel."""
+    """An interface to a channel.
+
+    Incoming data that is buffered, or held by a data callback and not yet
+    released, is limited by sending a pause control packet once it reaches
+    `high_watermark` bytes, and a resume once it is down to `low_watermark`.
+
+    Producers should call `wait_writable` before writing, which blocks while
+    the remote end has paused the channel, or there is more than
+    `high_watermark` bytes of unsent data. Producers that can't block may
+    check `is_writable`, and use `call_when_writable`.
+
+    """
 
-    def __init__(self, client, number):
+    def __init__(
+        self,
+        client,
+        number,
+        high_watermark=constants.M2M_CHANNEL_HIGH_WATERMARK,
+        low_watermark=constants.M2M_CHANNEL_LOW_WATERMARK,
+    ):
         self.client = client
         self.number = number
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
         self._closed = False
 
         self._data_callback = None
         self._close_callback = None
         self._control_callback = None
+        self._manual_release = False
         self._lock = threading.RLock()
-        self.deque = deque()
+        self._buffer = RingBuffer()
+        # Bytes passed to the data callback that haven't been released
+        self._in_flight = 0
         self._data_event = threading.Event()
+        # Set when the remote end is accepting data
+        self._resumed_event = threading.Event()
+        self._resumed_event.set()
+        # True when we have asked the remote end to pause
+        self._paused = False
+        # Called when the remote end resumes
+        self._resume_callbacks = []
 
     def __repr__(self):
         """Show the channel number."""
@@ -76,6 +130,9 @@ class Channel(object):
         if self._closed:
             return
         self._closed = True
+        # Wake anything waiting to write
+        self._resumed_event.set()
+        self._call_resume_callbacks()
         try:
             if self._close_callback is not None:
                 self._close_callback()
@@ -92,29 +149,110 @@ class Channel(object):
             log.debug("%s bytes from closed %r ignored", len(data), self)
             return
         if self._data_callback is not None:
+            if not self._manual_release:
+                # Consumed by the time the callback returns
+                self._data_callback(data)
+                return
+            with self._lock:
+                self._in_flight += len(data)
             self._data_callback(data)
+            # Only data the consumer is still holding counts, so a large
+            # packet that is written immediately doesn't pause and resume
+            with self._lock:
+                self._check_pause()
         else:
             with self._lock:
-                self.deque.append(data)
+                self._buffer.write(data)
                 self._data_event.set()
+                self._check_pause()
+
+    def release(self, count):
+        """Release bytes passed to the data callback, once they have been
+        written (only required if set_callbacks was called with
+        `manual_release=True`)."""
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - count)
+            self._check_resume()
+
+    @property
+    def pending(self):
+        """Number of bytes buffered or in flight."""
+        return len(self._buffer) + self._in_flight
+
+    def _check_pause(self):
+        """Ask the remote end to pause if too much data is pending."""
+        if not self._paused and self.pending >= self.high_watermark:
+            log.debug("%r has %s bytes pending, pausing", self, self.pending)
+            self._paused = True
+            self.send_control({"type": "pause"})
+
+    def _check_resume(self):
+        """Ask the remote end to resume once pending data has been consumed."""
+        if self._paused and self.pending <= self.low_watermark:
+            log.debug("%r has %s bytes pending, resuming", self, self.pending)
+            self._paused = False
+            self.send_control({"type": "resume"})
 
     def on_control(self, data):
         """On control data."""
         if self._closed:
             log.debug("%s bytes from closed %r ignored", len(data), self)
             return
+        if self._on_flow_control(data):
+            return
         if self._control_callback is not None:
             self._control_callback(data)
 
-    def set_callbacks(self, on_data=None, on_close=None, on_control=None):
+    def _on_flow_control(self, data):
+        """Handle pause / resume control packets, return True if handled."""
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        try:
+            control_type = json.loads(data.decode("utf-8")).get("type")
+        except Exception:
+            return False
+        if control_type == "pause":
+            log.debug("%r paused by remote", self)
+            self._resumed_event.clear()
+        elif control_type == "resume":
+            log.debug("%r resumed by remote", self)
+            self._resumed_event.set()
+            self._call_resume_callbacks()
+        else:
+            return False
+        return True
+
+    def _call_resume_callbacks(self):
+        with self._lock:
+            callbacks = self._resume_callbacks[:]
+            del self._resume_callbacks[:]
+        for callback in callbacks:
+            self.call_when_writable(callback)
+
+    def set_callbacks(
+        self, on_data=None, on_close=None, on_control=None, manual_release=False
+    ):
+        """Set callbacks for channel events.
+
+        If `manual_release` is True, data passed to `on_data` that is still
+        held when the callback returns counts towards the high watermark,
+        until the consumer calls `release`.
+
+        """
+        self._manual_release = manual_release
         self._data_callback = on_data
         self._close_callback = on_close
         self._control_callback = on_control
 
     @property
     def size(self):
-        with self._lock:
-            return sum(len(b) for b in self.deque)
+        """Number of bytes buffered."""
+        return len(self._buffer)
+
+    @property
+    def is_paused(self):
+        """True if the remote end has paused this channel."""
+        return not self._resumed_event.is_set()
 
     def __nonzero__(self):
         return self._data_event.is_set()
@@ -124,37 +262,104 @@ class Channel(object):
 
     def read(self, count, timeout=None, block=False):
         """Read up to `count` bytes."""
-        incoming_bytes = []
-        bytes_remaining = count
-
         # Block until data
         if block:
             if not self._data_event.wait(timeout):
                 return b""
 
         with self._lock:
-            # Data may be spread across multiple / partial messages
-            while self.deque and bytes_remaining:
-                head = self.deque[0]
-                read_bytes = min(bytes_remaining, len(head))
-                incoming_bytes.append(head[:read_bytes])
-                bytes_left = head[read_bytes:]
-                bytes_remaining -= read_bytes
-                if not bytes_left:
-                    self.deque.popleft()
-                else:
-                    self.deque[0] = bytes_left
-            if not self.deque:
-                self._data_event.clear()
-
-        return b"".join(incoming_bytes)
+            data = self._buffer.read(count)
+            self._on_read()
+        return data
+
+    def readinto(self, buffer, timeout=None, block=False):
+        """Read in to a writable buffer, return the number of bytes read."""
+        if block:
+            if not self._data_event.wait(timeout):
+                return 0
+
+        with self._lock:
+            count = self._buffer.readinto(buffer)
+            self._on_read()
+        return count
+
+    def _on_read(self):
+        """Update state after data has been read."""
+        if not self._buffer:
+            self._data_event.clear()
+        self._check_resume()
 
     def write(self, data):
-        assert isinstance(data, bytes), "data must be bytes"
+        assert isinstance(data, buffer_types), "data must be bytes"
         if not self.is_closed:
             with self._lock:
                 self.client.channel_write(self.number, data)
 
+    def wait_writable(self, timeout=None):
+        """Block until the channel may be written to without buffering
+        excessive amounts of data.
+
+        Returns:
+            bool: False if the channel closed or the timeout expired.
+        """
+        start = time.time()
+        while not self._closed:
+            wait = 1.0
+            if timeout is not None:
+                wait = min(wait, start + timeout - time.time())
+                if wait <= 0:
+                    break
+            # Wait in steps, so we can check for the channel closing
+            if self._resumed_event.wait(wait) and self.client.wait_channel_writable(
+                self.number, self.high_watermark, self.low_watermark, wait
+            ):
+                return not self._closed
+        return False
+
+    @property
+    def is_writable(self):
+        """True if the channel may be written to without blocking in
+        `wait_writable` (or it has closed)."""
+        if self._closed:
+            return True
+        return not self.is_paused and self.client.is_channel_writable(
+            self.number, self.high_watermark
+        )
+
+    def call_when_writable(self, callback):
+        """Call `callback` once the channel may be written to, or has closed.
+
+        Doesn't block. The callback may be called immediately, or later from
+        another thread.
+
+        """
+        with self._lock:
+            if self.is_paused and not self._closed:
+                self._resume_callbacks.append(callback)
+                return
+        self.client.call_when_channel_writable(
+            self.number, self.high_watermark, self.low_watermark, callback
+        )
+
+    def set_priority(self, priority):
+        """Set the priority of data written to this channel, relative to other
+        channels (see sendqueue.CHANNEL_PRIORITIES)."""
+        self.client.set_channel_priority(self.number, priority)
+
+    def set_weight(self, weight):
+        """Set the share of bandwidth for this channel, relative to other
+        channels of the same priority."""
+        self.client.set_channel_weight(self.number, weight)
+
+    def set_service(self, service):
+        """Configure the channel for a type of service, e.g. "terminal"."""
+        self.client.set_channel_service(self.number, service)
+
+    def get_chunk_size(self):
+        """Get the number of bytes a service should read at a time, to write
+        to this channel."""
+        return self.client.get_chunk_size(self.number)
+
     def send_control(self, control):
         """Write a control packet."""
         if not self.is_closed:
@@ -183,7 +388,15 @@ class WSClient(threading.Thread):
         self.url = url
         self.remote_directory = remote_directory
         _user_agent = "Agent/{} {}".format(__version__, LOMOND_USER_AGENT)
-        self.websocket = WebSocket(url, agent=_user_agent, compress=True)
+        try:
+            profile = get_profile(constants.M2M_COMPRESSION_PROFILE)
+        except ValueError as error:
+            log.warning("%s; using default", error)
+            profile = get_profile("default")
+        if profile is None:
+            self.websocket = WebSocket(url, agent=_user_agent)
+        else:
+            self.websocket = ProfileWebSocket(url, profile, agent=_user_agent)
         self.channel_callback = channel_callback
         self.control_callback = control_callback
 
@@ -191,13 +404,39 @@ class WSClient(threading.Thread):
         self.identity = uuid
         self.channels = {}
         self.last_packet_time = time.time()
+        self.last_ping_time = 0.0
+        self.last_stats_time = time.time()
+        self.rtt = RollingHistogram(RTT_BUCKETS)
+        self.backoff = Backoff(
+            base=constants.M2M_RECONNECT_BASE_WAIT,
+            max_wait=constants.M2M_RECONNECT_MAX_WAIT,
+        )
+        self.disconnect_time = None
+        self.resume_times = RollingHistogram(RESUME_BUCKETS)
+        self._exit_event = threading.Event()
+        # Set to a reason when the connection should be dropped
+        self._disconnect_reason = None
 
-        self.callback_lock = threading.RLock()
         self.write_lock = threading.Lock()
-        self.callbacks = defaultdict(list)
+        self.callbacks = CallbackRegistry(timeout=constants.M2M_COMMAND_TIMEOUT)
         self.hooks = defaultdict(list)
 
         self.dispatcher = Dispatcher(packet_cls=Packet, handler_instance=self, log=log)
+        self.send_queue = SendQueue(
+            coalesce_window=constants.M2M_COALESCE_WINDOW_US / 1000000.0,
+            coalesce_bytes=constants.M2M_COALESCE_BYTES,
+            max_delay=constants.M2M_COALESCE_MAX_DELAY_US / 1000000.0,
+            max_packet_size=constants.M2M_MAX_SEND_PACKET_SIZE,
+        )
+        self.compression_policy = CompressionPolicy()
+        self.chunk_sizer = ChunkSizer(
+            min_size=constants.M2M_CHUNK_MIN_SIZE,
+            max_size=constants.M2M_CHUNK_MAX_SIZE,
+            target_latency=constants.M2M_CHUNK_TARGET_LATENCY_MS / 1000.0,
+        )
+        # Set when the server has shown it accepts batch packets
+        self.peer_batching = False
+        self._writer = None
 
         self.name = "m2m"  # Thread name
         self.daemon = True
@@ -215,28 +454,20 @@ class WSClient(threading.Thread):
         """List of open channels."""
         return self.channels.keys()
 
-    def add_callback(self, command_id, callback):
-        self.callbacks[command_id].append(callback)
+    def add_callback(self, command_id, callback, timeout=None):
+        """Call `callback` with the response to a command, or None on timeout."""
+        self.callbacks.add(command_id, callback, timeout=timeout)
 
     def callback(self, command_id, result):
-        with self.callback_lock:
-            if command_id in self.callbacks:
-                for callback in self.callbacks[command_id]:
-                    try:
-                        callback(result)
-                    except Exception:
-                        log.exception("error in command callback")
-                del self.callbacks[command_id]
+        self.callbacks.call(command_id, result)
 
     def clear_callbacks(self):
         """Clear all callbacks, because they may be blocking."""
-        with self.callback_lock:
-            for command_id, callbacks in self.callbacks.items():
-                for callback in callbacks:
-                    try:
-                        callback(None)
-                    except Exception:
-                        log.exception("error clearing callback")
+        self.callbacks.clear()
+
+    def get_callback_stats(self):
+        """Get counts of outstanding and expired command callbacks."""
+        return self.callbacks.get_stats()
 
     def get_channel(self, channel_no):
         # TODO: Create channels in response to packets
@@ -249,7 +480,43 @@ class WSClient(threading.Thread):
 
     def close_channel(self, channel_no):
         log.debug("request close")
-        self.send("request_close", port=channel_no)
+        packet = Packet.create(PacketType.request_close, port=channel_no)
+        # Sent after any data queued for the channel
+        self.send_bytes(packet.encode_binary(), channel=channel_no)
+
+    def set_channel_priority(self, channel_no, priority):
+        """Set the priority of data sent to a channel."""
+        self.send_queue.set_channel_priority(channel_no, priority)
+
+    def set_channel_weight(self, channel_no, weight):
+        """Set the share of bandwidth for a channel."""
+        self.send_queue.set_channel_weight(channel_no, weight)
+
+    def set_channel_service(self, channel_no, service):
+        """Configure a channel for a type of service.
+
+        Sets the priority, share of bandwidth, and compression mode.
+
+        """
+        priority = _service_priorities.get(service)
+        if priority is not None:
+            self.send_queue.set_channel_priority(channel_no, priority)
+        self.send_queue.set_channel_weight(
+            channel_no, constants.M2M_CHANNEL_WEIGHTS.get(service, 1)
+        )
+        self.compression_policy.set_channel_mode(
+            channel_no, constants.M2M_CHANNEL_COMPRESSION.get(service, "auto")
+        )
+
+    def get_chunk_size(self, channel_no):
+        """Get the number of bytes to read at a time for a channel."""
+        return self.chunk_sizer.get_size(
+            channel_no, self.send_queue.get_channel_latency(channel_no)
+        )
+
+    def get_chunk_stats(self):
+        """Get a dict that maps channel on to chunk size stats."""
+        return self.chunk_sizer.get_stats()
 
     def hard_close_channels(self):
         """Called when all the channels have been abruptly closed."""
@@ -258,19 +525,76 @@ class WSClient(threading.Thread):
 
     def run(self):
         """Main websocket handling loop."""
+        self.start_writer()
         try:
             with self.websocket:
-                for event in persist(self.websocket):
-                    log.debug("WS %r", event)
-                    try:
-                        self.on_event(event)
-                    except Exception as error:
-                        log.exception("error handling websocket event")
+                while not self._closed:
+                    self._disconnect_reason = None
+                    websocket_events = self.websocket.connect(poll=5, ping_rate=30)
+                    for event in websocket_events:
+                        self._handle_event(event)
+                        if self._disconnect_reason is not None:
+                            # Raised inside the session, which closes the
+                            # socket and generates a disconnected event
+                            self._handle_event(
+                                websocket_events.throw(
+                                    _ForceDisconnect(self._disconnect_reason)
+                                )
+                            )
+                    if self._closed:
+                        break
+                    wait = self.backoff.get_wait()
+                    log.debug("reconnecting in %.1f seconds", wait)
+                    if self._exit_event.wait(wait):
+                        break
         except (SystemExit, KeyboardInterrupt):
             log.info("exit requested")
         except Exception:
             log.exception("unhandled error from websocket")
-        self.on_close()
+        self.send_queue.close()
+
+    def _handle_event(self, event):
+        log.debug("WS %r", event)
+        try:
+            self.on_event(event)
+        except Exception:
+            log.exception("error handling websocket event")
+
+    def force_disconnect(self, reason):
+        """Drop the connection, so that the client reconnects."""
+        self._disconnect_reason = reason
+
+    def start_writer(self):
+        """Start the thread that writes queued packets."""
+        if self._writer is None:
+            self._writer = threading.Thread(target=self.run_writer, name="m2m-writer")
+            self._writer.daemon = True
+            self._writer.start()
+
+    def run_writer(self):
+        """Write packets from the send queue, until it is closed."""
+        send_queue = self.send_queue
+        chunk_sizer = self.chunk_sizer
+        while not send_queue.is_closed:
+            try:
+                packets = send_queue.get_packets(
+                    max_bytes=constants.M2M_MAX_WRITE_SIZE, timeout=1
+                )
+                if not packets:
+                    continue
+                now = time.time()
+                for channel, packet_bytes in packets:
+                    if channel is not None:
+                        chunk_sizer.on_sent(
+                            channel,
+                            len(packet_bytes),
+                            bool(send_queue.get_channel_size(channel)),
+                            now,
+                        )
+                self.write_packets(packets)
+            except Exception:
+                # Keep the writer running, or nothing more would be sent
+                log.exception("error writing packets")
 
     def on_event(self, event):
         """Called when new websocket events arrive."""
@@ -282,10 +606,62 @@ class WSClient(threading.Thread):
             self.on_binary(event.data)
         elif event.name == "poll":
             self.sync_identity()
+            self.check_liveness()
+            self.check_stats()
+        elif event.name == "pong":
+            # Websocket level pong
+            self.last_packet_time = time.time()
+
+    def check_liveness(self):
+        """Ping the server, and force a reconnect if it has stopped responding."""
+        now = time.time()
+        silence = now - self.last_packet_time
+        max_silence = constants.MAX_TIME_SINCE_LAST_PACKET
+        if max_silence is not None and silence > max_silence:
+            log.warning("no packets from server in %.1f seconds; reconnecting", silence)
+            self.force_disconnect("no packets in {:.1f}s".format(silence))
+        elif now - self.last_ping_time >= constants.M2M_PING_INTERVAL:
+            self.last_ping_time = now
+            # Server returns the data in a pong, so we can time the round trip
+            self.send(PacketType.ping, data="{:.6f}".format(now).encode("ascii"))
+
+    def get_rtt_stats(self):
+        """Get round trip time stats (in seconds) from recent pings."""
+        return self.rtt.get_stats()
+
+    def check_stats(self):
+        """Log stats, if M2M_STATS_INTERVAL has elapsed since they were last logged."""
+        interval = constants.M2M_STATS_INTERVAL
+        now = time.time()
+        if interval and now - self.last_stats_time >= interval:
+            self.last_stats_time = now
+            self.log_stats()
+
+    def get_stats(self):
+        """Get a dict of connection, send queue and per-channel stats."""
+        return {
+            "rtt": self.get_rtt_stats(),
+            "resume": self.get_resume_stats(),
+            "send_queue": self.send_queue.get_stats(),
+            "channel_sent": self.send_queue.get_channel_stats(),
+            "compression": self.compression_policy.get_stats(),
+            "callbacks": self.get_callback_stats(),
+            "chunk_size": self.get_chunk_stats(),
+        }
+
+    def log_stats(self):
+        """Write stats to the debug log."""
+        if not log.isEnabledFor(logging.DEBUG):
+            return
+        for name, stats in sorted(self.get_stats().items()):
+            log.debug("%s stats: %s", name, json.dumps(stats))
 
     def close(self, timeout=5):
-        self.websocket.close()
         self._closed = True
+        self._exit_event.set()
+        self.websocket.close()
+        self.send_queue.close()
+        self.callbacks.close()
         self.identity = None
 
     def send(self, packet, *args, **kwargs):
@@ -300,18 +676,89 @@ class WSClient(threading.Thread):
         packet_bytes = packet.encode_binary()
         self.send_bytes(packet_bytes)
 
-    def send_bytes(self, packet_bytes):
-        """Send bytes over the websocket."""
+    def send_bytes(self, packet_bytes, channel=None):
+        """Queue bytes to be sent over the websocket, without blocking.
+
+        Packets for a `channel` are sent in order with the channel's data,
+        other packets are sent ahead of channel data.
+
+        """
+        return self.send_queue.put(packet_bytes, channel=channel)
+
+    def write_packets(self, packets):
+        """Write a batch of (channel, packet) to the websocket, with a single write.
+
+        If the server supports it, consecutive packets are combined in to
+        batch packets, so they are sent as a single websocket message.
+
+        """
+        websocket = self.websocket
+        compression = websocket.state.compression
+        policy = self.compression_policy
+        max_batch_size = constants.M2M_MAX_BATCH_SIZE if self.peer_batching else 0
+        frames = []
+        batch = []
+        batch_size = 0
+        batch_compress = False
+        for channel, packet_bytes in packets:
+            compress = bool(compression) and policy.should_compress(
+                channel, packet_bytes
+            )
+            if batch and (
+                compress != batch_compress
+                or batch_size + len(packet_bytes) > max_batch_size
+            ):
+                frames.append(self._encode_frame(batch, batch_compress, compression))
+                del batch[:]
+                batch_size = 0
+            batch.append((channel, packet_bytes))
+            batch_size += len(packet_bytes)
+            batch_compress = compress
+        if batch:
+            frames.append(self._encode_frame(batch, batch_compress, compression))
         try:
-            self.websocket.send_binary(packet_bytes)
-        except WebSocketError:
+            with self.write_lock:
+                websocket.session.write(b"".join(frames))
+        except WebSocketError as error:
+            log.debug("%s packet(s) not sent; %s", len(packets), error)
             return False
         else:
             return True
 
+    def _encode_frame(self, packets, compress, compression):
+        """Encode (channel, packet) in to a websocket frame, return bytes."""
+        policy = self.compression_policy
+        if len(packets) == 1:
+            packet_bytes = packets[0][1]
+        else:
+            packet_bytes = dataplane.encode_batch(
+                [packet_bytes for _channel, packet_bytes in packets]
+            )
+        if compress:
+            start = time.time()
+            payload = compression.compress(packet_bytes)
+            elapsed = time.time() - start
+            # Share the compressed size and time between the channels
+            for channel, channel_bytes in packets:
+                share = len(channel_bytes) / float(len(packet_bytes))
+                policy.on_compressed(
+                    channel,
+                    len(channel_bytes),
+                    int(len(payload) * share),
+                    elapsed * share,
+                )
+            frame = Frame(Opcode.BINARY, payload=bytearray(payload), rsv1=1)
+        else:
+            if compression:
+                for channel, channel_bytes in packets:
+                    policy.on_skipped(channel, len(channel_bytes))
+            frame = Frame(Opcode.BINARY, payload=bytearray(packet_bytes))
+        return frame.to_bytes()
+
     def on_ready(self):
         """Called when WS is opened."""
         log.debug("websocket opened")
+        self.last_packet_time = time.time()
         if self.identity is None:
             self.send(PacketType.request_join)
         else:
@@ -321,10 +768,47 @@ class WSClient(threading.Thread):
         """On a WS message."""
         self.last_packet_time = time.time()
         try:
-            packet = bencode.decode(data)
+            if len(data) > constants.M2M_MAX_PACKET_SIZE:
+                raise bencode.DecoderError(
+                    bencode.DecoderError.MAX_SIZE_REACHED,
+                    "packet of {} bytes".format(len(data)),
+                )
+            packets = dataplane.decode_batch(
+                data, max_packets=constants.M2M_MAX_PACKET_ELEMENTS
+            )
+            if packets is None:
+                packet = self.decode_packet(data)
         except:
             log.exception("packet could not be decoded")
         else:
+            if packets is None:
+                self.on_packet(packet)
+            else:
+                self.on_batch(packets)
+
+    def decode_packet(self, data):
+        """Decode a packet, return a list of the packet type and body."""
+        packet = dataplane.decode(data)
+        if packet is None:
+            packet = bencode.decode(
+                data,
+                max_depth=constants.M2M_MAX_PACKET_DEPTH,
+                max_elements=constants.M2M_MAX_PACKET_ELEMENTS,
+            )
+        return packet
+
+    def on_batch(self, packets):
+        """Called with a list of encoded packets from a batch packet."""
+        self.peer_batching = True
+        for data in packets:
+            try:
+                packet = self.decode_packet(data)
+            except:
+                log.exception("packet in batch could not be decoded")
+                continue
+            if packet and packet[0] == PacketType.batch:
+                log.warning("ignoring nested batch packet")
+                continue
             self.on_packet(packet)
 
     def sync_identity(self):
@@ -333,7 +817,16 @@ class WSClient(threading.Thread):
 
     def on_disconnected(self):
         """Called when ws socket closes."""
-        self.identity = None
+        # The identity is kept, so the session may be resumed with request_identify
+        if self.disconnect_time is None:
+            self.disconnect_time = time.time()
+        # Packets queued for the old connection are no longer meaningful
+        dropped = self.send_queue.clear()
+        if dropped:
+            log.debug("discarded %s unsent packet(s)", dropped)
+        self.compression_policy.reset()
+        self.chunk_sizer.reset()
+        self.peer_batching = False
         self.clear_callbacks()
         self.hard_close_channels()
 
@@ -345,6 +838,12 @@ class WSClient(threading.Thread):
         except Exception:
             log.exception("packet is badly formatted")
         else:
+            # Route packets bypass the dispatcher
+            if packet_type in _route_types and len(packet_body) == 2:
+                channel, data = packet_body
+                if isinstance(channel, int_types) and isinstance(data, buffer_types):
+                    self.on_route(packet_type, channel, data)
+                    return
             try:
                 packet_type = packets.PacketType(packet_type)
             except Exception:
@@ -352,9 +851,39 @@ class WSClient(threading.Thread):
             else:
                 self.dispatcher.dispatch(packet_type, packet_body)
 
+    def on_route(self, packet_type, channel, data):
+        """Called with the contents of a route or route_control packet."""
+        if packet_type == PacketType.route:
+            # Route data is passed on as a view of the frame
+            self.handle_route(PacketType.route, channel, data)
+        else:
+            # Control data is parsed by the receiver, and should be bytes
+            if isinstance(data, memoryview):
+                data = data.tobytes()
+            self.handle_route_control(PacketType.route_control, channel, data)
+
+    def wait_channel_writable(self, channel, high_watermark, low_watermark, timeout):
+        """Wait for unsent data on a channel to drop below a watermark."""
+        return self.send_queue.wait_drained(
+            channel, high_watermark, low_watermark, timeout
+        )
+
+    def is_channel_writable(self, channel, high_watermark):
+        """Check if a channel has fewer than `high_watermark` bytes unsent."""
+        return self.send_queue.get_channel_size(channel) < high_watermark
+
+    def call_when_channel_writable(
+        self, channel, high_watermark, low_watermark, callback
+    ):
+        """Call `callback` when a channel may be written to."""
+        self.send_queue.call_when_drained(
+            channel, high_watermark, low_watermark, callback
+        )
+
     def channel_write(self, channel, data):
         """Write data to a virtual channel."""
-        self.send(PacketType.request_send, channel=channel, data=data)
+        # Small writes may be coalesced in to a single request_send
+        return self.send_queue.put_data(channel, data)
 
     def on_instruction(self, sender, data):
         """Called with an instruction."""
@@ -363,8 +892,11 @@ class WSClient(threading.Thread):
 
     def channel_control_write(self, channel, control_dict):
         """Send a channel control packet."""
-        control_json = json.dumps(control_dict)
-        self.send(PacketType.request_send_control, channel=channel, data=control_json)
+        control_json = json.dumps(control_dict).encode("utf-8")
+        self.send_bytes(
+            dataplane.encode(PacketType.request_send_control, channel, control_json),
+            channel=channel,
+        )
 
     # --------------------------------------------------------
     # Packet handlers
@@ -388,10 +920,35 @@ class WSClient(threading.Thread):
         """Ping send from the server, send back a pong with the same data."""
         self.send("pong", data=data[:1024])
 
+    @expose(PacketType.pong)
+    def handle_pong(self, packet_type, data):
+        """Response to a ping we sent, containing the time it was sent."""
+        try:
+            rtt = time.time() - float(data)
+        except ValueError:
+            log.debug("unexpected pong data %r", data)
+        else:
+            if rtt >= 0:
+                self.rtt.add(rtt)
+
+    @expose(PacketType.batch)
+    def handle_batch(self, packet_type, packets):
+        """Several packets in one message (not handled by the fast path)."""
+        self.on_batch(packets)
+
     @expose(PacketType.welcome)
     def handle_welcome(self, packet_type):
         """Welcome packet means we can start talking to the m2m server."""
-        pass
+        self.backoff.reset()
+        if self.disconnect_time is not None:
+            resume_time = time.time() - self.disconnect_time
+            self.disconnect_time = None
+            self.resume_times.add(resume_time)
+            log.info("m2m session resumed in %.2f seconds", resume_time)
+
+    def get_resume_stats(self):
+        """Get stats for the time (in seconds) from disconnect to welcome."""
+        return self.resume_times.get_stats()
 
     @expose(PacketType.log)
     def handle_log(self, packet_type, msg):
@@ -434,6 +991,10 @@ class WSClient(threading.Thread):
             channel = self.get_channel(channel_no)
             channel.on_close()
             del self.channels[channel_no]
+        bytes_sent = self.send_queue.forget_channel(channel_no)
+        log.debug("sent %s byte(s) to channel %s", bytes_sent, channel_no)
+        self.compression_policy.forget_channel(channel_no)
+        self.chunk_sizer.forget_channel(channel_no)
 
     @expose(PacketType.notify_login_success)
     def on_login_success(self, packet_type, user):
@@ -4,7 +4,6 @@ from __future__ import print_function, unicode_literals
 
 import logging
 import subprocess
-import threading
 
 from . import constants
 from .compat import PY3
@@ -12,6 +11,7 @@ from .limiter import Limiter
 from .m2m import EchoService, WSClient
 from .m2m.commandservice import CommandService
 from .m2m.fileservice import FileService
+from .m2m.reactor import Reactor
 from .m2m.remoteprocess import RemoteProcess
 
 log = logging.getLogger("m2m")
@@ -36,13 +36,15 @@ class Terminal(object):
             process for process in self.processes if not process.is_closed
         ]
 
-    def launch(self, limiter, channel, size=None):
+    def launch(self, limiter, reactor, channel, size=None):
         """Launch a terminal instance."""
 
         if size is None:
             size = [80, 24]
         self._prune_closed()
         log.debug("opening terminal %s", self.name)
+        # Keep terminals responsive while other channels are busy
+        channel.set_service("terminal")
         remote_process = None
         try:
             remote_process = RemoteProcess(
@@ -63,8 +65,7 @@ class Terminal(object):
         else:
             try:
                 with limiter():
-                    process_thread = threading.Thread(target=remote_process.run)
-                    process_thread.start()
+                    remote_process.start(reactor)
                     log.info("launched remote process %r over %r", self, channel)
             except Exception as error:
                 log.info("unable to launch remote process; %s", error)
@@ -89,13 +90,17 @@ class Terminal(object):
 class M2MManager(object):
     """Manages M2M Services."""
 
+    client_class = WSClient
+
     def __init__(self, client, url, remote_directory, identity=None):
         self.client = client
         self.url = url
         self.identity = identity
         self.terminals = {}
         self.notified_identity = None
-        self.m2m_client = WSClient(self, url, remote_directory)
+        self.m2m_client = self.client_class(self, url, remote_directory)
+        # Reads terminals, commands and port forwards
+        self.reactor = Reactor()
         self.services_limiter = Limiter("services", constants.LIMIT_SERVICES)
         self.terminals_limiter = Limiter("terminals", constants.LIMIT_TERMINALS)
 
@@ -137,6 +142,7 @@ class M2MManager(object):
         log.debug("m2m manager close")
         if self.m2m_client is not None:
             self.m2m_client.close()
+        self.reactor.close()
 
     def add_terminal(self, name, remote_process, user=None, group=None):
         """Add a terminal for a remote process."""
@@ -166,7 +172,7 @@ class M2MManager(object):
             )
         action = data["action"]
         if action == "sync":
-            self.client.sync()
+            self.sync()
         elif action == "open-terminal":
             port = data["port"]
             terminal_name = data["name"]
@@ -182,7 +188,7 @@ class M2MManager(object):
         elif action == "open-portredirect":
             device_port = data["device_port"]
             m2m_port = data["m2m_port"]
-            self.client.port_forward.redirect_port(self.services_limiter, m2m_port, device_port)
+            self.open_portredirect(m2m_port, device_port)
         elif action == "reboot-device":
             self.reboot()
         elif action == "read-file":
@@ -193,6 +199,10 @@ class M2MManager(object):
             self.client.directory_scanner.perform_scan()
         # Unrecognized instructions are ignored
 
+    def sync(self):
+        """Sync with the server."""
+        self.client.sync()
+
     def open_terminal(self, name, port, size=None):
         """Open a new terminal."""
         terminal = self.get_terminal(name)
@@ -200,7 +210,10 @@ class M2MManager(object):
             log.warning("no terminal called '%s'", name)
             return
         terminal.launch(
-            self.terminals_limiter, self.m2m_client.get_channel(port), size=size
+            self.terminals_limiter,
+            self.reactor,
+            self.m2m_client.get_channel(port),
+            size=size,
         )
 
     def open_echo_service(self, port):
@@ -213,6 +226,12 @@ class M2MManager(object):
         """Open a port forward service."""
         self.client.port_forward.open_service(self.services_limiter, service, route)
 
+    def open_portredirect(self, m2m_port, device_port):
+        """Forward a channel to a port on the device."""
+        self.client.port_forward.redirect_port(
+            self.services_limiter, m2m_port, device_port
+        )
+
     def reboot(self):
         """Initiate a reboot."""
         # TODO: consider initiating a graceful shutdown of dpcore that ends in a rebooot
@@ -230,4 +249,4 @@ class M2MManager(object):
     def open_command_service(self, port, command):
         """Open a service that runs a command and sends the stdout over m2m."""
         channel = self.m2m_client.get_channel(port)
-        CommandService(self.services_limiter, channel, command)
+        CommandService(self.services_limiter, self.reactor, channel, command)
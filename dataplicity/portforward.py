@@ -9,25 +9,30 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 from time import time
+import errno
 import logging
-import select
+import os
 import socket
 import threading
 import weakref
 
-from .constants import CHUNK_SIZE, SERVER_BUSY
+from .constants import SERVER_BUSY
 
 
 log = logging.getLogger("pf")
 
 
-class Connection(threading.Thread):
-    """Handles a single remote controlled TCP/IP connection."""
+class Connection(object):
+    """Handles a single remote controlled TCP/IP connection.
 
-    def __init__(self, limiter, close_event, channel, host_port):
+    Data from the socket is read by the reactor thread.
+
+    """
+
+    def __init__(self, limiter, reactor, close_event, channel, host_port):
         """Initialize the connection, set up callbacks."""
-        super(Connection, self).__init__()
         self.limiter = limiter
+        self.reactor = reactor
         self._close_event = close_event
         self.channel = channel
         self.host_port = host_port
@@ -36,9 +41,19 @@ class Connection(threading.Thread):
         self._start_time = time()
         self.socket = None
         self.read_buffer = []  # For data received before we connected
-
+        self.bytes_written = 0
+        self._connecting_socket = None
+        self._connect_timer = None
+        self._finished = False
+        self.channel.set_service("portforward")
+
+        # Data is released once it has been written to the socket, so the
+        # channel pauses while we are connecting or the server is slow
         self.channel.set_callbacks(
-            self.on_channel_data, self.on_channel_close, self.on_channel_control
+            self.on_channel_data,
+            self.on_channel_close,
+            self.on_channel_control,
+            manual_release=True,
         )
 
     @property
@@ -46,71 +61,63 @@ class Connection(threading.Thread):
         """Get a threading.Event object."""
         return self._close_event
 
-    def run(self):
-        """Run the main loop, and decrement limiter."""
-        try:
-            self._run()
-        finally:
-            # Ensure decrement is called if _run throws an exception
-            self.limiter.decrement()
+    def start(self):
+        """Connect to the local server, and start forwarding."""
+        self.reactor.call_soon(self._connect)
 
-    def _run(self):
-        """
-        Main loop, connects to local server, reads data, and writes it to an
-        m2m channel.
-        """
-        bytes_written = 0
-        readable_events = select.POLLIN | select.POLLPRI  # Data in , priority data in
-        error_events = select.POLLERR | select.POLLHUP  #  Error or hang up
-        events = readable_events | error_events
-        poll = select.poll()
+    def _finish(self):
+        """Stop reading, close the channel, and decrement the limiter."""
+        if self._finished:
+            return
+        self._finished = True
         try:
-            # Connect to remote host
-            if not self._connect():
-                return
-
-            poll.register(self.socket.fileno(), events)
-
-            log.debug("entered recv loop")
-            # Read all the data we can and write it to the channel
-            while not self.close_event.is_set():
-                # Block for a period of time until the socket becomes readable,
-                # or there is an error
-                try:
-                    poll_result = poll.poll(5 * 1000)
-                except Exception as error:
-                    # For paranoia only.
-                    log.warning("error in portforward.py poll.poll; %s", error)
-                    break
-                if self.channel.is_closed:
-                    break
-                for _file_descriptor, event_mask in poll_result:
-                    if event_mask & readable_events:
-                        try:
-                            # Reads *up to* BUFFER_SIZE bytes
-                            data = self.socket.recv(CHUNK_SIZE)
-                        except Exception:
-                            log.exception("error in recv")
-                            break
-                        else:
-                            if data:
-                                self.channel.write(data)
-                                bytes_written += len(data)
-                            else:
-                                # No data means the socket has been closed
-                                break
-                    if event_mask & error_events:
-                        # Socket has been closed in another thread, possibly due to
-                        # m2m channel closing
-                        self.close_event.set()
-        finally:
-
-            speed = bytes_written / 1024.0 / (time() - self._start_time)
-            log.debug("left recv loop (read %s bytes) %0.1fKB/s ", bytes_written, speed)
+            self._cancel_connect()
+            if self.socket is not None:
+                self.reactor.remove_reader(self.socket.fileno())
+            speed = self.bytes_written / 1024.0 / (time() - self._start_time)
+            log.debug(
+                "left recv loop (read %s bytes) %0.1fKB/s ",
+                self.bytes_written,
+                speed,
+            )
             # These close methods are a null operation if the objects are
             # already closed
             self.channel.close()
             self._shutdown_read()
+        finally:
+            self.limiter.decrement()
+
+    def _on_readable(self):
+        """Read data from the socket and write it to the channel."""
+        channel = self.channel
+        if self.close_event.is_set() or channel.is_closed:
+            self._finish()
+            return
+        if not channel.is_writable:
+            # Stop reading until the remote end catches up
+            self.reactor.remove_reader(self.socket.fileno())
+            channel.call_when_writable(
+                lambda: self.reactor.call_soon(self._on_writable)
+            )
+            return
+        try:
+            # Reads *up to* the chunk size
+            data = self.socket.recv(channel.get_chunk_size())
+        except Exception:
+            log.exception("error in recv")
+            self._finish()
+            return
+        if data:
+            channel.write(data)
+            self.bytes_written += len(data)
+        else:
+            # No data means the socket has been closed
+            self._finish()
+
+    def _on_writable(self):
+        """Called when the remote end has caught up."""
+        if not self._finished:
+            self.reactor.add_reader(self.socket.fileno(), self._on_readable)
 
     def _shutdown_read(self):
         """Shutdown reading."""
@@ -143,43 +150,62 @@ class Connection(threading.Thread):
                 except Exception:
                     log.exception("error closing socket")
 
-    def connect(self):
-        """Start thread, and connect to local server."""
-        # Connect may block, so do it in a thread
-
-        try:
-            with self.limiter():
-                self.start()
-        except Exception as error:
-            log.warning("unable to start portforard thread; %r", error)
-            self.channel.write(SERVER_BUSY)
-            self.channel.close()
-
     def _connect(self):
-        """Connect to a local server, return True on success."""
+        """Start connecting to a local server, without blocking."""
         _socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         # No Nagle since we are going for as close to realtime as possible
         _socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-        # Set the timeout for initial connect, as default is too high
-        _socket.settimeout(5.0)
+        _socket.setblocking(False)
 
         log.debug("connecting to %s:%d", *self.host_port)
         try:
-            _socket.connect(self.host_port)
-        except socket.timeout:
-            log.error("timed out connecting to server")
-            return False
-        except IOError as e:
-            log.error("IO Error when connecting, %s", e)
-            return False
+            error = _socket.connect_ex(self.host_port)
         except Exception:
             log.exception("error connecting")
-            return False
-        else:
-            log.debug("connected to %s:%d", *self.host_port)
+            error = errno.EIO
+        if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            log.error("IO Error when connecting, %s", os.strerror(error))
+            _socket.close()
+            self._finish()
+            return
+        self._connecting_socket = _socket
+        # The default timeout is too high
+        self._connect_timer = self.reactor.call_later(5.0, self._on_connect_timeout)
+        self.reactor.add_writer(_socket.fileno(), self._on_connect)
+
+    def _cancel_connect(self):
+        """Stop connecting, if a connect is in progress."""
+        _socket = self._connecting_socket
+        if _socket is not None:
+            self._connecting_socket = None
+            self._connect_timer.cancel()
+            self.reactor.remove_writer(_socket.fileno())
+            _socket.close()
+
+    def _on_connect_timeout(self):
+        log.error("timed out connecting to server")
+        self._finish()
+
+    def _on_connect(self):
+        """Called when the connect has completed."""
+        _socket = self._connecting_socket
+        self._connecting_socket = None
+        self._connect_timer.cancel()
+        self.reactor.remove_writer(_socket.fileno())
+        error = _socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if error:
+            log.error("IO Error when connecting, %s", os.strerror(error))
+            _socket.close()
+            self._finish()
+            return
+        log.debug("connected to %s:%d", *self.host_port)
+        # Writes from the channel block, with the same timeout as the connect
+        _socket.settimeout(5.0)
+        with self._lock:
             self.socket = _socket
             self._flush_buffer()
-            return True
+        log.debug("entered recv loop")
+        self.reactor.add_reader(_socket.fileno(), self._on_readable)
 
     def on_channel_data(self, data):
         """Called by m2m channel."""
@@ -194,17 +220,16 @@ class Connection(threading.Thread):
                     for chunk in self.read_buffer:
                         self.socket.sendall(chunk)
                 finally:
+                    self.channel.release(sum(len(chunk) for chunk in self.read_buffer))
                     del self.read_buffer[:]
 
     def on_channel_close(self):
         """Called when the channel has been closed."""
         log.debug("channel close")
         with self._lock:
-            # Shut down the socket
-            # This will cause an exceptional condition in the select loop,
-            # which will subsequently exit cleanly
             self._flush_buffer()
             self._shutdown_write()
+        self.reactor.call_soon(self._finish)
 
     def on_channel_control(self, data):
         """Called when the remote end sends a control packet (currently not used)."""
@@ -256,7 +281,11 @@ class Service(object):
             with limiter():
                 with self._lock:
                     connection = Connection(
-                        limiter, self.close_event, channel, self.host_port
+                        limiter,
+                        self.m2m.reactor,
+                        self.close_event,
+                        channel,
+                        self.host_port,
                     )
                 connection.start()
         except Exception as error:
@@ -349,11 +378,12 @@ class PortForwardManager(object):
             with limiter():
                 Connection(
                     limiter,
+                    reactor=self.m2m.reactor,
                     close_event=self.close_event,
                     channel=channel,
                     host_port=("127.0.0.1", device_port),
                 ).start()
         except Exception as error:
-            log.warning("unable to start portforard thread; %r", error)
+            log.warning("unable to start portforward; %r", error)
             channel.write(SERVER_BUSY)
             channel.close()
@@ -1,4 +1,6 @@
 __all__ = [
+    "compression",
+    "loadtest",
     "run",
     "version",
 ]
@@ -0,0 +1,47 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+
+import multiprocessing
+
+from ..m2m.deflate import PROFILES, measure_profile
+from ..subcommand import SubCommand
+
+
+class Compression(SubCommand):
+    """Measure the memory used by each websocket compression profile"""
+
+    help = """Measure memory used by compression profiles"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--connections",
+            type=int,
+            default=32,
+            help="Number of connections to average over",
+        )
+
+    def run(self):
+        # Typical terminal / log output
+        data = b"".join(
+            b"%d: dataplicity agent compression profile test line\n" % line
+            for line in range(2048)
+        )
+        for name, profile in sorted(PROFILES.items()):
+            # Measure in a new process, so memory freed by one profile isn't
+            # re-used by the next
+            pool = multiprocessing.Pool(1)
+            try:
+                result = pool.apply(
+                    measure_profile, (profile, data, self.args.connections)
+                )
+            finally:
+                pool.terminate()
+            rss = result["rss"]
+            print(
+                "{:<12} {:>8} per connection, ratio {:.3f}, {:.2f}ms per message".format(
+                    name,
+                    "unknown" if rss is None else "{:.1f}KB".format(rss / 1024.0),
+                    result["ratio"],
+                    result["time"] * 1000.0,
+                )
+            )
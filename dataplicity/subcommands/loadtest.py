@@ -0,0 +1,69 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+
+from ..subcommand import SubCommand
+
+
+class Loadtest(SubCommand):
+    """Run the agent against a local stand-in m2m server under load"""
+
+    help = """Measure agent throughput, latency and resources under load"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--terminals", type=int, default=4, help="Number of terminals"
+        )
+        parser.add_argument(
+            "--portforwards",
+            type=int,
+            default=4,
+            help="Number of port forward connections",
+        )
+        parser.add_argument(
+            "--files", type=int, default=4, help="Number of file reads"
+        )
+        parser.add_argument(
+            "--commands", type=int, default=4, help="Number of commands to run"
+        )
+        parser.add_argument(
+            "--round-trips",
+            dest="round_trips",
+            type=int,
+            default=50,
+            help="Commands typed in to each terminal",
+        )
+        parser.add_argument(
+            "--size",
+            type=int,
+            default=1024 * 1024,
+            help="Bytes sent by each port forward, file and command",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=60.0,
+            help="Maximum time for each operation, in seconds",
+        )
+        parser.add_argument(
+            "--engine",
+            choices=["threads", "asyncio"],
+            default="threads",
+            help="Agent engine to test",
+        )
+
+    def run(self):
+        # The harness pulls in the stand-in server, so only import it when used
+        from ..loadtest import LoadTest, format_results
+
+        args = self.args
+        load_test = LoadTest(
+            terminals=args.terminals,
+            portforwards=args.portforwards,
+            files=args.files,
+            commands=args.commands,
+            round_trips=args.round_trips,
+            size=args.size,
+            timeout=args.timeout,
+            engine=args.engine,
+        )
+        print(format_results(load_test.run()))
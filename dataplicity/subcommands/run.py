@@ -1,6 +1,7 @@
 from __future__ import unicode_literals
 from __future__ import print_function
 
+from .. import constants
 from ..subcommand import SubCommand
 
 
@@ -9,6 +10,14 @@ class Run(SubCommand):
 
     help = """Run dataplicity agent"""
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--engine",
+            choices=["threads", "asyncio"],
+            default=constants.M2M_ENGINE,
+            help="Run services in threads, or as coroutines with asyncio",
+        )
+
     def run(self):
         client = self.app.make_client()
         client.run_forever()
@@ -31,6 +31,7 @@ install_requires = [
 if sys.version_info < (3, 4):
     install_requires.append("six==1.10.0")
     install_requires.append("enum34==1.1.6")
+    install_requires.append("selectors2==2.0.2")
 else:
     install_requires.append("six==1.16.0")
 
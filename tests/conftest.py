@@ -1,7 +1,15 @@
+import sys
+
 import pytest
 from mock import patch
 
 
+# The asyncio engine requires Python 3.7+, and won't compile on Python 2
+collect_ignore = []
+if sys.version_info < (3, 7):
+    collect_ignore.append("dataplicity/m2m/test_aioclient.py")
+
+
 @pytest.fixture
 def serial_file(tmpdir):
     """ fixture for creating an fake serial file
@@ -0,0 +1,116 @@
+import asyncio
+import json
+
+from mock import Mock
+
+from dataplicity.aiomanager import AsyncM2MManager
+from dataplicity.m2m.aioclient import AsyncChannel
+from dataplicity.m2m.sendqueue import SendQueue
+from dataplicity.m2m.standin import StandInServer
+
+
+class FakeClient(object):
+    """ stands in for AsyncWSClient
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self.send_queue = SendQueue()
+        self.paused_channels = set()
+        self.controls = []
+        self.closed = []
+
+    def channel_write(self, number, data):
+        self.send_queue.put_data(number, data)
+
+    def channel_control_write(self, number, control):
+        self.controls.append(control)
+
+    def close_channel(self, number):
+        self.closed.append(number)
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_channel_stream():
+    async def test():
+        client = FakeClient(asyncio.get_running_loop())
+        channel = AsyncChannel(client, 1)
+        channel.on_data(b'hello, ')
+        channel.on_data(memoryview(b'world'))
+        channel.on_close()
+        assert await channel.reader.read() == b'hello, world'
+        assert channel.is_closed
+    run(test())
+
+
+def test_channel_write_pauses():
+    """ the writer pauses when there is too much unsent data
+    """
+    async def test():
+        client = FakeClient(asyncio.get_running_loop())
+        channel = AsyncChannel(client, 1, high_watermark=8, low_watermark=4)
+        channel.writer.write(b'12345678')
+        drain = asyncio.ensure_future(channel.writer.drain())
+        await asyncio.sleep(0)
+        assert not drain.done()
+        assert channel in client.paused_channels
+        client.send_queue.get()
+        channel.update_writing()
+        await asyncio.wait_for(drain, 1)
+        assert not client.paused_channels
+    run(test())
+
+
+def test_channel_remote_pause():
+    async def test():
+        client = FakeClient(asyncio.get_running_loop())
+        channel = AsyncChannel(client, 1)
+        channel.on_control(json.dumps({'type': 'pause'}).encode('utf-8'))
+        drain = asyncio.ensure_future(channel.writer.drain())
+        await asyncio.sleep(0)
+        assert not drain.done()
+        channel.on_control(json.dumps({'type': 'resume'}).encode('utf-8'))
+        await asyncio.wait_for(drain, 1)
+        # other controls go to the callback
+        controls = []
+        channel.set_control_callback(controls.append)
+        channel.on_control(b'{"type": "window_resize"}')
+        assert controls == [b'{"type": "window_resize"}']
+    run(test())
+
+
+def test_channel_read_pauses():
+    """ the remote end is asked to pause when too much data is buffered
+    """
+    async def test():
+        client = FakeClient(asyncio.get_running_loop())
+        channel = AsyncChannel(client, 1, high_watermark=8)
+        channel.on_data(b'x' * 16)
+        assert client.controls == [{'type': 'pause'}]
+        await channel.reader.read(16)
+        assert client.controls == [{'type': 'pause'}, {'type': 'resume'}]
+        channel.close()
+        channel.close()
+        assert client.closed == [1]
+    run(test())
+
+
+def test_echo():
+    """ an instruction starts a service, over a real connection
+    """
+    with StandInServer() as server:
+        manager = AsyncM2MManager(Mock(), server.url, None)
+        manager.m2m_client.start()
+        try:
+            connection = server.wait_welcome(10)
+            assert connection is not None
+            channel = connection.open_channel()
+            connection.send_instruction(action='open-echo', port=channel.port)
+            channel.write(b'hello, asyncio')
+            assert channel.wait_for(b'hello, asyncio', 10)
+        finally:
+            manager.close()
+            manager.m2m_client.join(10)
+    assert not manager.m2m_client.is_alive()
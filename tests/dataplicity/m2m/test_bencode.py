@@ -1,6 +1,12 @@
 # -*- coding: utf-8
-from dataplicity.m2m.bencode import encode, decode, EncodingError, DecodeError
+from dataplicity.m2m.bencode import (
+    encode, encode_into, decode, EncodingError, DecodeError, DecoderError,
+    IncrementalDecoder
+)
+import time
+
 import pytest
+import six
 
 
 def test_bencode_encoder():
@@ -42,7 +48,215 @@ def test_bencode_decoder():
         b'foo': b'bar', b'fooo': b'bbar'}
     with pytest.raises(DecodeError) as exc:
         decode(b'i.123e')
-    assert str(exc.value) == 'illegal digit in size'
+    assert exc.value.code == DecoderError.ILLEGAL_DIGIT
     assert decode(b'le') == []
     assert decode(b'li1ei2ee') == [1, 2]
     assert decode(b'13:aaaaaaaaaaa\xc5\xbc') == b'aaaaaaaaaaa\xc5\xbc'
+
+
+def test_bencode_decoder_rejects_truncated_input():
+    """ truncated strings and containers raise DecodeError rather than
+        returning partial data
+    """
+    with pytest.raises(DecodeError):
+        decode(b'5:abc')
+    with pytest.raises(DecodeError):
+        decode(b'li1ei2e')
+    with pytest.raises(DecodeError):
+        decode(b'i12')
+    with pytest.raises(DecodeError):
+        decode(b'x:abc')
+
+
+@pytest.mark.parametrize("size", [1024, 64 * 1024, 1024 * 1024])
+def test_bencode_decode_route_throughput(size):
+    """ benchmark decoding of route packets (run with -s to see throughput)
+    """
+    payload = b'\xff' * size
+    packet = encode([6, 1234, payload])
+    iterations = max(16, (16 * 1024 * 1024) // size)
+    start = time.time()
+    for _ in range(iterations):
+        decode(packet)
+    elapsed = max(time.time() - start, 1e-9)
+    print(
+        "\ndecode {}KB route packet: {:.0f} packets/s, {:.1f} MB/s".format(
+            size // 1024,
+            iterations / elapsed,
+            iterations * len(packet) / elapsed / (1024 * 1024),
+        )
+    )
+    assert decode(packet) == [6, 1234, payload]
+
+
+def test_bencode_decoder_zero_copy():
+    """ zero copy decoding returns memoryviews of the original data, except
+        for dict keys
+    """
+    data = encode([6, 1, b'payload', {b'key': b'value'}])
+    packet_type, channel, payload, mapping = decode(data, zero_copy=True)
+    assert packet_type == 6
+    assert channel == 1
+    assert isinstance(payload, memoryview)
+    if not six.PY2:
+        # Python 2 memoryviews don't reference their object
+        assert payload.obj is data
+    assert payload.tobytes() == b'payload'
+    key, = mapping.keys()
+    assert isinstance(key, bytes)
+    assert mapping[b'key'].tobytes() == b'value'
+    # memoryviews may be re-encoded
+    assert encode([6, 1, payload]) == encode([6, 1, b'payload'])
+
+
+def test_bencode_encode_into():
+    """ encode_into appends to an existing bytearray
+    """
+    buffer = bytearray(b'xx')
+    encode_into([6, 1, b'abc', memoryview(b'de')], buffer)
+    assert buffer == b'xxli6ei1e3:abc2:dee'
+    encode_into({b'a': 'ż'}, buffer)
+    assert buffer == b'xxli6ei1e3:abc2:deed1:a2:\xc5\xbce'
+
+
+def test_incremental_decoder():
+    """ objects are yielded as soon as they are complete, regardless of how
+        the input is split
+    """
+    objs = [
+        [6, 1, b'x' * 100],
+        {b'a': [1, -2, b''], b'b': {}},
+        b'',
+        [16, b'sender', {b'action': b'sync'}],
+    ]
+    data = b''.join(encode(obj) for obj in objs)
+
+    decoder = IncrementalDecoder()
+    assert list(decoder.feed(data)) == objs
+    assert not decoder.pending
+
+    for chunk_size in (1, 2, 3, 7, 64):
+        decoder = IncrementalDecoder()
+        decoded = []
+        for pos in range(0, len(data), chunk_size):
+            decoded.extend(decoder.feed(data[pos:pos + chunk_size]))
+        assert decoded == objs
+        assert not decoder.pending
+
+    decoder = IncrementalDecoder()
+    assert list(decoder.feed(b'li6ei1e5:ab')) == []
+    assert decoder.pending
+    assert list(decoder.feed(b'cdee3:')) == [[6, 1, b'abcde']]
+    assert list(decoder.feed(memoryview(b'xyz'))) == [b'xyz']
+
+
+def test_incremental_decoder_buffers():
+    """ strings split over chunks of any type decode to bytes
+    """
+    data = encode([b'hello world', 42, {b'k': b'value'}])
+    for chunk_type in (bytes, bytearray, memoryview):
+        decoder = IncrementalDecoder()
+        decoded = []
+        for pos in range(0, len(data), 3):
+            decoded.extend(decoder.feed(chunk_type(data[pos:pos + 3])))
+        assert decoded == [[b'hello world', 42, {b'k': b'value'}]]
+        assert isinstance(decoded[0][0], bytes)
+
+
+def test_incremental_decoder_max_string():
+    """ large size prefixes are rejected before buffering anything
+    """
+    with pytest.raises(DecoderError) as error:
+        list(IncrementalDecoder().feed(b'99999999999:abc'))
+    assert error.value.code == DecoderError.MAX_SIZE_REACHED
+    with pytest.raises(DecoderError) as error:
+        list(IncrementalDecoder(max_string=4).feed(b'5:'))
+    assert error.value.code == DecoderError.MAX_SIZE_REACHED
+
+    decoder = IncrementalDecoder()
+    assert list(decoder.feed(b'1000:abc')) == []
+    assert len(decoder._string) == 3
+
+
+def test_incremental_decoder_errors():
+    """ invalid input raises DecodeError
+    """
+    with pytest.raises(DecodeError):
+        list(IncrementalDecoder().feed(b'e'))
+    with pytest.raises(DecodeError):
+        list(IncrementalDecoder().feed(b'x'))
+    with pytest.raises(DecodeError):
+        list(IncrementalDecoder().feed(b'i1.5e'))
+    with pytest.raises(DecodeError):
+        list(IncrementalDecoder().feed(b'di1ei2ee'))
+    with pytest.raises(DecodeError):
+        list(IncrementalDecoder(max_token=4).feed(b'i12345'))
+
+
+LIMIT_CASES = [
+    (b'05:hello', {}, DecoderError.PRECEDING_ZERO_IN_SIZE),
+    (b'5x:hello', {}, DecoderError.ILLEGAL_DIGIT_IN_SIZE),
+    (b'i03e', {}, DecoderError.ILLEGAL_DIGIT),
+    (b'i-0e', {}, DecoderError.ILLEGAL_DIGIT),
+    (b'i1x5e', {}, DecoderError.ILLEGAL_DIGIT),
+    (b'x', {}, DecoderError.INVALID_INPUT),
+    (b'dli1ee1:ae', {}, DecoderError.INVALID_INPUT),
+    (b'di1e1:ae', {}, DecoderError.INVALID_INPUT),
+    (b'9' * 30 + b':', {}, DecoderError.MAX_SIZE_REACHED),
+    (b'5:hello', {'max_string': 4}, DecoderError.MAX_SIZE_REACHED),
+    (b'5:hello', {'max_size': 6}, DecoderError.MAX_SIZE_REACHED),
+    (b'llleee', {'max_depth': 2}, DecoderError.MAX_DEPTH_REACHED),
+    (b'l' * 10000, {}, DecoderError.MAX_DEPTH_REACHED),
+    (b'li1ei2ei3ee', {'max_elements': 3}, DecoderError.MAX_ELEMENTS_REACHED),
+    (b'd1:ai1ee', {'max_elements': 2}, DecoderError.MAX_ELEMENTS_REACHED),
+]
+
+
+@pytest.mark.parametrize("data, kwargs, code", LIMIT_CASES)
+def test_bencode_decoder_limits(data, kwargs, code):
+    """ malformed or oversized input raises DecoderError with the appropriate
+        code
+    """
+    with pytest.raises(DecoderError) as exc:
+        decode(data, **kwargs)
+    assert exc.value.code == code
+    # DecoderError is also a DecodeError
+    assert isinstance(exc.value, DecodeError)
+
+
+def test_bencode_decoder_within_limits():
+    data = b'lli1ee5:helloe'
+    assert decode(
+        data, max_depth=2, max_string=5, max_elements=4, max_size=len(data)
+    ) == [[1], b'hello']
+    assert decode(b'i0e') == 0
+
+
+@pytest.mark.parametrize("data, kwargs, code", LIMIT_CASES)
+def test_incremental_decoder_same_limits(data, kwargs, code):
+    """ the incremental decoder applies the same limits as decode, however
+        the data is split
+    """
+    for chunk_size in (1, len(data)):
+        decoder = IncrementalDecoder(**kwargs)
+        with pytest.raises(DecoderError) as exc:
+            for pos in range(0, len(data), chunk_size):
+                list(decoder.feed(data[pos:pos + chunk_size]))
+        assert exc.value.code == code
+
+
+def test_incremental_decoder_limits_per_object():
+    """ max_elements and max_size apply to each top level object
+    """
+    data = b'lli1ee5:helloe'
+    decoder = IncrementalDecoder(max_elements=4, max_size=len(data))
+    assert list(decoder.feed(data * 3)) == [[[1], b'hello']] * 3
+
+
+def test_incremental_decoder_limits():
+    with pytest.raises(DecoderError) as exc:
+        list(IncrementalDecoder(max_string=4).feed(b'5:'))
+    assert exc.value.code == DecoderError.MAX_SIZE_REACHED
+    with pytest.raises(DecoderError) as exc:
+        list(IncrementalDecoder(max_depth=1).feed(b'll'))
+    assert exc.value.code == DecoderError.MAX_DEPTH_REACHED
@@ -0,0 +1,65 @@
+import threading
+import time
+
+from dataplicity.m2m.callbacks import CallbackRegistry
+
+
+def test_call():
+    callbacks = CallbackRegistry()
+    results = []
+    callbacks.add(1, results.append)
+    callbacks.add(1, results.append)
+    callbacks.add(2, results.append)
+    assert len(callbacks) == 3
+    callbacks.call(1, 'foo')
+    assert results == ['foo', 'foo']
+    assert len(callbacks) == 1
+    # called only once
+    callbacks.call(1, 'bar')
+    assert results == ['foo', 'foo']
+    assert callbacks.get_stats() == {'outstanding': 1, 'expired': 0, 'completed': 2}
+    callbacks.close()
+
+
+def test_clear():
+    callbacks = CallbackRegistry()
+    results = []
+    callbacks.add(1, results.append)
+    callbacks.add(2, results.append)
+    callbacks.clear()
+    assert results == [None, None]
+    assert len(callbacks) == 0
+    callbacks.call(1, 'foo')
+    assert results == [None, None]
+    callbacks.close()
+
+
+def test_expire():
+    callbacks = CallbackRegistry(timeout=100)
+    results = []
+    callbacks.add(1, results.append, timeout=10)
+    callbacks.add(2, results.append)
+    callbacks.call(2, 'foo')
+    assert callbacks.expire(time.time() + 50) == 1
+    assert results == ['foo', None]
+    assert callbacks.get_stats() == {'outstanding': 0, 'expired': 1, 'completed': 1}
+    callbacks.close()
+
+
+def test_timer_expires_callbacks():
+    callbacks = CallbackRegistry()
+    expired = threading.Event()
+    callbacks.add(1, lambda result: expired.set(), timeout=60)
+    callbacks.add(2, lambda result: expired.set(), timeout=0.05)
+    assert expired.wait(5)
+    assert callbacks.get_stats()['expired'] == 1
+    callbacks.close()
+
+
+def test_heap_is_compacted():
+    callbacks = CallbackRegistry()
+    for command_id in range(1000):
+        callbacks.add(command_id, lambda result: None)
+        callbacks.call(command_id, None)
+    assert len(callbacks._heap) <= 65
+    callbacks.close()
@@ -0,0 +1,60 @@
+from dataplicity.m2m.chunksize import ChunkSizer
+
+
+def feed(sizer, channel, rate, seconds=1.0, backlogged=True):
+    """ send data at a fixed rate, in 10ms steps
+    """
+    steps = int(seconds * 100)
+    for step in range(steps + 1):
+        sizer.on_sent(channel, int(rate / 100), backlogged, now=step / 100.0)
+
+
+def test_initial_size():
+    sizer = ChunkSizer(initial_size=8192)
+    assert sizer.get_size(1) == 8192
+
+
+def test_size_from_rate():
+    """ reads are sized to what the channel sends in the target latency
+    """
+    sizer = ChunkSizer(target_latency=0.1, max_size=1024 * 1024)
+    feed(sizer, 1, 100 * 1024)
+    assert sizer.get_size(1) == 10 * 1024
+    # fast channel grows, no more than twice per read
+    feed(sizer, 2, 100 * 1024 * 1024)
+    assert sizer.get_size(2) == 128 * 1024
+    assert sizer.get_size(2) == 256 * 1024
+    for _ in range(10):
+        size = sizer.get_size(2)
+    assert size == 1024 * 1024
+
+
+def test_limits():
+    sizer = ChunkSizer(min_size=4096, max_size=65536)
+    feed(sizer, 1, 1024)
+    assert sizer.get_size(1) == 4096
+    stats = sizer.get_stats()
+    assert stats[1]['size'] == 4096
+    assert stats[1]['decreases'] == 1
+
+
+def test_rate_measured_when_backlogged():
+    """ the rate isn't measured while data is sent as fast as it is produced
+    """
+    sizer = ChunkSizer()
+    feed(sizer, 1, 1024, backlogged=False)
+    assert sizer.get_stats()[1]['rate'] is None
+
+
+def test_no_growth_when_queue_is_slow():
+    sizer = ChunkSizer(target_latency=0.1, initial_size=8192)
+    feed(sizer, 1, 100 * 1024 * 1024)
+    assert sizer.get_size(1, latency=0.5) == 8192
+    assert sizer.get_size(1, latency=0.0) == 16384
+
+
+def test_forget_channel():
+    sizer = ChunkSizer()
+    sizer.get_size(1)
+    sizer.forget_channel(1)
+    assert sizer.get_stats() == {}
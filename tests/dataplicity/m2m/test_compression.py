@@ -0,0 +1,53 @@
+import os
+
+from dataplicity.m2m.compression import (
+    COMPRESS_ALWAYS,
+    COMPRESS_NEVER,
+    CompressionPolicy,
+)
+
+
+def test_compress_auto():
+    policy = CompressionPolicy()
+    assert policy.should_compress(1, b'hello, world ' * 100)
+    assert not policy.should_compress(2, os.urandom(4096))
+    # small packets are always compressed
+    assert policy.should_compress(2, os.urandom(16))
+
+
+def test_compress_resample():
+    """ the decision for a channel is reused until it is resampled
+    """
+    policy = CompressionPolicy(resample_interval=2)
+    assert not policy.should_compress(1, os.urandom(4096))
+    assert not policy.should_compress(1, b'hello, world ' * 100)
+    assert policy.should_compress(1, b'hello, world ' * 100)
+
+
+def test_compress_modes():
+    policy = CompressionPolicy()
+    policy.set_channel_mode(1, COMPRESS_ALWAYS)
+    policy.set_channel_mode(2, COMPRESS_NEVER)
+    assert policy.should_compress(1, os.urandom(4096))
+    assert not policy.should_compress(2, b'hello, world ' * 100)
+    policy.forget_channel(1)
+    assert not policy.should_compress(1, os.urandom(4096))
+
+
+def test_compression_stats():
+    policy = CompressionPolicy()
+    policy.on_compressed(1, 100, 25, 0.5)
+    policy.on_skipped(1, 100)
+    policy.on_skipped(None, 10)
+    stats = policy.get_stats()
+    assert stats[1] == {
+        'packets': 2,
+        'skipped': 1,
+        'bytes_in': 200,
+        'bytes_out': 125,
+        'ratio': 0.625,
+        'compress_time': 0.5,
+    }
+    assert stats[None]['packets'] == 1
+    policy.reset()
+    assert policy.get_stats() == {}
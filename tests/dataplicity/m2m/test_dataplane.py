@@ -0,0 +1,69 @@
+import pytest
+from dataplicity.m2m import bencode, dataplane
+from dataplicity.m2m.packets import M2MPacket, PacketType
+
+
+@pytest.mark.parametrize("packet_type", dataplane.DATA_PACKET_TYPES)
+def test_encode_matches_generic_packets(packet_type):
+    """ the data-plane codec should produce the same bytes as the generic
+        packet classes
+    """
+    for data in (b'', b'hello', b'\x00' * 70000):
+        packet = M2MPacket.create(packet_type, channel=42, data=data)
+        assert dataplane.encode(packet_type, 42, data) == packet.encode_binary()
+    assert dataplane.encode(packet_type, 1, memoryview(b'abc')) == \
+        bencode.encode([packet_type.value, 1, b'abc'])
+
+
+@pytest.mark.parametrize("packet_type", dataplane.DATA_PACKET_TYPES)
+def test_decode(packet_type):
+    frame = bencode.encode([packet_type.value, 42, b'hello'])
+    decoded_type, channel, data = dataplane.decode(frame)
+    assert decoded_type == packet_type
+    assert channel == 42
+    assert isinstance(data, memoryview)
+    assert data == b'hello'
+
+
+@pytest.mark.parametrize("frame", [
+    b'',
+    b'le',
+    b'li3ee',
+    b'li6ee',
+    b'li6ei1e',
+    b'li6ei1e5:hell',
+    b'li6ei1e5:helloe ',
+    b'li6ei1e5:hello',
+    b'li6ei-1e5:helloe',
+    b'li6ei1e5:helloi2ee',
+    b'li6e5:helloi2ee',
+    b'li6ei1ex:helloe',
+    b'li16e6:sender1:xe',
+])
+def test_decode_rejects_other_frames(frame):
+    """ anything other than a well formed data-plane packet returns None
+    """
+    assert dataplane.decode(frame) is None
+
+
+def test_batch():
+    packets = [b'li7ee', b'', dataplane.encode(PacketType.route, 1, b'x' * 100)]
+    frame = dataplane.encode_batch(packets)
+    assert frame == bencode.encode([PacketType.batch.value, packets])
+    assert dataplane.decode_batch(frame) == packets
+    assert dataplane.decode_batch(bytearray(frame)) == packets
+    assert dataplane.decode_batch(dataplane.encode_batch([])) == []
+    assert dataplane.decode_batch(frame, max_packets=2) is None
+
+
+@pytest.mark.parametrize("frame", [
+    b'',
+    b'li33ee',
+    b'li33el5:li7eee',
+    b'li33el4:li7ee',
+    b'li33el4:li7ei1ee',
+    b'li33elx:li7eee',
+    b'li6ei1e5:helloe',
+])
+def test_decode_batch_rejects_other_frames(frame):
+    assert dataplane.decode_batch(frame) is None
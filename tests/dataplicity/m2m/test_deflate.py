@@ -0,0 +1,68 @@
+import pytest
+from lomond.compression import Deflate
+from lomond.frame import Frame
+from lomond.opcode import Opcode
+
+from dataplicity.m2m.deflate import (
+    PROFILES,
+    ProfileWebSocket,
+    get_profile,
+    measure_profile,
+)
+
+
+def test_get_profile():
+    assert get_profile('default').window_bits == 15
+    assert get_profile('off') is None
+    with pytest.raises(ValueError):
+        get_profile('nope')
+
+
+def test_extension_header():
+    assert PROFILES['minimal'].extension_header == (
+        b'permessage-deflate; client_max_window_bits=9; '
+        b'client_no_context_takeover; server_max_window_bits=9; '
+        b'server_no_context_takeover, '
+        b'permessage-deflate; client_max_window_bits=9; '
+        b'client_no_context_takeover'
+    )
+
+
+def test_websocket_negotiates_profile():
+    profile = PROFILES['low-memory']
+    websocket = ProfileWebSocket('ws://localhost/', profile)
+    request = websocket.build_request()
+    assert request.count(b'Sec-WebSocket-Extensions') == 1
+    assert profile.extension_header in request
+
+    # server accepts the fallback offer
+    extensions = websocket.process_extensions(
+        ['permessage-deflate; client_max_window_bits=11']
+    )
+    assert extensions == {'permessage-deflate'}
+    compression = websocket.state.compression
+    assert compression.compress_wbits == 11
+    assert compression.decompress_wbits == 15
+    assert compression.mem_level == 4
+    assert not compression.reset_compress
+
+
+def test_profile_round_trip():
+    """ data compressed with a profile can be decompressed by the server
+    """
+    profile = PROFILES['minimal']
+    deflate = profile.make_deflate(profile.options)
+    assert deflate.reset_compress
+    server = Deflate(9, 9, True, True)
+    data = b'hello, world ' * 1000
+    for _ in range(2):
+        compressed = deflate.compress(data)
+        assert len(compressed) < len(data)
+        frame = Frame(Opcode.BINARY, payload=compressed)
+        assert server.decompress([frame]) == data
+
+
+def test_measure_profile():
+    result = measure_profile(PROFILES['default'], b'hello, world ' * 1000, 2)
+    assert result['ratio'] < 0.5
+    assert result['rss'] is None or result['rss'] >= 0
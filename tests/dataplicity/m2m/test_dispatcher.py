@@ -0,0 +1,79 @@
+import pytest
+from dataplicity.m2m.dispatcher import Dispatcher, PacketFormatError, expose
+from dataplicity.m2m.packetbase import PacketFormatError as PacketBodyError
+from dataplicity.m2m.packets import M2MPacket, PacketType
+
+
+class Handler(object):
+
+    def __init__(self):
+        self.calls = []
+
+    @expose(PacketType.route)
+    def on_route(self, packet_type, channel, data):
+        self.calls.append((packet_type, channel, data))
+
+    @expose(PacketType.ping)
+    def on_ping(self, packet_type, data, extra):
+        self.calls.append((packet_type, data, extra))
+
+    @expose(PacketType.log)
+    def on_log(self, packet_type):
+        self.calls.append((packet_type,))
+
+    @expose(PacketType.command_log)
+    def on_command_log(self, packet_type, *args, **kwargs):
+        self.calls.append((packet_type, args, kwargs))
+
+
+@pytest.fixture
+def handler():
+    return Handler()
+
+
+@pytest.fixture
+def dispatcher(handler):
+    return Dispatcher(packet_cls=M2MPacket, handler_instance=handler)
+
+
+def test_dispatch(dispatcher, handler):
+    dispatcher.dispatch(PacketType.route, [1, b'data'])
+    assert handler.calls == [(PacketType.route, 1, b'data')]
+
+
+def test_dispatch_handler_with_fewer_arguments(dispatcher, handler):
+    """ attributes beyond the handler's named arguments are passed by keyword
+    """
+    dispatcher.dispatch(PacketType.command_log, [1, b'node', b'text'])
+    assert handler.calls == [
+        (PacketType.command_log, (1, b'node'), {'text': b'text'})
+    ]
+
+
+def test_dispatch_handler_with_wrong_signature(dispatcher, handler):
+    with pytest.raises(PacketFormatError):
+        dispatcher.dispatch(PacketType.ping, [b'data'])
+    with pytest.raises(PacketFormatError):
+        dispatcher.dispatch(PacketType.log, [b'text'])
+    assert handler.calls == []
+
+
+def test_dispatch_malformed_packet(dispatcher, handler):
+    with pytest.raises(PacketBodyError):
+        dispatcher.dispatch(PacketType.route, [1])
+    with pytest.raises(PacketBodyError):
+        dispatcher.dispatch(PacketType.route, [b'1', b'data'])
+    assert handler.calls == []
+
+
+def test_dispatch_missing_handler(dispatcher, handler, mocker):
+    on_missing_handler = mocker.patch.object(dispatcher, 'on_missing_handler')
+    dispatcher.dispatch(PacketType.pong, [b'data'])
+    assert on_missing_handler.called
+    assert handler.calls == []
+
+
+def test_disabled_dispatcher(dispatcher, handler):
+    dispatcher.disable()
+    dispatcher.dispatch(PacketType.route, [1, b'data'])
+    assert handler.calls == []
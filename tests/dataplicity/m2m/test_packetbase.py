@@ -115,3 +115,35 @@ def test_get_method_args(cmd):
     args, kwargs = cmd.get_method_args(3)
 
     assert len(args) + len(kwargs.keys()) == len(cmd.attributes)
+
+
+def test_packets_have_slots():
+    """ packets store their attributes in slots, and have no __dict__
+    """
+    packet = PingPacket(data=b'foo')
+    assert not hasattr(packet, '__dict__')
+    assert PingPacket.__slots__ == ('data',)
+    with pytest.raises(AttributeError):
+        packet.foo = 1
+
+
+def test_compiled_packet_methods(cmd):
+    """ the compiled __init__ and encode behave like the generic versions
+    """
+    assert cmd.encode() == [
+        CommandSendInstructionPacket.type.value,
+        cmd.command_id,
+        b'\x01\x02',
+        cmd.data
+    ]
+    # text is encoded as utf-8
+    assert PingPacket(u'\u017c').data == b'\xc5\xbc'
+    # positional and keyword arguments may be mixed, extra arguments are
+    # ignored
+    packet = CommandSendInstructionPacket(1, b'node', data={}, extra=2)
+    assert packet.kwargs == {'command_id': 1, 'node': b'node', 'data': {}}
+    packet = CommandSendInstructionPacket(1, b'node', {}, b'extra')
+    assert packet.kwargs == {'command_id': 1, 'node': b'node', 'data': {}}
+    with pytest.raises(PacketFormatError) as e:
+        CommandSendInstructionPacket(1, b'node')
+    assert str(e.value).startswith("missing attribute 'data'")
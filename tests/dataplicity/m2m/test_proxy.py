@@ -0,0 +1,22 @@
+import os
+
+from dataplicity.m2m.proxy import Interceptor
+
+
+def test_fork_exits_child_if_exec_fails():
+    """ a child that fails to exec exits, rather than returning to the caller
+    """
+    interceptor = Interceptor()
+    pid = os.getpid()
+    try:
+        master_fd = interceptor.fork(['/nonexistent/command'])
+    finally:
+        if os.getpid() != pid:
+            # The child returned; exit so the test fails in the parent
+            os._exit(0)
+    try:
+        _pid, status = os.waitpid(interceptor.pid, 0)
+        assert os.WIFEXITED(status)
+        assert os.WEXITSTATUS(status) == 1
+    finally:
+        os.close(master_fd)
@@ -0,0 +1,133 @@
+import os
+import socket
+import threading
+
+import pytest
+
+from dataplicity.compat import selectors
+from dataplicity.m2m.reactor import Reactor
+
+
+@pytest.fixture
+def reactor():
+    reactor = Reactor()
+    yield reactor
+    reactor.close()
+
+
+def test_reader(reactor):
+    read_socket, write_socket = socket.socketpair()
+    received = []
+    done = threading.Event()
+
+    def on_readable():
+        data = read_socket.recv(1024)
+        received.append(data)
+        if not data:
+            reactor.remove_reader(read_socket.fileno())
+            done.set()
+
+    reactor.add_reader(read_socket.fileno(), on_readable)
+    write_socket.sendall(b'hello')
+    write_socket.close()
+    assert done.wait(5)
+    assert b''.join(received) == b'hello'
+    read_socket.close()
+
+
+def test_writer(reactor):
+    read_fd, write_fd = os.pipe()
+    done = threading.Event()
+
+    def on_writable():
+        reactor.remove_writer(write_fd)
+        done.set()
+
+    reactor.add_writer(write_fd, on_writable)
+    assert done.wait(5)
+    os.close(read_fd)
+    os.close(write_fd)
+
+
+def test_call_soon(reactor):
+    called = threading.Event()
+    threads = []
+
+    def callback(value):
+        threads.append(reactor.in_thread)
+        called.set()
+
+    reactor.call_soon(callback, 1)
+    assert called.wait(5)
+    assert threads == [True]
+    assert not reactor.in_thread
+
+
+def test_call_later(reactor):
+    calls = []
+    done = threading.Event()
+    timer = reactor.call_later(0.01, calls.append, 'cancelled')
+    timer.cancel()
+    reactor.call_later(0.05, done.set)
+    reactor.call_later(0.02, calls.append, 'called')
+    assert done.wait(5)
+    assert calls == ['called']
+
+
+def test_callback_errors_are_logged(reactor, caplog):
+    done = threading.Event()
+
+    def fail():
+        raise ValueError('fail')
+
+    reactor.call_soon(fail)
+    reactor.call_soon(done.set)
+    assert done.wait(5)
+    assert 'error in reactor callback' in caplog.text
+
+
+def test_close_without_start():
+    reactor = Reactor()
+    reactor.close()
+    reactor.call_soon(lambda: None)
+    assert reactor._thread is None
+
+
+def test_recovers_from_closed_fd(mocker, caplog):
+    """ if a registered fd is closed, select fails; the error is logged, the
+        fd's callback is called, and other fds are still serviced
+    """
+    mocker.patch(
+        'dataplicity.m2m.reactor.selectors.DefaultSelector',
+        selectors.SelectSelector,
+    )
+    reactor = Reactor()
+    try:
+        read_fd, write_fd = os.pipe()
+        closed = threading.Event()
+
+        def on_closed_readable():
+            reactor.remove_reader(read_fd)
+            closed.set()
+
+        reactor.add_reader(read_fd, on_closed_readable)
+        reactor.call_soon(os.close, read_fd)
+        assert closed.wait(5)
+        assert 'select failed' in caplog.text
+
+        # The reactor is still running
+        called = threading.Event()
+        reactor.call_later(0.01, called.set)
+        assert called.wait(5)
+        os.close(write_fd)
+    finally:
+        reactor.close()
+
+
+def test_timers_use_monotonic_clock(reactor, mocker):
+    """ timers aren't affected by changes to the wall clock
+    """
+    mocker.patch('dataplicity.m2m.reactor.time.time', return_value=0)
+    called = threading.Event()
+    reactor.call_later(0.01, called.set)
+    assert called.wait(5)
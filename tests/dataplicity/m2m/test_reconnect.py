@@ -0,0 +1,17 @@
+from dataplicity.m2m.reconnect import Backoff
+
+
+def test_backoff():
+    backoff = Backoff(base=1.0, max_wait=5.0, random=lambda: 1.0)
+    # first retry is immediate
+    assert backoff.get_wait() == 0.0
+    assert [backoff.get_wait() for _ in range(5)] == [1.0, 2.0, 4.0, 5.0, 5.0]
+    backoff.reset()
+    assert backoff.get_wait() == 0.0
+
+
+def test_backoff_jitter():
+    backoff = Backoff(base=1.0, max_wait=60.0)
+    backoff.get_wait()
+    for _ in range(20):
+        assert 0.0 <= backoff.get_wait() <= 60.0
@@ -0,0 +1,68 @@
+import time
+
+import pytest
+from dataplicity.m2m.ringbuffer import RingBuffer
+
+
+def test_ringbuffer_read_write():
+    ring = RingBuffer(8)
+    assert not ring
+    ring.write(b'hello')
+    assert len(ring) == 5
+    assert ring.read(2) == b'he'
+    ring.write(b'world')
+    # data wraps around the end of the buffer
+    assert ring.capacity == 8
+    assert len(ring) == 8
+    assert ring.read(100) == b'lloworld'
+    assert ring.read(1) == b''
+
+
+def test_ringbuffer_grows():
+    ring = RingBuffer(8)
+    ring.write(b'12345')
+    ring.read(3)
+    ring.write(b'abcdefghij')
+    assert ring.capacity == 16
+    assert ring.read(4) == b'45ab'
+    assert ring.read(100) == b'cdefghij'
+    # returns to initial capacity when empty
+    assert ring.capacity == 8
+
+
+def test_ringbuffer_readinto():
+    ring = RingBuffer(8)
+    ring.write(b'abcdef')
+    ring.read(4)
+    ring.write(memoryview(b'ghijkl'))
+    buffer = bytearray(6)
+    assert ring.readinto(buffer) == 6
+    assert buffer == b'efghij'
+    assert ring.readinto(buffer) == 2
+    assert buffer[:2] == b'kl'
+    assert ring.readinto(buffer) == 0
+
+
+@pytest.mark.parametrize('read_size', [1, 64, 1024, 64 * 1024])
+def test_ringbuffer_read_throughput(read_size):
+    """ benchmark reads from a 16MB backlog (run with -s to see throughput)
+    """
+    chunk = b'\xff' * (64 * 1024)
+    ring = RingBuffer()
+    for _ in range(256):
+        ring.write(chunk)
+    assert len(ring) == 16 * 1024 * 1024
+    iterations = min(256 * 1024, len(ring) // read_size)
+    buffer = bytearray(read_size)
+    start = time.time()
+    for _ in range(iterations):
+        ring.readinto(buffer)
+    elapsed = max(time.time() - start, 1e-9)
+    print(
+        "\n{} byte reads from 16MB: {:.0f} reads/s, {:.1f} MB/s".format(
+            read_size,
+            iterations / elapsed,
+            iterations * read_size / elapsed / (1024 * 1024),
+        )
+    )
+    assert len(ring) == 16 * 1024 * 1024 - iterations * read_size
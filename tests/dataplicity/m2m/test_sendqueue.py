@@ -0,0 +1,244 @@
+import threading
+import time
+
+from dataplicity.m2m import dataplane
+from dataplicity.m2m.packets import PacketType
+from dataplicity.m2m.sendqueue import PRIORITY_TERMINAL, SendQueue
+
+
+def test_batches():
+    send_queue = SendQueue()
+    for packet in (b'foo', b'bar', b'baz'):
+        assert send_queue.put(packet)
+    assert send_queue.depth == 3
+    assert send_queue.size == 9
+    assert send_queue.get(max_bytes=6) == [b'foo', b'bar']
+    assert send_queue.get(max_bytes=6) == [b'baz']
+    assert send_queue.size == 0
+
+
+def test_oversized_packet():
+    """ a packet larger than max_bytes is still returned on its own
+    """
+    send_queue = SendQueue()
+    send_queue.put(b'x' * 10)
+    send_queue.put(b'y')
+    assert send_queue.get(max_bytes=4) == [b'x' * 10]
+    assert send_queue.get(max_bytes=4) == [b'y']
+
+
+def test_timeout():
+    assert SendQueue().get(timeout=0.01) == []
+
+
+def test_wakes_writer():
+    send_queue = SendQueue()
+    batches = []
+    writer = threading.Thread(target=lambda: batches.append(send_queue.get(timeout=5)))
+    writer.start()
+    send_queue.put(b'hello')
+    writer.join()
+    assert batches == [[b'hello']]
+
+
+def test_close():
+    send_queue = SendQueue()
+    send_queue.put(b'foo')
+    send_queue.close()
+    assert send_queue.is_closed
+    assert not send_queue.put(b'bar')
+    assert send_queue.get(timeout=5) == []
+
+
+def test_stats():
+    send_queue = SendQueue()
+    send_queue.put(b'foo')
+    send_queue.put(b'barbaz')
+    assert send_queue.clear() == 2
+    send_queue.put(b'foo')
+    send_queue.get()
+    stats = send_queue.get_stats()
+    assert stats['depth'] == 0
+    assert stats['max_depth'] == 2
+    assert stats['sent_count'] == 1
+    assert stats['sent_bytes'] == 3
+    assert stats['max_latency'] >= stats['mean_latency'] >= 0
+
+
+def test_coalesce():
+    send_queue = SendQueue(coalesce_window=0.01, coalesce_bytes=8, max_delay=1.0)
+    send_queue.put_data(1, b'foo')
+    send_queue.put_data(2, b'bar')
+    send_queue.put_data(1, b'baz')
+    assert send_queue.get() == [
+        dataplane.encode(PacketType.request_send, 1, b'foobaz'),
+        dataplane.encode(PacketType.request_send, 2, b'bar'),
+    ]
+
+
+def test_coalesce_threshold():
+    """ data is sent without waiting once it reaches coalesce_bytes, along with
+    any other data that is waiting
+    """
+    send_queue = SendQueue(coalesce_window=10.0, coalesce_bytes=8, max_delay=10.0)
+    send_queue.put_data(1, b'foo')
+    send_queue.put_data(1, b'barbaz')
+    send_queue.put_data(1, b'qux')
+    start = time.time()
+    assert send_queue.get() == [
+        dataplane.encode(PacketType.request_send, 1, b'foobarbaz'),
+        dataplane.encode(PacketType.request_send, 1, b'qux'),
+    ]
+    assert time.time() - start < 1.0
+
+
+def test_coalesce_max_delay():
+    """ data is not delayed by more than max_delay
+    """
+    send_queue = SendQueue(coalesce_window=10.0, coalesce_bytes=1024, max_delay=0.01)
+    send_queue.put_data(1, b'foo')
+    start = time.time()
+    assert send_queue.get() == [dataplane.encode(PacketType.request_send, 1, b'foo')]
+    assert time.time() - start < 1.0
+
+
+def test_coalesce_preserves_order():
+    """ data written after another packet for the channel is not coalesced
+        with earlier data
+    """
+    send_queue = SendQueue(coalesce_window=0.01, coalesce_bytes=1024, max_delay=1.0)
+    send_queue.put_data(1, b'foo')
+    send_queue.put(b'packet', channel=1)
+    send_queue.put_data(1, b'bar')
+    assert send_queue.get() == [
+        dataplane.encode(PacketType.request_send, 1, b'foo'),
+        b'packet',
+        dataplane.encode(PacketType.request_send, 1, b'bar'),
+    ]
+
+
+def test_wait_drained():
+    send_queue = SendQueue()
+    send_queue.put_data(1, b'x' * 8)
+    send_queue.put_data(2, b'x' * 2)
+    assert send_queue.get_channel_size(1) == 8
+    assert send_queue.wait_drained(2, 8, 4, timeout=0)
+    assert not send_queue.wait_drained(1, 8, 4, timeout=0.01)
+
+    writer = threading.Thread(target=send_queue.get)
+    writer.start()
+    assert send_queue.wait_drained(1, 8, 4, timeout=5)
+    writer.join()
+    assert send_queue.get_channel_size(1) == 0
+
+
+def test_call_when_drained():
+    send_queue = SendQueue()
+    send_queue.put_data(1, b'x' * 8)
+    drained = []
+    send_queue.call_when_drained(2, 8, 4, lambda: drained.append(2))
+    assert drained == [2]
+    send_queue.call_when_drained(1, 8, 4, lambda: drained.append(1))
+    assert drained == [2]
+    send_queue.get()
+    assert drained == [2, 1]
+
+    # Callbacks are called when the channel is forgotten
+    send_queue.put_data(3, b'x' * 8)
+    send_queue.call_when_drained(3, 8, 4, lambda: drained.append(3))
+    send_queue.forget_channel(3)
+    assert drained == [2, 1, 3]
+
+
+def test_priority():
+    """ control packets are sent first, then terminal channels, then bulk
+    """
+    send_queue = SendQueue()
+    send_queue.set_channel_priority(2, PRIORITY_TERMINAL)
+    send_queue.put_data(1, b'bulk')
+    send_queue.put(b'control1', channel=1)
+    send_queue.put_data(2, b'terminal')
+    send_queue.put(b'pong')
+    assert send_queue.get() == [
+        b'pong',
+        dataplane.encode(PacketType.request_send, 2, b'terminal'),
+        dataplane.encode(PacketType.request_send, 1, b'bulk'),
+        b'control1',
+    ]
+
+
+def test_large_writes_are_split():
+    """ large writes are split, so higher priority packets don't wait for
+        the whole write
+    """
+    send_queue = SendQueue(max_packet_size=4)
+    send_queue.set_channel_priority(2, PRIORITY_TERMINAL)
+    send_queue.put_data(1, b'x' * 10)
+    send_queue.put_data(2, b'y')
+    assert send_queue.get(max_bytes=4) == [
+        dataplane.encode(PacketType.request_send, 2, b'y'),
+    ]
+    assert send_queue.get(max_bytes=4) == [
+        dataplane.encode(PacketType.request_send, 1, b'xxxx'),
+    ]
+    send_queue.put(b'ping')
+    assert send_queue.get(max_bytes=4) == [b'ping']
+    assert send_queue.get() == [
+        dataplane.encode(PacketType.request_send, 1, b'xxxx'),
+        dataplane.encode(PacketType.request_send, 1, b'xx'),
+    ]
+
+
+def test_channels_take_turns():
+    send_queue = SendQueue(max_packet_size=2)
+    send_queue.put_data(1, b'aaaa')
+    send_queue.put_data(2, b'bbbb')
+    assert send_queue.get() == [
+        dataplane.encode(PacketType.request_send, 1, b'aa'),
+        dataplane.encode(PacketType.request_send, 2, b'bb'),
+        dataplane.encode(PacketType.request_send, 1, b'aa'),
+        dataplane.encode(PacketType.request_send, 2, b'bb'),
+    ]
+
+
+def test_weighted_fair_share():
+    """ channels of the same priority share bandwidth according to weight
+    """
+    send_queue = SendQueue(max_packet_size=4)
+    send_queue.set_channel_weight(2, 3)
+    for _ in range(10):
+        send_queue.put_data(1, b'aaaa')
+        send_queue.put_data(2, b'bbbb')
+    batch = send_queue.get(max_bytes=4 * 8)
+    channel_1 = dataplane.encode(PacketType.request_send, 1, b'aaaa')
+    assert batch[:4] == [channel_1] + [
+        dataplane.encode(PacketType.request_send, 2, b'bbbb')
+    ] * 3
+    assert batch.count(channel_1) == 2
+    stats = send_queue.get_channel_stats()
+    assert stats[2] == 3 * stats[1]
+
+    assert send_queue.forget_channel(1) == stats[1]
+    assert 1 not in send_queue.get_channel_stats()
+
+
+def test_channel_latency():
+    send_queue = SendQueue()
+    assert send_queue.get_channel_latency(1) == 0.0
+    send_queue.put_data(1, b'hello')
+    now = time.time() + 2
+    assert send_queue.get_channel_latency(1, now=now) >= 1.9
+    send_queue.get()
+    assert send_queue.get_channel_latency(1, now=now) == 0.0
+
+
+def test_empty_data_is_ignored():
+    queue = SendQueue()
+    assert queue.put_data(1, b'')
+    assert queue.depth == 0
+    queue.put_data(1, b'abc')
+    assert queue.get(timeout=0.1) == [
+        dataplane.encode(PacketType.request_send, 1, b'abc')
+    ]
+    queue.close()
+    assert not queue.put_data(1, b'')
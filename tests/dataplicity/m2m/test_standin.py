@@ -0,0 +1,16 @@
+import pytest
+
+from dataplicity.m2m.standin import measure_packet_rate
+
+
+@pytest.mark.parametrize("batching", [True, False])
+def test_packet_rate(batching):
+    """ packets are sent as batches only if the server supports them
+    """
+    result = measure_packet_rate(count=500, batching=batching)
+    # A liveness ping may be sent while measuring
+    assert result['packets'] >= 500
+    if batching:
+        assert result['messages'] < 500
+    else:
+        assert result['messages'] == result['packets']
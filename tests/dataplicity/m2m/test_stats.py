@@ -0,0 +1,19 @@
+from dataplicity.m2m.stats import RollingHistogram
+
+
+def test_rolling_histogram():
+    histogram = RollingHistogram([1, 10], size=3)
+    assert histogram.get_stats()['mean'] is None
+    for value in (0.5, 5, 50, 1):
+        histogram.add(value)
+    # the first sample has rolled out
+    assert len(histogram) == 3
+    assert histogram.get_histogram() == [(1, 1), (10, 1), (None, 1)]
+    stats = histogram.get_stats()
+    assert stats['count'] == 3
+    assert stats['last'] == 1
+    assert stats['mean'] == 56 / 3.0
+    assert stats['median'] == 5
+    assert stats['p95'] == 50
+    histogram.clear()
+    assert histogram.get_histogram() == [(1, 0), (10, 0), (None, 0)]
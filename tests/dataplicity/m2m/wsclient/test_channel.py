@@ -24,6 +24,28 @@ class TestClient(object):
         """
         pass
 
+    def channel_control_write(self, number, control):
+        """ please refer to docstring of close_channel
+        """
+        pass
+
+    def wait_channel_writable(self, number, high_watermark, low_watermark, timeout):
+        """ please refer to docstring of close_channel
+        """
+        return True
+
+    def is_channel_writable(self, number, high_watermark):
+        """ please refer to docstring of close_channel
+        """
+        return True
+
+    def call_when_channel_writable(
+        self, number, high_watermark, low_watermark, callback
+    ):
+        """ please refer to docstring of close_channel
+        """
+        callback()
+
 
 @pytest.fixture
 def channel():
@@ -112,12 +134,11 @@ def test_channel_on_data(caplog, channel):
     chan.set_callbacks(on_data=None)
     # this returns true only when data_event is set.
     assert bool(chan) is False
-    assert chan.deque.count(data) == 0
+    assert chan.size == 0
     chan.on_data(data)
     # data_even should be set, because there was no callback registered to
     # handle on_data event
     assert bool(chan) is True
-    assert chan.deque.count(data) == 1
     assert chan.size == 3
 
 
@@ -189,6 +210,18 @@ def test_channel_read(channel):
     assert channel.read(1) == b''
 
 
+def test_channel_readinto(channel):
+    channel.on_data(b'\x01\x02\x03')
+    channel.on_data(memoryview(b'\x04\x05'))
+    buffer = bytearray(4)
+    assert channel.readinto(buffer) == 4
+    assert buffer == b'\x01\x02\x03\x04'
+    assert bool(channel) is True
+    assert channel.readinto(buffer) == 1
+    assert bool(channel) is False
+    assert channel.readinto(buffer, timeout=0.1, block=True) == 0
+
+
 def test_channel_write(channel, mocker):
     """ test code for channel::write
     """
@@ -203,3 +236,123 @@ def test_channel_write(channel, mocker):
     channel.write(data)
     assert channel.client.channel_write.call_args == call(
         channel.number, data)
+
+
+def test_channel_pauses_at_high_watermark(mocker):
+    """ buffering more than the high watermark sends a pause control, and
+        reading down to the low watermark sends a resume
+    """
+    channel = Channel(TestClient(), 123, high_watermark=8, low_watermark=4)
+    mocker.spy(channel.client, 'channel_control_write')
+    channel.on_data(b'abcd')
+    channel.on_data(b'efgh')
+    channel.on_data(b'ijkl')
+    assert channel.size == 12
+    assert channel.client.channel_control_write.call_args_list == [
+        call(123, {'type': 'pause'})
+    ]
+    channel.read(6)
+    assert channel.client.channel_control_write.call_count == 1
+    channel.read(2)
+    assert channel.size == 4
+    assert channel.client.channel_control_write.call_args_list == [
+        call(123, {'type': 'pause'}), call(123, {'type': 'resume'})
+    ]
+
+
+def test_channel_paused_by_remote(channel):
+    control_callback = Mock()
+    channel.set_callbacks(on_control=control_callback)
+    assert channel.wait_writable(timeout=0.1)
+
+    channel.on_control(b'{"type": "pause"}')
+    assert channel.is_paused
+    assert not channel.wait_writable(timeout=0.1)
+
+    channel.on_control(b'{"type": "resume"}')
+    assert not channel.is_paused
+    assert channel.wait_writable(timeout=0.1)
+
+    # flow control packets are not passed on
+    assert not control_callback.called
+
+
+def test_channel_wait_writable_returns_on_close(channel):
+    channel.on_control(b'{"type": "pause"}')
+    channel.on_close()
+    assert not channel.wait_writable()
+
+
+def test_channel_call_when_writable(channel):
+    callback = Mock()
+    assert channel.is_writable
+    channel.call_when_writable(callback)
+    assert callback.call_count == 1
+
+    channel.on_control(b'{"type": "pause"}')
+    assert not channel.is_writable
+    channel.call_when_writable(callback)
+    assert callback.call_count == 1
+
+    channel.on_control(b'{"type": "resume"}')
+    assert callback.call_count == 2
+
+
+def test_channel_call_when_writable_on_close(channel):
+    callback = Mock()
+    channel.on_control(b'{"type": "pause"}')
+    channel.call_when_writable(callback)
+    channel.on_close()
+    assert callback.call_count == 1
+    assert channel.is_writable
+
+
+def test_channel_pauses_with_data_callback(mocker):
+    """ data passed to a callback counts towards the high watermark until it
+        is released
+    """
+    channel = Channel(TestClient(), 123, high_watermark=8, low_watermark=4)
+    mocker.spy(channel.client, 'channel_control_write')
+    received = []
+    channel.set_callbacks(on_data=received.append, manual_release=True)
+    channel.on_data(b'abcd')
+    channel.on_data(memoryview(b'efgh'))
+    assert len(received) == 2
+    assert channel.pending == 8
+    assert channel.client.channel_control_write.call_args_list == [
+        call(123, {'type': 'pause'})
+    ]
+    channel.release(2)
+    assert channel.client.channel_control_write.call_count == 1
+    channel.release(2)
+    assert channel.pending == 4
+    assert channel.client.channel_control_write.call_args_list == [
+        call(123, {'type': 'pause'}), call(123, {'type': 'resume'})
+    ]
+
+
+def test_channel_data_written_by_callback_does_not_pause(mocker):
+    """ data that the callback has consumed by the time it returns doesn't
+        pause the channel, however large the packet
+    """
+    channel = Channel(TestClient(), 123, high_watermark=8, low_watermark=4)
+    mocker.spy(channel.client, 'channel_control_write')
+    received = []
+    channel.set_callbacks(on_data=received.append)
+    channel.on_data(b'abcdefghij')
+    channel.on_data(b'klmnopqrst')
+
+    def write_now(data):
+        received.append(data)
+        channel.release(len(data))
+
+    channel.set_callbacks(on_data=write_now, manual_release=True)
+    channel.on_data(b'abcdefghij')
+    assert len(received) == 3
+    assert channel.pending == 0
+    assert channel.client.channel_control_write.call_count == 0
+
+
+def test_channel_flow_control_from_memoryview(channel):
+    channel.on_control(memoryview(b'{"type": "pause"}'))
+    assert channel.is_paused
@@ -0,0 +1,285 @@
+import logging
+import os
+import time
+
+import pytest
+import six
+from lomond.compression import Deflate
+from mock import Mock
+from dataplicity import constants
+from dataplicity.m2m import bencode, dataplane
+from dataplicity.m2m.packets import PacketType
+from dataplicity.m2m.standin import StandInServer
+from dataplicity.m2m.wsclient import WSClient
+
+
+@pytest.fixture
+def client():
+    return WSClient(None, 'ws://localhost/', None)
+
+
+def test_route_data_is_not_copied(client):
+    """ route payloads should reach the channel as a view of the frame
+    """
+    received = []
+    channel = client.get_channel(5)
+    channel.set_callbacks(on_data=received.append)
+
+    frame = bencode.encode([PacketType.route.value, 5, b'hello'])
+    client.on_binary(frame)
+
+    data, = received
+    assert isinstance(data, memoryview)
+    if not six.PY2:
+        # Python 2 memoryviews don't reference their object
+        assert data.obj is frame
+    assert data == b'hello'
+
+
+def test_route_data_buffered_in_channel(client):
+    """ route payloads buffered in a channel are returned as bytes by read
+    """
+    client.on_binary(bencode.encode([PacketType.route.value, 5, b'hello']))
+    client.on_binary(bencode.encode([PacketType.route.value, 5, b'world']))
+    assert client.get_channel(5).read(8) == b'hellowor'
+
+
+def test_channel_write_sends_request_send(client):
+    client.get_channel(5).write(b'hello')
+    assert client.send_queue.get() == [
+        bencode.encode([PacketType.request_send.value, 5, b'hello'])
+    ]
+
+
+def test_channel_writes_are_coalesced(client):
+    channel = client.get_channel(5)
+    channel.write(b'hello')
+    channel.write(b' world')
+    channel.send_control({'type': 'x'})
+    channel.write(b'!')
+    assert client.send_queue.get() == [
+        bencode.encode([PacketType.request_send.value, 5, b'hello world']),
+        bencode.encode([PacketType.request_send_control.value, 5, b'{"type": "x"}']),
+        bencode.encode([PacketType.request_send.value, 5, b'!']),
+    ]
+
+
+def test_route_control(client):
+    """ control payloads are delivered as bytes
+    """
+    received = []
+    client.get_channel(5).set_callbacks(on_control=received.append)
+    client.on_binary(
+        bencode.encode([PacketType.route_control.value, 5, b'{"type": "x"}'])
+    )
+    assert received == [b'{"type": "x"}']
+    assert isinstance(received[0], bytes)
+
+
+def test_oversized_packets_are_rejected(client, mocker, caplog):
+    mocker.patch('dataplicity.constants.M2M_MAX_PACKET_SIZE', 16)
+    on_packet = mocker.patch.object(client, 'on_packet')
+    client.on_binary(bencode.encode([PacketType.route.value, 5, b'x' * 16]))
+    assert not on_packet.called
+    assert 'MAX_SIZE_REACHED' in caplog.text
+
+
+def test_route_packets_bypass_dispatcher(client, mocker):
+    dispatch = mocker.patch.object(client.dispatcher, 'dispatch')
+    received = []
+    client.get_channel(5).set_callbacks(
+        on_data=received.append, on_control=received.append
+    )
+    client.on_packet([PacketType.route.value, 5, b'data'])
+    client.on_packet([PacketType.route_control.value, 5, b'control'])
+    assert received == [b'data', b'control']
+    assert not dispatch.called
+
+    # badly formatted route packets are left to the dispatcher
+    client.on_packet([PacketType.route.value, b'5', b'data'])
+    client.on_packet([PacketType.route.value, 5])
+    assert dispatch.call_count == 2
+
+
+def test_send_bytes_is_queued(client):
+    assert client.send_bytes(b'foo')
+    assert client.send_queue.get() == [b'foo']
+    client.send_queue.close()
+    assert not client.send_bytes(b'bar')
+
+
+def test_write_packets_batches_frames(client, mocker):
+    """ queued packets are written as websocket frames in a single write
+    """
+    session = mocker.patch.object(client.websocket.state, 'session')
+    assert client.write_packets([(None, b'foo'), (5, b'barbaz')])
+    (data,), _ = session.write.call_args
+    # Each small masked frame has a 6 byte header
+    assert session.write.call_count == 1
+    assert len(data) == (6 + 3) + (6 + 6)
+    assert six.indexbytes(data, 0) == six.indexbytes(data, 9) == 0x82
+
+
+def test_writer_survives_errors(client, mocker):
+    """ an error getting or writing packets doesn't stop the writer thread
+    """
+    calls = []
+
+    def get_packets(**kwargs):
+        calls.append(kwargs)
+        if len(calls) == 1:
+            raise ValueError('fail')
+        client.send_queue.close()
+        return []
+
+    mocker.patch.object(client.send_queue, 'get_packets', side_effect=get_packets)
+    client.run_writer()
+    assert len(calls) == 2
+
+
+def test_control_packets_sent_before_channel_data(client):
+    channel = client.get_channel(5)
+    channel.write(b'hello')
+    channel.close()
+    client.send('pong', data=b'ping')
+    assert client.send_queue.get() == [
+        bencode.encode([PacketType.pong.value, b'ping']),
+        bencode.encode([PacketType.request_send.value, 5, b'hello']),
+        bencode.encode([PacketType.request_close.value, 5]),
+    ]
+
+
+def test_write_packets_skips_incompressible_data(client, mocker):
+    """ data that doesn't compress well is sent without compression
+    """
+    session = mocker.patch.object(client.websocket.state, 'session')
+    client.websocket.state.compression = Deflate(15, 15, False, False)
+    text = b'hello, world ' * 100
+    noise = os.urandom(len(text))
+    assert client.write_packets([(5, text), (6, noise)])
+    (data,), _ = session.write.call_args
+    # Compressed frames have the rsv1 bit set
+    assert six.indexbytes(data, 0) == 0x82 | 0x40
+    stats = client.compression_policy.get_stats()
+    assert stats[5]['skipped'] == 0
+    assert stats[5]['ratio'] < 0.5
+    assert stats[6]['skipped'] == 1
+    assert stats[6]['ratio'] == 1.0
+
+
+def test_ping_rtt(client, mocker):
+    client.check_liveness()
+    ping, = client.send_queue.get()
+    packet_type, data = bencode.decode(ping)
+    assert packet_type == PacketType.ping.value
+    # no ping until the interval has passed
+    client.check_liveness()
+    assert client.send_queue.depth == 0
+
+    mocker.patch('time.time', return_value=float(data) + 0.25)
+    client.on_packet([PacketType.pong.value, data])
+    stats = client.get_rtt_stats()
+    assert stats['count'] == 1
+    assert abs(stats['last'] - 0.25) < 1e-3
+
+
+def test_stats_logged_periodically(client, mocker, caplog):
+    caplog.set_level(logging.DEBUG, logger='m2m')
+    mocker.patch.object(constants, 'M2M_STATS_INTERVAL', 60)
+    channel = client.get_channel(5)
+    channel.write(b'hello')
+    client.send_queue.get_packets()
+    client.check_stats()
+    assert 'stats:' not in caplog.text
+
+    client.last_stats_time -= 60
+    client.check_stats()
+    for name in (
+        'rtt',
+        'resume',
+        'send_queue',
+        'channel_sent',
+        'compression',
+        'callbacks',
+        'chunk_size',
+    ):
+        assert '{} stats:'.format(name) in caplog.text
+    assert client.get_stats()['channel_sent'] == {5: 5}
+
+
+def test_reconnect_when_server_silent(mocker):
+    mocker.patch.object(constants, 'MAX_TIME_SINCE_LAST_PACKET', 1.0)
+    with StandInServer() as server:
+        client = WSClient(Mock(), server.url, None)
+        client.start()
+        try:
+            # The stand-in sends nothing after the welcome, so the client
+            # should drop the connection at the next poll and reconnect
+            start = time.time()
+            while len(server.connections) < 2 and time.time() - start < 30:
+                time.sleep(0.1)
+            assert len(server.connections) >= 2
+            assert server.connections[0].closed
+        finally:
+            client.close()
+            client.join(10)
+
+
+def test_session_resumed_after_disconnect(client, mocker):
+    client.identity = 'device-uuid'
+    mocker.patch('time.time', return_value=1000.0)
+    client.on_disconnected()
+    assert client.identity == 'device-uuid'
+
+    client.on_ready()
+    request, = client.send_queue.get()
+    packet_type, uuid = bencode.decode(request)
+    assert packet_type == PacketType.request_identify.value
+    assert uuid == b'device-uuid'
+
+    client.backoff.get_wait()
+    mocker.patch('time.time', return_value=1001.5)
+    client.on_packet([PacketType.welcome.value])
+    assert client.backoff.attempts == 0
+    stats = client.get_resume_stats()
+    assert stats['count'] == 1
+    assert stats['last'] == 1.5
+
+
+def test_response_callbacks(client):
+    results = []
+    client.add_callback(1, results.append)
+    client.add_callback(2, results.append)
+    client.on_packet([PacketType.response.value, 1, {b'foo': 1}])
+    assert results == [{b'foo': 1}]
+    client.on_disconnected()
+    assert results == [{b'foo': 1}, None]
+    assert client.get_callback_stats()['outstanding'] == 0
+    client.callbacks.close()
+
+
+def test_batch_received(client):
+    assert not client.peer_batching
+    client.on_binary(dataplane.encode_batch([
+        dataplane.encode(PacketType.route, 1, b'foo'),
+        bencode.encode([PacketType.pong.value, b'1']),
+        dataplane.encode_batch([]),
+    ]))
+    assert client.get_channel(1).read(10) == b'foo'
+    assert client.get_rtt_stats()['count'] == 1
+    assert client.peer_batching
+    client.on_disconnected()
+    assert not client.peer_batching
+
+
+def test_write_packets_sends_batches(client, mocker):
+    """ packets are combined in to batch packets if the server supports them
+    """
+    session = mocker.patch.object(client.websocket.state, 'session')
+    client.peer_batching = True
+    packets = [(None, b'li7ee'), (5, b'li5ei5e3:fooe')]
+    assert client.write_packets(packets)
+    (data,), _ = session.write.call_args
+    batch = dataplane.encode_batch([packet for _, packet in packets])
+    assert len(data) == 6 + len(batch)
+    assert six.indexbytes(data, 0) == 0x82
@@ -0,0 +1,42 @@
+import subprocess
+import sys
+
+import pytest
+
+from dataplicity.loadtest import LoadTest, format_results
+
+
+@pytest.mark.parametrize("engine", ["threads", "asyncio"])
+def test_load_test(engine):
+    """ port forwards, files and commands run through a stand-in server
+    """
+    if engine == "asyncio" and sys.version_info < (3, 7):
+        pytest.skip("the asyncio engine requires Python 3.7+")
+    load_test = LoadTest(
+        terminals=0,
+        portforwards=2,
+        files=2,
+        commands=2,
+        size=64 * 1024,
+        timeout=20,
+        engine=engine,
+    )
+    results = load_test.run()
+    for name in ("portforward", "file", "command"):
+        workload = results["workloads"][name]
+        assert workload["errors"] == 0
+        assert workload["operations"] == 2
+        assert workload["bytes"] == 2 * 64 * 1024
+    assert "portforward" in format_results(results)
+
+
+def test_app_does_not_import_load_test():
+    """ the harness and stand-in server are only imported by the loadtest
+        sub-command when it runs
+    """
+    code = (
+        "import sys, dataplicity.app; "
+        "assert 'dataplicity.loadtest' not in sys.modules; "
+        "assert 'dataplicity.m2m.standin' not in sys.modules"
+    )
+    subprocess.check_call([sys.executable, "-c", code])
@@ -1,10 +1,14 @@
+import socket
+import threading
+
 import pytest
-from mock import call, patch
+from mock import Mock, call, patch
 
 from dataplicity import constants, remote_directory
 from dataplicity.limiter import Limiter
+from dataplicity.m2m.wsclient import Channel
 from dataplicity.m2mmanager import M2MManager
-from dataplicity.portforward import PortForwardManager
+from dataplicity.portforward import Connection, PortForwardManager
 
 _weakref_table = {}
 
@@ -85,3 +89,35 @@ def test_that_using_empty_service_and_port_raises(manager, limiter):
     with pytest.raises(ValueError):
         route = ('localhost', 22, 'example.com', None)
         manager.open_service(limiter, None, route)
+
+
+def test_connection_releases_data_once_written(limiter):
+    """ channel data counts towards the high watermark until it has been
+        written to the socket
+    """
+    client = Mock()
+    channel = Channel(client, 1234, high_watermark=8, low_watermark=4)
+    connection = Connection(limiter, Mock(), threading.Event(), channel, None)
+    channel.on_data(b'abcd')
+    channel.on_data(b'efgh')
+    assert channel.pending == 8
+    assert client.channel_control_write.call_args_list == [
+        call(1234, {'type': 'pause'})
+    ]
+
+    local, remote = socket.socketpair()
+    try:
+        connection.socket = local
+        connection._flush_buffer()
+        assert remote.recv(16) == b'abcdefgh'
+        assert channel.pending == 0
+        assert client.channel_control_write.call_args_list == [
+            call(1234, {'type': 'pause'}), call(1234, {'type': 'resume'})
+        ]
+        # Once connected, data written immediately doesn't pause the channel
+        channel.on_data(b'0123456789')
+        assert remote.recv(16) == b'0123456789'
+        assert client.channel_control_write.call_count == 2
+    finally:
+        local.close()
+        remote.close()